@@ -1,10 +1,31 @@
 # Possible types
+#
+# Each type carries an index of its place in the hierarchy, computed
+# from its parent's when the type is created (so once per compile):
+# its depth, its ancestors, and a flattened method table giving the
+# class that defines each of its methods, inherited or its own.
+# Common ancestors are memoized.  Methods are added to a class before
+# any of its subclasses are declared.  Each type also knows its direct
+# subclasses, for class hierarchy analysis of calls.
 class Type:
     def __init__(self, name, parent, methods, props):
         self.name = name
         self.parent = parent
         self.methods = methods
         self.props = props
+        self.subclasses = []
+        self.imported = False # Built by another program (see driver.py)
+        if parent is None:
+            self.ancestors = (self,)
+            self.method_table = {}
+        else:
+            self.ancestors = (self,) + parent.ancestors
+            self.method_table = dict(parent.method_table)
+            parent.subclasses.append(self)
+        self.depth = len(self.ancestors) - 1
+        for method in methods:
+            self.method_table[method] = self
+        self.common_ancestors = {}
 
     def __str__(self):
         return f"{self.name.upper()}"
@@ -12,20 +33,43 @@ class Type:
     def __repr__(self):
         return f"Type({self.name}, {self.parent}, {self.methods}, {self.props})"
 
+    def add_method(self, method):
+        self.methods[method.name] = method
+        self.method_table[method.name] = self
+
+    def find_method(self, name):
+        """The class that defines method 'name' for this type, or None"""
+        return self.method_table.get(name)
+
+    def overridden(self, name):
+        """Does a subclass of this type (known so far) define method 'name'?"""
+        return any(sub.find_method(name) is sub or sub.overridden(name)
+                   for sub in self.subclasses)
+
+    def ancestor(self, depth):
+        """The ancestor of this type at the given depth (0 is the root)"""
+        return self.ancestors[self.depth - depth]
+
     # Find common ancestor when you have more than one type
     def get_common_ancestor(self, other):
-        type1 = self
-        type2 = other
-        while type1.name != type2.name:
-            if type1.name == "Obj" and type2.name == "Obj":
-                break
-            elif type2.name == "Obj":
-                type1 = type1.parent
-                type2 = other
+        common = self.common_ancestors.get(other)
+        if common is None:
+            # Ancestors at the same depth agree down to the
+            # common ancestor, and differ below it
+            low, high = 0, min(self.depth, other.depth)
+            if self.ancestor(0).name != other.ancestor(0).name:
+                common = Obj # Unrelated roots; everything is an Obj
             else:
-                type2 = type2.parent
-
-        return type1
+                while low < high:
+                    mid = (low + high + 1) // 2
+                    if self.ancestor(mid).name == other.ancestor(mid).name:
+                        low = mid
+                    else:
+                        high = mid - 1
+                common = self.ancestor(low)
+            self.common_ancestors[other] = common
+            other.common_ancestors[self] = common
+        return common
 
 # Holds information about methods on classes 
 class Method():
@@ -62,3 +106,11 @@ types = {
         "Boolean": Boolean,
         "Nothing": Nothing
         }
+
+# Names of the types every program starts with; user classes are added to
+# the types dict as they are compiled
+BUILTIN_TYPES = frozenset(types)
+
+# Builtin types that classes may not extend, so calls on them
+# always reach the method of the type itself
+FINAL_TYPES = frozenset(["Int", "String", "Boolean", "Nothing"])
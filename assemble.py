@@ -12,12 +12,20 @@ There are two approaches to "resolving" labels:
 """
 
 import re
+import os
 import sys
+import string
 import json
+import struct
+import shutil
+import tempfile
+import concurrent.futures
 from pathlib import Path
 import argparse
 import configparser
-from typing import Dict, List,  Optional, Tuple
+from typing import BinaryIO, Dict, Iterable, Iterator, List,  Optional, Set, Tuple
+
+import ir
 
 import logging
 logging.basicConfig()
@@ -41,13 +49,36 @@ CONFIG = Configuration()  # Visible from any code
 
 def cli() -> object:
     parser = argparse.ArgumentParser(
-        description="Assemble tiny virtual machine module"
-                    "into JSON-formatted object code"
+        description="Assemble tiny virtual machine modules "
+                    "into binary (.tvm) or JSON-formatted object code",
+        usage="%(prog)s source [target]\n"
+              "       %(prog)s --stream source target.tvm\n"
+              "       %(prog)s [--obj DIR] [-j JOBS] [--json] source.asm source.asm ..."
     )
-    parser.add_argument("source", type=argparse.FileType("r"))
-    parser.add_argument("target", type=argparse.FileType("w"),
-                        nargs="?", default=sys.stdout)
-    return parser.parse_args()
+    parser.add_argument("files", nargs="+", type=Path,
+                        help="One source and its object file, binary if its suffix "
+                             "is .tvm (default JSON on standard output); or "
+                             "several .asm sources, assembled into the object directory")
+    parser.add_argument("--obj", type=Path,
+                        help="Assemble every source into this object directory "
+                             "(default the TVMLIB of asm.conf)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="Worker processes for assembling several sources "
+                             "(default: number of cpus)")
+    parser.add_argument("--json", action="store_true",
+                        help="Also write each object file as json, for debugging")
+    parser.add_argument("--stream", action="store_true",
+                        help="Assemble one source into a .tvm target a method at a time, "
+                             "in memory proportional to the largest method")
+    args = parser.parse_args()
+    args.batch = args.obj is not None or (
+        len(args.files) > 1 and all(path.suffix == ".asm" for path in args.files))
+    if not args.batch and len(args.files) > 2:
+        parser.error("expected source [target], or .asm sources")
+    if args.stream and (args.batch or len(args.files) != 2
+                        or args.files[1].suffix != OBJ_SUFFIX):
+        parser.error(f"--stream expects one source and a {OBJ_SUFFIX} target")
+    return args
 
 
 # ----------------
@@ -58,11 +89,11 @@ def cli() -> object:
 #
 class ImportedModule:
     """Imported module uses information from
-    json file
+    its object file (.tvm or json), or from an object code
+    structure assembled earlier in the same process.
     """
-    def __init__(self, path: Path):
-        with open(path, "r") as source:
-            self.json = json.load(source)
+    def __init__(self, struct: dict):
+        self.json = struct
         # Dict from name to position would be faster, but
         # number of lookups is very small
         self.methods: List[str] = self.json["methods"]
@@ -80,18 +111,39 @@ class ImportedModule:
     def field_slot(self, name: str) -> int:
         return self.fields.index(name)
 
+    @classmethod
+    def load(cls, path: Path) -> "ImportedModule":
+        if path.suffix == OBJ_SUFFIX:
+            return cls(read_binary(path.read_bytes()))
+        with open(path, "r") as source:
+            return cls(json.load(source))
+
 
-IMPORTS: Dict[str, Optional[ImportedModule]] = { "$": None }
-# $ will be replaced by current class name in output .json file
+# Modules read so far, shared by every module assembled in this process.
+# The "imports" list of each object file is kept by its ObjectCode.
+IMPORTS: Dict[str, ImportedModule] = {}
 
 
 def import_module(module: str) -> ImportedModule:
+    """The module's binary object file, or its json (as for the stubs
+    of the builtin classes) if it has none
+    """
     if module not in IMPORTS:
-        path = CONFIG.tvmlib.joinpath(module).with_suffix(".json")
-        IMPORTS[module] = ImportedModule(path)
+        path = CONFIG.tvmlib.joinpath(module).with_suffix(OBJ_SUFFIX)
+        if not path.exists():
+            path = path.with_suffix(".json")
+        IMPORTS[module] = ImportedModule.load(path)
     return IMPORTS[module]
 
 
+def register_module(objcode: "ObjectCode"):
+    """Make a module assembled in this process importable
+    by modules assembled after it, without reading it back
+    from its object file.
+    """
+    IMPORTS[objcode.class_name] = ImportedModule(objcode.struct())
+
+
 # The named literals MUST match the definitions
 # in vm_loader.h for CODE_NOTHING, etc
 # #define CODE_NOTHING  (-1)
@@ -104,6 +156,11 @@ NAMED_LITERALS = {
     "true": -3
 }
 
+# The operand of call_direct packs the index of the method's class
+# in the imports list and the method's slot in its vtable.  This MUST
+# match DIRECT_CALL_SHIFT in vm_loader.h
+DIRECT_CALL_SHIFT = 16
+
 # ----------------
 #  The instruction set of the machine and the numeric
 #  encoding of instructions must be consistent between
@@ -210,6 +267,11 @@ class Instruction:
 #
 UNRESOLVED_ADDRESS = -42  # Just an easily recognized value
 
+# Operations whose operand is a label, resolved to a relative jump
+JUMP_OPS = ["jump", "jump_if", "jump_ifnot",
+            "jump_int_less", "jump_int_greater", "jump_int_le",
+            "jump_int_ge", "jump_int_equals", "jump_int_ne"]
+
 
 class ObjectCode:
     def __init__(self):
@@ -218,8 +280,14 @@ class ObjectCode:
         self.super_name: str = ""
         self.method_list: List[str] = []
         self.field_list: List[str] = []
-        # Constant pool
-        self.constants: List[Tuple[str, int]] = []
+        # Classes referenced by index in new and is_instance;
+        # $ will be replaced by current class name in the output object file
+        self.imports: List[str] = ["$"]
+        # Constant pool, each literal once:  the index
+        # of each constant by (kind, value), so that the Int 1 and
+        # the String "1" are different constants
+        self.constants: List[Dict[str, str]] = []
+        self.constant_index: Dict[Tuple[str, str], int] = {}
         # Method code (instructions)
         self.code = []  # Will expand to code per method
         # For each method defined here, we want its
@@ -243,9 +311,9 @@ class ObjectCode:
         # Methods and field list are initially those
         # we inherit, but may be extended elsewhere
         # in the assembly code
-        self.method_list = super_module.methods
+        self.method_list = list(super_module.methods)
         self.n_inherited = len(super_module.methods)
-        self.field_list = super_module.fields
+        self.field_list = list(super_module.fields)
         # AND we need to be able to refer to this class in NEW
 
     def declare_field(self, name: str):
@@ -269,7 +337,7 @@ class ObjectCode:
         # it's not filled in later in the code.
 
     def begin_method(self, method_name: str):
-        self.resolve_jumps()  # Of preceding method!
+        self.end_method()  # The preceding method!
         # And then re-initialize tables
         # label -> address
         self.labels: Dict[str, int] = {}
@@ -285,6 +353,10 @@ class ObjectCode:
         self.method_code.append({"name": method_name, "slot": method_slot,
                                  "code": self.code})
 
+    def end_method(self):
+        """The code of the current method is complete"""
+        self.resolve_jumps()
+
     def declare_locals(self, method_locals: List[str]):
         """Map local variable names to position in activation record"""
         self.method_locals = method_locals
@@ -317,7 +389,7 @@ class ObjectCode:
         """Resolve "Class:method" to slot number"""
         class_name, method_name = full_name.split(":")
         try:
-            if class_name == "$":
+            if class_name in ["$", self.class_name]:
                 # This class
                 method_slot = self.method_list.index(method_name)
             else:
@@ -333,7 +405,7 @@ class ObjectCode:
         """Resolve Class:field to slot number"""
         class_name, field_name = full_name.split(":")
         try:
-            if class_name == "$":
+            if class_name in ["$", self.class_name]:
                 # This class
                 field_slot = self.field_list.index(field_name)
             else:
@@ -346,8 +418,12 @@ class ObjectCode:
         return field_slot
 
     def resolve_class(self, class_name: str) -> int:
-        import_module(class_name)  # In case we need to
-        index = list(IMPORTS).index(class_name)
+        if class_name == self.class_name:
+            return 0
+        if class_name not in self.imports:
+            import_module(class_name)  # In case we need to
+            self.imports.append(class_name)
+        index = self.imports.index(class_name)
         return index
 
     def resolve_jumps(self):
@@ -383,7 +459,7 @@ class ObjectCode:
             # Address of next instruction
             self.labels[instr.label] = len(self.code)
         self.code.append(instr.operation.code)
-        if instr.operand:
+        if instr.operand is not None:
             # Many operands require interpretation
             # that depends on the operation
             op_value = self.encode_operand(instr)
@@ -403,20 +479,32 @@ class ObjectCode:
             # in the loader.
             if operand in NAMED_LITERALS:
                 return NAMED_LITERALS[operand]
-            if re.match("[0-9]+", operand):
+            # Integers start with a digit or -digit; strings with a quote
+            first = operand[1:2] if operand[:1] == "-" else operand[:1]
+            if first and first in string.digits:
                 kind = "i"
-            elif re.match('["][^"]*["]', operand):
+            elif operand[:1] == '"' and operand.find('"', 1) > 0:
                 kind = "s"
                 operand = operand.strip("\"").\
                     encode("utf-8").decode("unicode_escape")
             else:
                 log.error(f"Could not type operand '{operand}'")
                 kind = "BOGUS CONSTANT"
-            self.constants.append({"kind": kind, "value": operand})
-            return len(self.constants) - 1
+            key = (kind, operand)
+            if key not in self.constant_index:
+                self.constant_index[key] = len(self.constants)
+                self.constants.append({"kind": kind, "value": operand})
+            return self.constant_index[key]
         if op == "call":
             slot = self.resolve_call(operand)
             return slot
+        if op == "call_direct":
+            # The loader resolves class and slot to the method's code
+            class_name = operand.split(":")[0]
+            if class_name == "$":
+                class_name = self.class_name
+            slot = self.resolve_call(operand)
+            return (self.resolve_class(class_name) << DIRECT_CALL_SHIFT) + slot
         if op in ["load_field", "store_field"]:
             # These operations use indexes into the fields of an object
             slot = self.resolve_field(operand)
@@ -431,7 +519,7 @@ class ObjectCode:
             # These operations have integer operands that should be
             # resolved by the compiler
             return int(operand)
-        if op in ["jump", "jump_if", "jump_ifnot"]:
+        if op in JUMP_OPS:
             # Operand is a label, which we may not have seen yet.
             # Leave it to be patched in the final label resolution step
             self.label_patch[len(self.code)] = operand
@@ -439,11 +527,11 @@ class ObjectCode:
         # Match should be exhaustive
         log.error(f"Unhandled operand type for {instr}")
 
-    def json(self) -> str:
-        struct = {
+    def struct(self) -> dict:
+        return {
             "class_name": self.class_name,
             "super": self.super_name,
-            "imports": [self.class_name] + list(IMPORTS)[1:],
+            "imports": [self.class_name] + self.imports[1:],
             "methods": self.method_list,
             "fields": self.field_list,
             # It's just simpler to count fields and methods
@@ -455,12 +543,152 @@ class ObjectCode:
             "constants": self.constants,
             "code": self.method_code
         }
-        return json.dumps(struct, indent=4)
+
+    def json(self) -> str:
+        return json.dumps(self.struct(), indent=4)
+
+    def binary(self) -> bytes:
+        """The object code in the binary format (see OBJ_MAGIC)"""
+        words = []
+        table = []
+        for method in self.method_code:
+            table.append((method["name"], method["slot"], len(words), len(method["code"])))
+            words.extend(method["code"])
+        return self.binary_head(table, len(words)) + struct.pack(f"<{len(words)}i", *words)
+
+    def binary_head(self, table: List[Tuple[str, int, int, int]], n_words: int) -> bytes:
+        """The binary format up to the code array, given the name, slot,
+        start and length of each method defined and the words of code
+        """
+        obj = self.struct()
+        parts = [OBJ_MAGIC,
+                 struct.pack("<8i", OBJ_VERSION, len(obj["imports"]), obj["n_methods"],
+                             obj["n_fields"], obj["n_inherited"], len(obj["constants"]),
+                             len(table), n_words),
+                 pack_string(obj["class_name"]), pack_string(obj["super"])]
+        for name in obj["imports"] + obj["methods"] + obj["fields"]:
+            parts.append(pack_string(name))
+        for constant in obj["constants"]:
+            parts += [pack_string(constant["value"]), INT32.pack(ord(constant["kind"][0]))]
+        for name, slot, start, length in table:
+            parts += [pack_string(name), struct.pack("<3i", slot, start, length)]
+        return b"".join(parts)
 
     def __str__(self) -> str:
         return self.json()
 
 
+class StreamingObjectCode(ObjectCode):
+    """Object code that keeps one method's code in memory:  as each
+    method is completed (its jumps resolved), its code is written to
+    a spool file and only its entry in the method table is kept.
+    write_binary then writes the object file, with the code from the
+    spool.  Memory is proportional to the largest method rather than
+    to the class.
+    """
+    def __init__(self, spool: BinaryIO):
+        super().__init__()
+        self.spool = spool
+        # name, slot, start and length of each method defined
+        self.method_table: List[Tuple[str, int, int, int]] = []
+        self.n_words = 0
+
+    def begin_method(self, method_name: str):
+        super().begin_method(method_name)
+        method = self.method_code.pop()
+        self.method_table.append((method["name"], method["slot"], self.n_words, 0))
+
+    def end_method(self):
+        super().end_method()
+        if not self.method_table or not self.code:
+            return
+        self.spool.write(struct.pack(f"<{len(self.code)}i", *self.code))
+        name, slot, start, _ = self.method_table[-1]
+        self.method_table[-1] = (name, slot, start, len(self.code))
+        self.n_words += len(self.code)
+        self.code = []
+
+    def write_binary(self, out: BinaryIO):
+        """Write the object code in the binary format"""
+        out.write(self.binary_head(self.method_table, self.n_words))
+        self.spool.seek(0)
+        shutil.copyfileobj(self.spool, out)
+
+
+# ----------------
+# Binary object files (.tvm), which the loader maps into memory
+# and reads in place, without building a parse tree.  Numbers are
+# 32 bit little-endian integers.  A string is its length in bytes,
+# then its UTF-8 bytes and a NUL, padded with NULs to a multiple of
+# 4 bytes (so the loader can use it where it lies, and every number
+# is aligned).  In order:
+#
+#    magic (4 bytes), version
+#    counts: imports, methods, fields, inherited methods,
+#            constants, methods defined, words of code
+#    class name, superclass name            (strings)
+#    imports, methods, fields               (strings, in the counts above)
+#    constants:  value (string), kind (ord('i') or ord('s'))
+#    methods defined:  name (string), vtable slot, start and
+#                      length in the code array
+#    code array:  all the methods' code, one word each
+#
+# OBJ_MAGIC and OBJ_VERSION MUST match vm_loader.h; change the
+# version with the format.
+#
+OBJ_MAGIC = b"TVMO"
+OBJ_VERSION = 1
+OBJ_SUFFIX = ".tvm"
+INT32 = struct.Struct("<i")
+
+
+def pack_string(text: str) -> bytes:
+    data = text.encode("utf-8")
+    padded = (len(data) + 4) & ~3   # Room for the NUL
+    return INT32.pack(len(data)) + data + bytes(padded - len(data))
+
+
+def read_binary(data: bytes) -> dict:
+    """The structure (as ObjectCode.struct) of a binary object file"""
+    if data[:4] != OBJ_MAGIC:
+        raise ValueError("Not a binary object file")
+    (version, n_imports, n_methods, n_fields, n_inherited,
+     n_constants, n_code, n_words) = struct.unpack_from("<8i", data, 4)
+    if version != OBJ_VERSION:
+        raise ValueError(f"Object file version {version}, expected {OBJ_VERSION}")
+    pos = 36
+    unpack_int = INT32.unpack_from
+
+    def strings(n: int, words_after: int = 0) -> list:
+        """n strings, each followed by words_after numbers"""
+        nonlocal pos
+        read = []
+        after = struct.Struct(f"<{words_after}i")
+        for _ in range(n):
+            length, = unpack_int(data, pos)
+            start = pos + 4
+            pos = start + ((length + 4) & ~3)
+            read.append((data[start:start + length].decode("utf-8"),
+                         after.unpack_from(data, pos)))
+            pos += after.size
+        return read
+
+    names = [name for name, _ in strings(2 + n_imports + n_methods + n_fields)]
+    obj = {"class_name": names[0], "super": names[1]}
+    names = names[2:]
+    obj["imports"] = names[:n_imports]
+    obj["methods"] = names[n_imports:n_imports + n_methods]
+    obj["fields"] = names[n_imports + n_methods:]
+    obj.update(n_fields=n_fields, n_methods=n_methods, n_inherited=n_inherited)
+    obj["constants"] = [{"kind": chr(kind), "value": value}
+                        for value, (kind,) in strings(n_constants, 1)]
+    table = strings(n_code, 3)
+    words = struct.unpack_from(f"<{n_words}i", data, pos)
+    obj["code"] = [{"name": name, "slot": slot, "code": list(words[start:start + length])}
+                   for name, (slot, start, length) in table]
+    return obj
+
+
 # ----------------
 #  Assembly code is line-oriented and can be parsed
 #  with regular expressions.  We strip away comments
@@ -468,7 +696,7 @@ class ObjectCode:
 #
 
 def strip_comments(line: str) -> str:
-    return line.split("#")[0].strip()
+    return line.partition("#")[0].strip()
     # Note comment lines will now be empty,
     # as will blank lines.
 
@@ -479,7 +707,7 @@ INSTR_PAT = re.compile(r"""
     \s*
     (?P<opname> [a-zA-Z_]+)      # Operation name is required
     (\s+ (?P<operand>     # Operands are integers, quoted strings, or names
-             [0-9]+           # Integers are strings of digits
+             -?[0-9]+         # Integers are digits, optionally negative
            |
              ["](             # String begins and ends with quote 
                ([\\].)  |           # Anything escaped
@@ -550,104 +778,411 @@ ARGS_DECL_PAT = re.compile(r"""
 """, re.VERBOSE)
 
 
-def translate(lines: List[str]) -> ObjectCode:
-    code = ObjectCode()
+# Directive patterns, by directive, in the order they are tried,
+# with the item each match makes
+DIRECTIVES = {
+    ".class": [(CLASS_DECL_PAT,
+                lambda match: ir.ClassDecl(match["class_name"], match["super_name"]))],
+    # Method (.method f forward) to be filled in later, or
+    # method (.method) followed immediately by body
+    ".method": [(METHOD_DECL_PAT, lambda match: ir.MethodDecl(match["method_name"])),
+                (METHOD_DEF_PAT, lambda match: ir.MethodDef(match["method_name"]))],
+    ".field": [(FIELD_DECL_PAT, lambda match: ir.FieldDecl(match["field_name"]))],
+    # Local variable declaration, ".local name,name,name"
+    ".local": [(LOCALS_DECL_PAT,
+                lambda match: ir.LocalsDecl(tuple(match["local_var_name"].split(","))))],
+    # Method arguments declaration, ".args name,name,name"
+    ".args": [(ARGS_DECL_PAT,
+               lambda match: ir.ArgsDecl(tuple(match["arg_var_name"].split(","))))],
+}
+
+
+def match_line(line: str) -> List[ir.Item]:
+    """The items of one line (without comments), by trying each
+    kind of assembly language line in turn
+    """
+    for patterns in DIRECTIVES.values():
+        for pattern, item in patterns:
+            match = pattern.match(line)
+            if match:
+                return [item(match)]
+
+    # An operation (label: operation operand)
+    match = INSTR_PAT.fullmatch(line)
+    if match:
+        parts = match.groupdict()
+        label = parts["label"]
+        instr = ir.Instr(parts["opname"], parts["operand"])
+        return [ir.Label(label), instr] if label else [instr]
+
+    # A label with no instruction
+    match = LABEL_PAT.match(line)
+    if not match:
+        log.error(f"NO MATCH on '{line}'")
+        return []
+    return [ir.Label(match["label"])]
+
+
+# ----------------
+# match_line tries up to nine patterns on each line, which
+# dominates the time to read long (machine-generated) assembly code.
+# parse_lines instead looks at the leading token:  a directive
+# (.class, ...) is matched against its own pattern, and an instruction
+# (with or without a label) is split into tokens and checked with
+# str.strip, which removes every character of a name or number.  Lines
+# it cannot check that way (names with other word characters than
+# ASCII, malformed lines) go to match_line, so the two read every
+# line the same.
+#
+WORD_CHARS = string.ascii_letters + string.digits + "_"     # \w
+OPNAME_CHARS = string.ascii_letters + "_"
+OPERAND_NAME_CHARS = WORD_CHARS + ":$"
+STRING_OPERAND_PAT = re.compile(r'"(\\.|[^"\\])*"')
+
+
+def is_operand(operand: str) -> bool:
+    """Is this an operand INSTR_PAT accepts?"""
+    if not operand.strip(OPERAND_NAME_CHARS):
+        return True     # A name or a non-negative integer
+    if operand[0] == "-":
+        return operand != "-" and not operand[1:].strip(string.digits)
+    return operand[0] == '"' and STRING_OPERAND_PAT.fullmatch(operand) is not None
+
+
+def lex_instruction(line: str) -> Optional[List[ir.Item]]:
+    """The items of an instruction line, or of a label on its own,
+    or None if it must be left to match_line
+    """
+    tokens = line.split(None, 1)
+    opname = tokens[0]
+    operand = tokens[1] if len(tokens) > 1 else None
+    label = None
+    if ":" in opname:
+        label, _, opname = opname.partition(":")
+        if not label or label.strip(WORD_CHARS):
+            return None
+        if not opname:
+            if operand is None:
+                return [ir.Label(label)]
+            tokens = operand.split(None, 1)
+            opname = tokens[0]
+            operand = tokens[1] if len(tokens) > 1 else None
+    if opname.strip(OPNAME_CHARS):
+        return None
+    if operand is not None and not is_operand(operand):
+        return None
+    if label:
+        return [ir.Label(label), ir.Instr(opname, operand)]
+    return [ir.Instr(opname, operand)]
+
+
+def parse_lines(lines: Iterable[str]) -> Iterator[ir.Item]:
+    """Read assembly text into the in-memory form used by
+    the compiler and by translate_ir.
+    """
     for line in lines:
         line = strip_comments(line)
         if not line:
             continue
-
-        # Kinds of assembly language line:
-        # Class declaration (.class)
-        match = CLASS_DECL_PAT.match(line)
-        if match:
-            class_name = match.groupdict()["class_name"]
-            superclass_name = match.groupdict()["super_name"]
-            code.declare_class(class_name, superclass_name)
+        if line[0] == ".":
+            for pattern, item in DIRECTIVES.get(line.split(None, 1)[0], ()):
+                match = pattern.match(line)
+                if match:
+                    yield item(match)
+                    break
+            else:
+                yield from match_line(line)
             continue
+        items = lex_instruction(line)
+        if items is None:
+            items = match_line(line)
+        yield from items
 
-        # Method (.method f forward) to be filled in later
-        match = METHOD_DECL_PAT.match(line)
-        if match:
-            method_name = match.groupdict()["method_name"]
-            code.declare_method(method_name)
-            continue
 
-        # Method (.method) followed immediately by body
-        match = METHOD_DEF_PAT.match(line)
-        if match:
-            method_name = match.groupdict()["method_name"]
-            code.begin_method(method_name)
-            continue
+# Operations whose operand names a class, possibly as Class:member
+CLASS_REF_OPS = {"new", "is_instance", "call", "call_direct", "load_field", "store_field"}
 
-        # Field declaration, ".field name"
-        match = FIELD_DECL_PAT.match(line)
-        if match:
-            field_name = match.groupdict()["field_name"]
-            code.declare_field(field_name)
-            continue
 
-        # Local variable declaration, ".local name,name,name"
-        match = LOCALS_DECL_PAT.match(line)
-        if match:
-            locals_name_list = match.groupdict()["local_var_name"]
-            method_locals = locals_name_list.split(",")
-            n_locals = len(method_locals)
+def dependencies(code: Iterable[ir.Item]) -> Tuple[str, Set[str]]:
+    """Scan assembly code for the name of the class it
+    defines and the names of classes it refers to
+    (its superclass and the classes it calls or creates),
+    which must be assembled before it.
+    """
+    class_name = ""
+    refs: Set[str] = set()
+    for item in code:
+        if type(item) is ir.Instr:
+            if item.opname in CLASS_REF_OPS:
+                refs.add(item.operand.split(":")[0])
+        elif type(item) is ir.ClassDecl:
+            class_name = item.name
+            refs.add(item.super_name)
+    refs.discard(class_name)
+    refs.discard("$")
+    return class_name, refs
+
+
+def translate_ir(code: Iterable[ir.Item],
+                 objcode: Optional[ObjectCode] = None) -> ObjectCode:
+    """Translate assembly code in its in-memory form to object code
+    (into objcode, if given)
+    """
+    if objcode is None:
+        objcode = ObjectCode()
+    for item in code:
+        kind = type(item)
+        if kind is ir.Instr:
+            objcode.add_instruction(Instruction(
+                None, INSTRS[item.opname], item.operand))
+        elif kind is ir.Label:
+            objcode.add_label(item.name)
+        elif kind is ir.MethodDef:
+            objcode.begin_method(item.name)
+        elif kind is ir.LocalsDecl:
             # Allocate space on stack for local variables
-            code.add_instruction(Instruction(
+            objcode.add_instruction(Instruction(
                 label=None,
                 operation=INSTRS["alloc"],
-                operand=n_locals))
+                operand=len(item.names)))
             # Now set up locals symbol table information
-            code.declare_locals(method_locals)
-            continue
-
-        # Local variable declaration, ".local name,name,name"
-        match = ARGS_DECL_PAT.match(line)
-        if match:
-            locals_name_list = match.groupdict()["arg_var_name"]
-            args = locals_name_list.split(",")
+            objcode.declare_locals(list(item.names))
+        elif kind is ir.ArgsDecl:
             # No space allocation needed, unlike local variables,
             # because these are *before* (at negative offsets from)
             # the frame pointer.
-            # Set up locals symbol table information
-            code.declare_args(args)
-            continue
+            objcode.declare_args(list(item.names))
+        elif kind is ir.FieldDecl:
+            objcode.declare_field(item.name)
+        elif kind is ir.MethodDecl:
+            objcode.declare_method(item.name)
+        elif kind is ir.ClassDecl:
+            objcode.declare_class(item.name, item.super_name)
+        else:
+            log.error(f"Not an assembly code item: {item}")
+    objcode.end_method()  # The last method entered
+    return objcode
 
-        # An operation (label: operation operand)
-        match = INSTR_PAT.fullmatch(line)
-        if match:
-            parts = match.groupdict()
-            label = parts["label"]
-            opname = parts["opname"]
-            operand = parts["operand"]
-            instruction = Instruction(label, INSTRS[opname], operand)
-            code.add_instruction(instruction)
-            continue
 
-        # A label with no instruction
-        # An operation (label: operation operand)
-        match = LABEL_PAT.match(line)
-        if not match:
-            log.error(f"NO MATCH on '{line}'")
-            continue
-        parts = match.groupdict()
-        label = parts["label"]
-        code.add_label(label)
+def translate(lines: Iterable[str]) -> ObjectCode:
+    """Translate assembly text to object code"""
+    return translate_ir(parse_lines(lines))
+
+
+def assemble_streaming(source: Path, target: Path):
+    """Assemble source into the binary object file target, reading
+    it a line at a time and keeping only the code of the method being
+    assembled in memory (see StreamingObjectCode).  The code is spooled
+    next to the target.
+    """
+    with open(source, "r") as lines, tempfile.TemporaryFile(dir=target.parent) as spool:
+        objcode = translate_ir(parse_lines(lines), StreamingObjectCode(spool))
+        with open(target, "wb") as out:
+            objcode.write_binary(out)
 
 
+# ----------------
+# Batch mode:  many files in one run.  Each class is assembled after
+# the classes of the batch it refers to (see dependencies), whatever
+# the order of the files, so that it can import them from IMPORTS
+# rather than from their object files.  With more than one job, the
+# classes go to a pool of worker processes as soon as the classes
+# they refer to are done, so classes that do not depend on each other
+# are assembled in parallel.  Each worker is given the structures of
+# the classes a class imports from the batch along with its code.
+#
 
-    code.resolve_jumps()  # Of the last method entered
-    return code
+class ErrorCounter(logging.Handler):
+    """The assembler logs errors and keeps going;
+    we count them so that we can fail the build.
+    """
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.count = 0
 
+    def emit(self, record: logging.LogRecord):
+        self.count += 1
 
-def main():
-    """Assemble one file into object code in json format"""
+
+def class_dependencies(asm: Dict[str, List[ir.Item]]) -> Dict[str, List[str]]:
+    """For each class of asm, the other classes of asm it refers to"""
+    deps = {}
+    for name, code in asm.items():
+        _, refs = dependencies(code)
+        deps[name] = [ref for ref in sorted(refs) if ref in asm and ref != name]
+    return deps
+
+
+def build_order(asm: Dict[str, List[ir.Item]]) -> List[str]:
+    """Classes in an order in which each is assembled after
+    the classes of asm that it refers to.
+    """
+    deps = class_dependencies(asm)
+    order: List[str] = []
+    visiting = set()
+
+    def visit(name: str):
+        if name in order or name in visiting:
+            # Already placed, or a cycle that the assembler
+            # will complain about
+            return
+        visiting.add(name)
+        for dep in deps[name]:
+            visit(dep)
+        visiting.discard(name)
+        order.append(name)
+
+    for name in asm:
+        visit(name)
+    return order
+
+
+def write_object(objcode: ObjectCode, obj_dir: Path, write_json: bool = False):
+    """Write the object file of a class to obj_dir, and its json too if asked"""
+    path = obj_dir.joinpath(objcode.class_name)
+    path.with_suffix(OBJ_SUFFIX).write_bytes(objcode.binary())
+    if write_json:
+        with open(path.with_suffix(".json"), "w") as f:
+            print(objcode.json(), file=f)
+
+
+def remove_object(name: str, obj_dir: Path):
+    """Remove the object files of a class that was not assembled,
+    so that no class (or run of the vm) finds an old one
+    """
+    path = obj_dir.joinpath(name)
+    for suffix in (OBJ_SUFFIX, ".json"):
+        path.with_suffix(suffix).unlink(missing_ok=True)
+
+
+def assemble_class(code: List[ir.Item], imported: List[dict] = ()
+                   ) -> Tuple[Optional[ObjectCode], int]:
+    """Object code of one class, or None if the assembler crashed,
+    and the number of errors logged (counting a crash).  imported are
+    the structures of classes it may import that are not yet in IMPORTS.
+    """
+    for struct in imported:
+        IMPORTS[struct["class_name"]] = ImportedModule(struct)
+    counter = ErrorCounter()
+    log.addHandler(counter)
+    try:
+        objcode = translate_ir(code)
+    except Exception:
+        log.exception("Assembler crashed")
+        objcode = None
+    finally:
+        log.removeHandler(counter)
+    return objcode, counter.count
+
+
+def init_worker(tvmlib: Path):
+    CONFIG.tvmlib = tvmlib
+
+
+def assemble_files(paths: List[Path], obj_dir: Path, jobs: int = 1,
+                   write_json: bool = False) -> Dict[str, int]:
+    """Assemble the classes of paths into obj_dir, which also holds
+    the classes they import from outside the batch.  Returns the
+    number of errors in each class, in the order assembled.
+    A class the assembler crashed on has no object file, and the
+    classes that refer to it are not assembled.
+    Raises ValueError if two files define the same class.
+    """
+    asm: Dict[str, List[ir.Item]] = {}
+    for path in paths:
+        with open(path, "r") as source:
+            code = list(parse_lines(source))
+        name, _ = dependencies(code)
+        if name in asm:
+            raise ValueError(f"Class {name} is defined twice ({path})")
+        asm[name] = code
+    order = build_order(asm)
+    # Classes a class must wait for (not those after it, in a cycle)
+    position = {name: i for i, name in enumerate(order)}
+    waits = {name: {dep for dep in deps if position[dep] < position[name]}
+             for name, deps in class_dependencies(asm).items()}
+    errors: Dict[str, int] = {}
+    failed: Set[str] = set()
+    library = CONFIG.tvmlib
+    CONFIG.tvmlib = obj_dir
+
+    def finish(name: str, objcode: Optional[ObjectCode], count: int):
+        if objcode is None:
+            failed.add(name)
+            IMPORTS.pop(name, None)
+            remove_object(name, obj_dir)
+        else:
+            register_module(objcode)
+            write_object(objcode, obj_dir, write_json)
+        errors[name] = count
+
+    def skip(name: str) -> bool:
+        """Fail a class that refers to a class that failed, without assembling it"""
+        broken = sorted(waits[name] & failed)
+        if not broken:
+            return False
+        log.error(f"{name} not assembled: {', '.join(broken)} failed")
+        finish(name, None, 1)
+        return True
+
+    try:
+        if jobs <= 1 or len(order) <= 1:
+            for name in order:
+                if not skip(name):
+                    finish(name, *assemble_class(asm[name]))
+            return errors
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=jobs, initializer=init_worker,
+                initargs=(obj_dir,)) as pool:
+            running = {}
+            while len(errors) < len(order):
+                for name in order:
+                    if (name not in errors and name not in running.values()
+                            and waits[name] <= errors.keys() and not skip(name)):
+                        imported = [IMPORTS[dep].json for dep in waits[name]
+                                    if dep in IMPORTS]
+                        running[pool.submit(assemble_class, asm[name], imported)] = name
+                if not running:
+                    continue    # All that remained were skipped
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    finish(running.pop(future), *future.result())
+        return errors
+    finally:
+        CONFIG.tvmlib = library
+
+
+def main() -> int:
+    """Assemble one file into object code, or several into an object directory.
+    Exit status is 1 if the assembler reported errors in a batch.
+    """
     args = cli()
-    source = [line for line in args.source]
-    objcode = translate(source)
-    print(objcode.json(), file=args.target)
+    if args.batch:
+        obj_dir = CONFIG.tvmlib if args.obj is None else args.obj
+        try:
+            errors = assemble_files(args.files, obj_dir, args.jobs, args.json)
+        except (OSError, ValueError) as e:
+            log.error(e)
+            return 1
+        failed = [name for name, count in errors.items() if count]
+        if failed:
+            log.error(f"Errors in {', '.join(failed)}")
+            return 1
+        return 0
+    if args.stream:
+        assemble_streaming(args.files[0], args.files[1])
+        return 0
+    with open(args.files[0], "r") as source:
+        objcode = translate(source)
+    if len(args.files) == 1:
+        print(objcode.json())
+    elif args.files[1].suffix == OBJ_SUFFIX:
+        args.files[1].write_bytes(objcode.binary())
+    else:
+        args.files[1].write_text(objcode.json() + "\n")
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
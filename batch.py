@@ -0,0 +1,188 @@
+"""Compile many Quack programs at once, in parallel.
+
+Takes .qk files, and directories to search for .qk files, and compiles
+each program with driver.compile_file in a pool of worker processes.
+The compiler keeps its state in module globals, so each worker resets
+it (parser.reset) before each program, and each program gets its own
+object directory under the output directory:
+
+    build/hello/        for hello.qk given on the command line
+    build/sub/hello/    for sub/hello.qk found under a directory argument
+
+Each object directory also gets copies of the object files of the
+builtin classes, so that a program can be run with
+"tiny_vm -L build/hello hello".
+
+Prints a report of the time taken and the outcome for each program,
+and optionally writes the same report as JSON.  Exit status is 0 if
+every program compiled, 1 if any failed, and 2 for usage errors.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+import parser as quack
+import assemble
+import driver
+from timings import Timings
+
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+
+
+def cli() -> object:
+    parser = argparse.ArgumentParser(
+        description="Compile many Quack programs in parallel")
+    parser.add_argument("sources", nargs="+", type=Path,
+                        help=".qk files, or directories to search for .qk files")
+    parser.add_argument("-o", "--out", type=Path, default=Path("build"),
+                        help="Directory for the object directories of the programs (default build)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: number of cpus)")
+    parser.add_argument("--report", type=Path,
+                        help="Also write the report to this file, as JSON")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Rebuild every class, ignoring the build cache")
+    parser.add_argument("--timings", action="store_true",
+                        help="Include the time and counts of each compiler phase "
+                             "of each program in the --report")
+    return parser.parse_args()
+
+
+class Job(NamedTuple):
+    source: Path
+    obj_dir: Path
+
+
+class Result(NamedTuple):
+    source: str
+    obj_dir: str
+    ok: bool
+    seconds: float
+    classes: List[str]
+    error: Optional[str]
+    timings: Optional[dict] = None
+
+
+def find_jobs(sources: List[Path], out: Path) -> List[Job]:
+    """One job for each program, in the order given, with directories
+    searched recursively.  Raises ValueError if two programs would
+    share an object directory.
+    """
+    jobs = []
+    owners: Dict[Path, Path] = {}
+    for source in sources:
+        if source.is_dir():
+            found = [(path, path.relative_to(source).with_suffix(""))
+                     for path in sorted(source.rglob("*.qk"))]
+        else:
+            found = [(source, Path(source.stem))]
+        for path, relative in found:
+            obj_dir = out.joinpath(relative)
+            if obj_dir in owners:
+                raise ValueError(f"{path} and {owners[obj_dir]} would both be built in {obj_dir}")
+            owners[obj_dir] = path
+            jobs.append(Job(path, obj_dir))
+    return jobs
+
+
+def install_builtins(obj_dir: Path):
+    """Copy the object files of the builtin classes,
+    which the assembler reads to resolve calls to them
+    """
+    library = assemble.CONFIG.tvmlib
+    for name in quack.BUILTIN_TYPES:
+        stub = library.joinpath(name).with_suffix(".json")
+        if stub.exists():
+            shutil.copyfile(stub, obj_dir.joinpath(stub.name))
+
+
+def compile_job(job: Job, use_cache: bool, timed: bool = False) -> Result:
+    """Runs in a worker process"""
+    start = time.perf_counter()
+    classes: List[str] = []
+    error = None
+    timings = Timings(job.source.stem) if timed else None
+    try:
+        job.obj_dir.mkdir(parents=True, exist_ok=True)
+        install_builtins(job.obj_dir)
+        source = job.source.read_text()
+        classes = driver.compile_file(source, job.source.stem, job.obj_dir,
+                                      use_cache=use_cache, timings=timings)
+    except driver.COMPILE_ERRORS as e:
+        error = f"{type(e).__name__}: {e}"
+    except Exception as e:
+        # A bug in the compiler fails this program, not the batch
+        log.exception(f"Compiling {job.source}")
+        error = f"{type(e).__name__}: {e}"
+    return Result(str(job.source), str(job.obj_dir), error is None,
+                  time.perf_counter() - start, classes, error,
+                  None if timings is None else timings.as_dict())
+
+
+def init_worker():
+    assemble.log.setLevel(logging.INFO)
+
+
+def run_batch(jobs: List[Job], workers: int, use_cache: bool = True,
+              timed: bool = False) -> List[Result]:
+    """Results of the jobs, in the order of the jobs"""
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                initializer=init_worker) as pool:
+        futures = [pool.submit(compile_job, job, use_cache, timed) for job in jobs]
+        return [future.result() for future in futures]
+
+
+def report(results: List[Result], seconds: float) -> dict:
+    failed = [result for result in results if not result.ok]
+    return {"programs": len(results),
+            "failed": len(failed),
+            "seconds": seconds,
+            "compile_seconds": sum(result.seconds for result in results),
+            "results": [result._asdict() for result in results]}
+
+
+def print_report(results: List[Result], seconds: float):
+    width = max((len(result.source) for result in results), default=0)
+    for result in results:
+        outcome = "ok" if result.ok else f"FAILED  {result.error}"
+        print(f"{result.source:<{width}} {result.seconds * 1000:9.1f} ms  {outcome}")
+    failed = sum(1 for result in results if not result.ok)
+    total = sum(result.seconds for result in results)
+    print(f"{len(results)} programs, {failed} failed, "
+          f"{total:.2f} s compiling in {seconds:.2f} s")
+
+
+def main() -> int:
+    args = cli()
+    try:
+        jobs = find_jobs(args.sources, args.out)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 2
+    start = time.perf_counter()
+    results = run_batch(jobs, args.jobs, use_cache=not args.no_cache, timed=args.timings)
+    seconds = time.perf_counter() - start
+    print_report(results, seconds)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report(results, seconds), f, indent=2)
+    if all(result.ok for result in results):
+        return EXIT_OK
+    return EXIT_FAILED
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""Incremental compilation cache.
+
+A build records, for each class of a program, a key hashing
+- the version of the toolchain (the compiler and assembler sources),
+- the source text of the class, and
+- the interfaces (parent, method signatures in vtable order, fields)
+  of every class it can see, i.e., the user classes defined before it.
+Together with the class's own interface, that is what determines its
+object code.  A class whose key is unchanged, and whose object file is
+still the one we wrote, need not be parsed, compiled, or assembled
+again; its recorded interface is enough for the classes after it.
+A change to a superclass's vtable layout changes its interface, and
+so the keys of every class after it.
+
+Manifests live in .quack_cache/builds, one per program and object directory.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import assemble
+
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+ROOT = Path(__file__).resolve().parent
+CACHE_DIR = ROOT.joinpath(".quack_cache", "builds")
+
+# "import a, b as c" or "from a import ...", at any indentation
+IMPORT_PAT = re.compile(r"^[ \t]*(?:from[ \t]+(\w+)|import[ \t]+([\w., \t]+))", re.MULTILINE)
+
+
+def local_modules(module: str) -> List[str]:
+    """Source files of module and of the modules of this directory
+    that it imports, directly or through each other, in a stable order
+    """
+    found: List[str] = []
+
+    def visit(name: str):
+        path = ROOT.joinpath(name + ".py")
+        if path.name in found or not path.exists():
+            return
+        found.append(path.name)
+        for match in IMPORT_PAT.finditer(path.read_text()):
+            names = [match[1]] if match[1] else match[2].split(",")
+            for name in names:
+                if name.strip():
+                    visit(name.split()[0].split(".")[0])
+
+    visit(module)
+    return sorted(found)
+
+
+# Anything that can change the object code produced from the same source:
+# the driver and every module of ours it imports (so that a new compiler
+# pass counts as soon as the driver uses it), and the instruction table
+TOOLCHAIN_FILES = local_modules("driver") + ["opdefs.txt"]
+
+_toolchain_version: Optional[str] = None
+
+
+def toolchain_version() -> str:
+    global _toolchain_version
+    if _toolchain_version is None:
+        h = hashlib.sha256()
+        for name in TOOLCHAIN_FILES:
+            h.update(name.encode("utf-8"))
+            h.update(ROOT.joinpath(name).read_bytes())
+        _toolchain_version = h.hexdigest()
+    return _toolchain_version
+
+
+def digest(*parts) -> str:
+    """Hash of strings and json-able structures"""
+    h = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, str):
+            part = json.dumps(part, sort_keys=True)
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def file_digest(path: Path) -> Optional[str]:
+    try:
+        return hashlib.sha256(path.read_bytes()).hexdigest()
+    except OSError:
+        return None
+
+
+# ----------------
+# Splitting a program into the source slices of its classes.
+# Top-level class statements are found with a small scanner that
+# knows about strings, comments, and braces; everything else
+# is the main program.  A class statement inside another statement
+# (the body of an if or while, or of a class) cannot be compiled
+# on its own, so such a source is not split.
+#
+TOKEN_PAT = re.compile(r"""
+    (?P<string> "([\\].|[^"\\])*" )
+  | (?P<comment> /[*] (.|\n)*? [*]/ )
+  | (?P<word> [A-Za-z_]\w* )
+  | (?P<open> [{] )
+  | (?P<close> [}] )
+  | (?P<other> . | \n )
+""", re.VERBOSE)
+
+
+def split_source(source: str) -> Tuple[List[Tuple[str, str]], str]:
+    """Split Quack source into [(class name, class source), ...]
+    in order of definition, and the source of the main program.
+    Class slices are blanked out of the main program, keeping
+    line numbers.  Raises ValueError if the source cannot be split,
+    including when a class is defined inside another statement.
+    """
+    classes: List[Tuple[str, str]] = []
+    rest: List[str] = []
+    depth = 0
+    start = None     # Start of the class statement being scanned
+    name = None
+    expect_name = False
+    for match in TOKEN_PAT.finditer(source):
+        kind = match.lastgroup
+        text = match.group()
+        if kind == "word" and text == "class" and depth > 0:
+            raise ValueError("Class defined inside a statement")
+        if start is None:
+            if kind == "word" and text == "class":
+                start = match.start()
+                expect_name = True
+                continue
+            if kind == "open":
+                depth += 1
+            elif kind == "close":
+                depth -= 1
+            rest.append(text)
+            continue
+        # Inside a class statement
+        if expect_name and kind == "word":
+            name = text
+            expect_name = False
+        elif kind == "open":
+            depth += 1
+        elif kind == "close":
+            depth -= 1
+            if depth == 0:
+                slice_text = source[start:match.end()]
+                classes.append((name, slice_text))
+                rest.append("\n" * slice_text.count("\n"))
+                start = None
+                name = None
+    if start is not None or depth != 0 or any(n is None for n, _ in classes):
+        raise ValueError("Unbalanced braces or unterminated class")
+    return classes, "".join(rest)
+
+
+def has_statements(source: str) -> bool:
+    """Is there anything but comments and white space?"""
+    for match in TOKEN_PAT.finditer(source):
+        if match.lastgroup == "comment" or match.group().isspace():
+            continue
+        return True
+    return False
+
+
+class BuildCache:
+    """The record of the last build of one program into one object directory"""
+
+    def __init__(self, program: str, obj_dir: Path):
+        self.obj_dir = obj_dir
+        key = digest(str(obj_dir.resolve()), program)[:16]
+        self.path = CACHE_DIR.joinpath(f"{program}-{key}.json")
+        self.entries: Dict[str, dict] = {}
+        try:
+            with open(self.path) as f:
+                manifest = json.load(f)
+            if manifest.get("toolchain") == toolchain_version():
+                self.entries = manifest["classes"]
+        except (OSError, ValueError, KeyError):
+            pass  # No usable record; build everything
+
+    def object_path(self, name: str) -> Path:
+        return self.obj_dir.joinpath(name).with_suffix(assemble.OBJ_SUFFIX)
+
+    def lookup(self, name: str, key: str) -> Optional[dict]:
+        """Record of class 'name', including its interface, if it was
+        built with this key and its object file has not changed since.
+        """
+        entry = self.entries.get(name)
+        if entry is None or entry["key"] != key:
+            return None
+        if file_digest(self.object_path(name)) != entry["object"]:
+            return None
+        return entry
+
+    def record(self, name: str, key: str, interface: Optional[dict]):
+        """Call after the object file of 'name' is written"""
+        self.entries[name] = {"key": key, "interface": interface,
+                              "object": file_digest(self.object_path(name))}
+
+    def save(self):
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            # Builds of the same program may run at once (see quackd.py);
+            # each replaces the whole manifest
+            temp = self.path.with_suffix(f".{os.getpid()}.tmp")
+            with open(temp, "w") as f:
+                json.dump({"toolchain": toolchain_version(),
+                           "classes": self.entries}, f, indent=1)
+            os.replace(temp, self.path)
+        except OSError as e:
+            log.warning(f"Could not save build cache: {e}")
@@ -230,15 +230,15 @@ obj_ref new_string(char *s) {
 
 /* String literals constructor,
  * used by compiler and not otherwise available in
- * Quack programs.
+ * Quack programs.  The constant keeps its own copy of s_lit.
  */
 int str_literal_const(char *s_lit) {
-    int const_index = lookup_const_index(s_lit);
+    int const_index = lookup_const_index(CONST_STR, s_lit);
     if (const_index) {
         return const_index;
     }
-    obj_ref boxed = new_string(s_lit);
-    const_index = create_const_value(s_lit, boxed);
+    obj_ref boxed = new_string(strdup(s_lit));
+    const_index = create_const_value(CONST_STR, s_lit, boxed);
     return const_index;
 }
 
@@ -295,7 +295,10 @@ obj_ref native_String_equals(void ) {
     assert_is_type(this, the_class_String);
     obj_String this_str = (obj_String) this;
     obj_ref other = (vm_fp - 1)->obj;
-    assert_is_type(other, the_class_String);
+    /* equals takes any object; String has no subclasses */
+    if (other->header.clazz != the_class_String) {
+        return lit_false;
+    }
     obj_String other_str = (obj_String) other;
     if (strcmp(this_str->text, other_str->text) == 0) {
         return lit_true;
@@ -700,7 +703,10 @@ obj_ref native_Int_equals(void ) {
     assert_is_type(this, the_class_Int);
     obj_Int this_int = (obj_Int) this;
     obj_ref other = (vm_fp - 1)->obj;
-    assert_is_type(other, the_class_Int);
+    /* equals takes any object; Int has no subclasses */
+    if (other->header.clazz != the_class_Int) {
+        return lit_false;
+    }
     obj_Int other_int = (obj_Int) other;
     log_debug("Comparing integer values for equality: %d == %d",
            this_int->value, other_int->value);
@@ -960,13 +966,13 @@ obj_ref new_int(int n) {
  * e.g., Int.add.
  */
 int int_literal_const(char *n_lit) {
-    int const_index = lookup_const_index(n_lit);
+    int const_index = lookup_const_index(CONST_INT, n_lit);
     if (const_index) {
         return const_index;
     }
     int as_int = atoi(n_lit);
     obj_ref boxed = new_int(as_int);
-    const_index = create_const_value(n_lit, boxed);
+    const_index = create_const_value(CONST_INT, n_lit, boxed);
     return const_index;
 }
 
@@ -0,0 +1,390 @@
+"""Compile a Quack program to object code in a single process.
+
+The quack and quackc scripts used to run parser.py, then start
+assemble.py once for each class, passing everything through .asm
+files.  This driver parses, type-checks, and assembles every class
+of the program in one process, handing the assembly code of each
+class to the assembler in memory (as lists of ir items), after
+peephole optimization (see peephole.py) and the sharing of local
+variable slots (see frames.py).  Each class is compiled and
+written out before the next is parsed, so the compiler holds the syntax
+tree and code of only one class at a time.  Classes come in the order
+they are defined, which puts superclasses and classes referred to
+before the classes that use them, and each assembled class is
+immediately importable by the classes after it.
+
+Next to the object file of each class, the driver writes an interface
+file (Name.qki) recording its parent, method signatures, and fields.
+A program that uses a class it does not define, but that was built
+before into the same object directory, is type-checked and compiled
+against that class's interface, without its source.
+
+Prints the names of the classes built, one per line, with the main
+class last (the same list parser.py prints for the shell scripts).
+
+Exit status is 0 on success, 1 if the program could not be compiled
+or assembled, and 2 for usage errors.
+"""
+
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from lark.exceptions import LarkError
+
+import parser as quack
+import assemble
+import buildcache
+import ir
+import peephole
+import frames
+from timings import Timings
+
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# Exit codes
+EXIT_OK = 0
+EXIT_COMPILE_ERROR = 1
+
+# What compile_file raises for a program that does not compile
+COMPILE_ERRORS = (quack.CompileError, AssertionError, LarkError, OSError)
+
+
+def cli() -> object:
+    parser = argparse.ArgumentParser(
+        description="Compile a Quack program to tiny vm object code")
+    parser.add_argument("source", type=argparse.FileType("r"),
+                        help="Quack source file (.qk)")
+    parser.add_argument("--obj", type=Path, default=assemble.CONFIG.tvmlib,
+                        help="Directory for object code (default from asm.conf)")
+    parser.add_argument("--json", action="store_true",
+                        help="Also write each object file as json, for debugging")
+    parser.add_argument("--asm", action="store_true",
+                        help="Also write the intermediate .asm file of each class")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Rebuild every class, ignoring the build cache")
+    parser.add_argument("--peephole-stats", action="store_true",
+                        help="Report instructions removed from each method compiled")
+    parser.add_argument("--frame-stats", action="store_true",
+                        help="Report the local variable slots saved in each method compiled")
+    parser.add_argument("--timings", action="store_true",
+                        help="Report the time and counts of each compiler phase, "
+                             "per class and in total")
+    parser.add_argument("--timings-format", choices=["text", "json"], default="text",
+                        help="The --timings report as a table (the default) or json")
+    parser.add_argument("--timings-file", type=Path,
+                        help="Write the --timings report here instead of to stderr")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Debugging output from the assembler")
+    return parser.parse_args()
+
+
+class ObjectWriter:
+    """Optimizes, assembles, and writes the object file of each class
+    as soon as its code is generated, so that the code of only one
+    class need be kept at a time.  Each class must be written after
+    the classes it refers to.  Use as a context manager, which counts
+    the errors the assembler logs; write raises CompileError if there
+    are any.
+    """
+
+    def __init__(self, obj_dir: Path, timings: Optional[Timings] = None,
+                 write_asm: bool = False,
+                 stats: Optional[List[peephole.MethodStats]] = None,
+                 frame_stats: Optional[List[frames.FrameStats]] = None,
+                 write_json: bool = False):
+        self.obj_dir = obj_dir
+        self.timings = Timings("") if timings is None else timings
+        self.write_asm = write_asm
+        self.write_json = write_json
+        self.stats = stats
+        self.frame_stats = frame_stats
+        self.counter = assemble.ErrorCounter()
+        self.built: List[str] = []
+
+    def __enter__(self) -> "ObjectWriter":
+        # Imports are found where we put the object code
+        self.library = assemble.CONFIG.tvmlib
+        assemble.CONFIG.tvmlib = self.obj_dir
+        assemble.IMPORTS.clear()
+        assemble.log.addHandler(self.counter)
+        return self
+
+    def __exit__(self, *exc_info):
+        assemble.log.removeHandler(self.counter)
+        assemble.CONFIG.tvmlib = self.library
+
+    def write(self, name: str, code: List[ir.Item]):
+        """Peephole-optimize, share local slots, and assemble the
+        code of class 'name'
+        """
+        with self.timings.phase("peephole", name):
+            code = peephole.optimize(code, self.stats)
+        with self.timings.phase("frames", name):
+            code = frames.allocate(code, self.frame_stats)
+        if self.write_asm:
+            with open(name + ".asm", "w") as f:
+                f.write(ir.dump(code))
+        self.assemble(name, code)
+
+    def assemble(self, name: str, code: List[ir.Item]):
+        timings = self.timings
+        with timings.phase("assemble", name):
+            objcode = assemble.translate_ir(code)
+        if self.counter.count:
+            raise quack.CompileError(f"Assembly of {name} failed")
+        with timings.phase("write", name):
+            assemble.register_module(objcode)
+            assemble.write_object(objcode, self.obj_dir, self.write_json)
+        timings.count("instructions", sum(1 for item in code if type(item) is ir.Instr), name)
+        timings.count("constants", len(objcode.constants), name)
+        timings.count("labels", len(objcode.labels), name)
+        timings.count("words", len(objcode.code), name)
+        self.built.append(name)
+
+
+def assemble_program(asm: Dict[str, List[ir.Item]], obj_dir: Path,
+                     timings: Optional[Timings] = None) -> List[str]:
+    """Assemble each class of the program into obj_dir.
+    Returns the list of classes built, in the order built.
+    Raises CompileError if the assembler reports errors.
+    """
+    with ObjectWriter(obj_dir, timings) as writer:
+        for name in assemble.build_order(asm):
+            writer.assemble(name, asm[name])
+    return writer.built
+
+
+INTERFACE_SUFFIX = ".qki"
+
+
+def interface_path(obj_dir: Path, name: str) -> Path:
+    return obj_dir.joinpath(name).with_suffix(INTERFACE_SUFFIX)
+
+
+def write_interface(obj_dir: Path, interface: dict):
+    with open(interface_path(obj_dir, interface["name"]), "w") as f:
+        json.dump(interface, f, indent=2)
+
+
+def load_interface(obj_dir: Path, name: str) -> Optional[dict]:
+    """The interface of class 'name' built in obj_dir, if there is one"""
+    path = interface_path(obj_dir, name)
+    if not path.exists():
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        log.warning(f"Ignoring unreadable interface file {path}: {e}")
+        return None
+
+
+def find_imports(source: str, obj_dir: Path) -> List[dict]:
+    """Interfaces of the classes built before in obj_dir that the
+    source refers to but does not define, and of the classes those
+    refer to, each after the classes its parent and fields need.
+    """
+    defined = set()
+    names = set()
+    after_class = False
+    for match in buildcache.TOKEN_PAT.finditer(source):
+        if match.lastgroup != "word":
+            continue
+        word = match.group()
+        if after_class:
+            defined.add(word)
+        after_class = word == "class"
+        names.add(word)
+    imports: List[dict] = []
+    seen = set(quack.BUILTIN_TYPES) | defined
+
+    def visit(name: str):
+        if name in seen:
+            return
+        seen.add(name)
+        interface = load_interface(obj_dir, name)
+        if interface is None:
+            return
+        # Types the declaration needs first, then types of method signatures
+        visit(interface["parent"])
+        for typ_names in interface["fields"].values():
+            for typ_name in typ_names:
+                visit(typ_name)
+        imports.append(interface)
+        for sig in interface["methods"].values():
+            visit(sig["ret"])
+            for typ_name in sig["params"].values():
+                visit(typ_name)
+
+    for name in sorted(names):
+        visit(name)
+    return imports
+
+
+def declare_imports(imports: List[dict]):
+    for interface in imports:
+        try:
+            quack.declare_class(interface, imported=True)
+        except KeyError as e:
+            raise quack.CompileError(f"Interface of {interface['name']} "
+                                     f"refers to unknown class {e}")
+
+
+def compile_classes(classes: List[Tuple[str, str]], rest: str, filename: str,
+                    cache: Optional[buildcache.BuildCache], imports: List[dict],
+                    writer: ObjectWriter, timed: bool = False
+                    ) -> Dict[str, Tuple[str, dict]]:
+    """Compile the classes of a program split by buildcache.split_source,
+    and its main class, one at a time: each is parsed, type-checked,
+    and generated, then handed to the writer, before the next is parsed.
+    Classes whose build cache keys have not changed are declared from the
+    cache instead of compiled.  Returns the cache key and interface of
+    each class compiled.  Times the phases of each class in the writer's
+    timings, and, if timed, the phases of parsing too.
+    """
+    timings = writer.timings
+    version = buildcache.toolchain_version()
+    quack.reset()
+    declare_imports(imports)
+    # Classes compiled against imported classes depend on their interfaces
+    interfaces = list(imports)
+    changed = {}
+    for name, text in classes:
+        key = buildcache.digest(version, text, interfaces)
+        entry = None if cache is None else cache.lookup(name, key)
+        if entry is None:
+            nodes = quack.node_count
+            tree = quack.parse(text, timings.timer(name) if timed else None)
+            timings.count("ast_nodes", quack.node_count - nodes, name)
+            with timings.phase("type_check", name):
+                tree.update_info()
+            with timings.phase("codegen", name):
+                tree.get_assembly()
+            writer.write(name, quack.class_asm.pop(name))
+            interface = quack.class_interface(name)
+            changed[name] = (key, interface)
+        else:
+            interface = entry["interface"]
+            quack.declare_class(interface)
+            timings.count("reused")
+        interfaces.append(interface)
+    main_key = buildcache.digest(version, rest, interfaces)
+    if cache is None or cache.lookup(filename, main_key) is None:
+        main_tree = None
+        if buildcache.has_statements(rest):
+            nodes = quack.node_count
+            main_tree = quack.parse(rest, timings.timer(filename) if timed else None)
+            timings.count("ast_nodes", quack.node_count - nodes, filename)
+            with timings.phase("type_check", filename):
+                main_tree.update_info()
+        with timings.phase("codegen", filename):
+            code = quack.main_assembly(main_tree, filename)
+        writer.write(filename, code)
+        changed[filename] = (main_key, None)
+    else:
+        timings.count("reused")
+    log.debug(f"Reusing {len(classes) + 1 - len(changed)} of {len(classes) + 1} classes, "
+              f"importing {len(imports)}")
+    return changed
+
+
+def compile_file(source: str, filename: str, obj_dir: Path,
+                 write_asm: bool = False, use_cache: bool = True,
+                 stats: Optional[List[peephole.MethodStats]] = None,
+                 timings: Optional[Timings] = None,
+                 frame_stats: Optional[List[frames.FrameStats]] = None,
+                 write_json: bool = False) -> List[str]:
+    """Compile Quack source for main class 'filename'
+    all the way to object code.  Returns the names of all the classes
+    of the program, main class last.  If stats is given, the peephole
+    statistics of each method compiled are appended to it, and likewise
+    the local slots of each method for frame_stats.  If timings
+    is given, the time and counts of each phase are recorded in it.
+    With write_json, each object file is also written as json.
+    """
+    timed = timings is not None
+    if timings is None:
+        timings = Timings(filename)
+    imports = find_imports(source, obj_dir)
+    cache = buildcache.BuildCache(filename, obj_dir) if use_cache else None
+    try:
+        classes, rest = buildcache.split_source(source)
+    except ValueError:
+        classes = None
+    with ObjectWriter(obj_dir, timings, write_asm, stats, frame_stats,
+                      write_json) as writer:
+        if classes is not None:
+            changed = compile_classes(classes, rest, filename, cache, imports,
+                                      writer, timed)
+        else:
+            # Without the class slices of the source, the whole program
+            # is compiled before any of it is written, and the front end
+            # is timed for the whole program (see timings.py)
+            cache = None
+            quack.reset()
+            declare_imports(imports)
+            asm = quack.compile_program(source, filename, timings.timer() if timed else None)
+            timings.count("ast_nodes", quack.node_count)
+            for name in assemble.build_order(asm):
+                writer.write(name, asm.pop(name))
+    imported = {interface["name"] for interface in imports}
+    built = [name for name in quack.types
+             if name not in quack.BUILTIN_TYPES and name not in imported]
+    for name in built:
+        write_interface(obj_dir, quack.class_interface(name))
+    if cache is not None:
+        for name, (key, interface) in changed.items():
+            cache.record(name, key, interface)
+        cache.save()
+    # Main class last, as the shell scripts expect
+    return built + [filename]
+
+
+def main() -> int:
+    args = cli()
+    if args.verbose:
+        log.setLevel(logging.DEBUG)
+    else:
+        assemble.log.setLevel(logging.INFO)
+    source = args.source.read()
+    filename = Path(args.source.name).stem
+    stats = [] if args.peephole_stats else None
+    frame_stats = [] if args.frame_stats else None
+    timings = Timings(filename) if args.timings else None
+    try:
+        built = compile_file(source, filename, args.obj, args.asm,
+                             use_cache=not args.no_cache, stats=stats,
+                             timings=timings, frame_stats=frame_stats,
+                             write_json=args.json)
+    except COMPILE_ERRORS as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return EXIT_COMPILE_ERROR
+    if timings is not None:
+        report = timings.json() if args.timings_format == "json" else timings.text()
+        if args.timings_file:
+            args.timings_file.write_text(report + "\n")
+        else:
+            print(report, file=sys.stderr)
+    if stats is not None:
+        # On stderr, since the scripts read the class names from stdout
+        for method in stats:
+            print(method, file=sys.stderr)
+        print(f"{sum(m.removed for m in stats)} of {sum(m.before for m in stats)} "
+              f"instructions removed", file=sys.stderr)
+    if frame_stats is not None:
+        for method in frame_stats:
+            print(method, file=sys.stderr)
+        print(f"{sum(m.saved for m in frame_stats)} of {sum(m.before for m in frame_stats)} "
+              f"local slots saved", file=sys.stderr)
+    print("\n".join(built))
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+"""Sharing of local variable slots between variables that are never
+live at the same time.
+
+The compiler declares a local for every variable a method assigns, and
+the alloc at the method's entry pushes 'nothing' into each of them on
+every call.  Many of those variables hold their values only briefly
+(a temporary in one arm of an if, the counters of consecutive loops,
+...), and need no slot of their own.  This pass computes, for the code
+of each method (after peephole optimization), the locals live at each
+instruction by the usual backward data flow over its basic blocks.  Two
+locals interfere if one is stored while the other is live.  Locals that
+do not interfere share a slot, chosen greedily in the order they were
+declared.  A local that may be read before it is assigned is live from
+the entry to that read, so no local sharing its slot is stored before
+it, and it still reads the 'nothing' of the alloc.
+
+Each slot keeps the name of the first local given it; loads and stores
+of the others are renamed to it (dropping copies from a local to one
+that shares its slot), and the method's .local declaration lists just
+the slots.  Locals never loaded or stored get no slot.
+"""
+
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import ir
+from ir import ClassDecl, MethodDef, LocalsDecl, Label, Instr
+from peephole import JUMPS, ENDS
+
+
+class FrameStats(NamedTuple):
+    """Local variable slots of one method before and after sharing"""
+    class_name: str
+    method: str
+    before: int
+    after: int
+
+    @property
+    def saved(self) -> int:
+        return self.before - self.after
+
+    def __str__(self):
+        return (f"{self.class_name}:{self.method} {self.before} -> {self.after} "
+                f"locals ({self.saved} saved)")
+
+
+def bits(mask: int):
+    """Indices of the bits set in mask"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def interference(body: List[ir.Item], names: Sequence[str]) -> List[int]:
+    """For each local of names, the bit mask (over names) of the
+    locals it interferes with, or -1 for a local never used.
+    body is the labels and instructions of the method.
+    """
+    bit = {name: 1 << i for i, name in enumerate(names)}
+    instrs: List[Instr] = []
+    label_at: Dict[str, int] = {}
+    for item in body:
+        if type(item) is Label:
+            label_at[item.name] = len(instrs)
+        else:
+            instrs.append(item)
+    n = len(instrs)
+
+    # Basic blocks start at labels and after jumps and returns
+    starts = {0} | set(label_at.values())
+    for i, instr in enumerate(instrs):
+        if instr.opname in JUMPS or instr.opname in ENDS:
+            starts.add(i + 1)
+    starts = sorted(start for start in starts if start < n)
+    block_at = {start: b for b, start in enumerate(starts)}
+    ends = starts[1:] + [n]
+
+    def mask(instr: Instr) -> int:
+        if instr.opname in ("load", "store"):
+            return bit.get(instr.operand, 0)
+        return 0
+
+    uses = []   # Locals loaded in a block before any store to them
+    stores = []
+    successors = []
+    used = 0
+    for start, end in zip(starts, ends):
+        use = store = 0
+        for instr in reversed(instrs[start:end]):
+            m = mask(instr)
+            if instr.opname == "store":
+                store |= m
+                use &= ~m
+            elif instr.opname == "load":
+                use |= m
+            used |= m
+        uses.append(use)
+        stores.append(store)
+        last = instrs[end - 1]
+        succ = []
+        if last.opname in JUMPS and label_at.get(last.operand, n) < n:
+            succ.append(block_at[label_at[last.operand]])
+        if last.opname not in ENDS and end < n:
+            succ.append(block_at[end])
+        successors.append(succ)
+
+    live_in = [0] * len(starts)
+    live_out = [0] * len(starts)
+    changed = True
+    while changed:
+        changed = False
+        for b in reversed(range(len(starts))):
+            out = 0
+            for s in successors[b]:
+                out |= live_in[s]
+            live = uses[b] | (out & ~stores[b])
+            if out != live_out[b] or live != live_in[b]:
+                live_out[b], live_in[b] = out, live
+                changed = True
+
+    conflicts = [0] * len(names)
+    for b, (start, end) in enumerate(zip(starts, ends)):
+        live = live_out[b]
+        for instr in reversed(instrs[start:end]):
+            m = mask(instr)
+            if not m:
+                continue
+            if instr.opname == "store":
+                conflicts[m.bit_length() - 1] |= live
+                live &= ~m
+            else:
+                live |= m
+    for i in range(len(names)):
+        for j in bits(conflicts[i]):
+            conflicts[j] |= 1 << i
+    return [conflicts[i] & ~(1 << i) if used & (1 << i) else -1
+            for i in range(len(names))]
+
+
+def share_slots(body: List[ir.Item], names: Sequence[str]) -> Dict[str, str]:
+    """The slot (named for its first local) of each local of names
+    that the method uses
+    """
+    conflicts = interference(body, names)
+    slots: List[List] = []    # [name, mask of the locals in the slot]
+    slot_of = {}
+    for i, name in enumerate(names):
+        if conflicts[i] == -1:
+            continue
+        for slot in slots:
+            if not slot[1] & conflicts[i]:
+                slot[1] |= 1 << i
+                slot_of[name] = slot[0]
+                break
+        else:
+            slots.append([name, 1 << i])
+            slot_of[name] = name
+    return slot_of
+
+
+def allocate(code: List[ir.Item], stats: Optional[List[FrameStats]] = None
+             ) -> List[ir.Item]:
+    """Assembly code of a class with the locals of each method
+    sharing slots.  If stats is given, the number of locals of each
+    method that declares any, before and after, is appended to it.
+    """
+    out: List[ir.Item] = []
+    class_name = None
+    method = None
+    declared: Optional[LocalsDecl] = None
+    body: List[ir.Item] = []
+
+    def flush():
+        nonlocal declared
+        if declared is None:
+            out.extend(body)
+            body.clear()
+            return
+        slot_of = share_slots(body, declared.names)
+        slots = tuple(dict.fromkeys(slot_of.values()))
+        if stats is not None:
+            stats.append(FrameStats(class_name, method, len(declared.names), len(slots)))
+        if slots:
+            out.append(LocalsDecl(slots))
+        renamed = [Instr(item.opname, slot_of[item.operand])
+                   if (type(item) is Instr and item.opname in ("load", "store")
+                       and item.operand in slot_of) else item
+                   for item in body]
+        i = 0
+        while i < len(renamed):
+            item = renamed[i]
+            following = renamed[i + 1] if i + 1 < len(renamed) else None
+            if (type(item) is Instr and item.opname == "load" and type(following) is Instr
+                    and following.opname == "store" and following.operand == item.operand):
+                i += 2  # A copy between locals that now share a slot
+                continue
+            out.append(item)
+            i += 1
+        declared = None
+        body.clear()
+
+    for item in code:
+        if type(item) in (Label, Instr):
+            body.append(item)
+            continue
+        flush()
+        if type(item) is LocalsDecl:
+            declared = item
+            continue
+        if type(item) is ClassDecl:
+            class_name = item.name
+        elif type(item) is MethodDef:
+            method = item.name
+        out.append(item)
+    flush()
+    return out
@@ -0,0 +1,101 @@
+"""In-memory form of tiny vm assembly code.
+
+The compiler emits a list of these items for each class, and the
+assembler translates them directly into object code.  Text assembly
+(.asm files) is just a dump of the same items, one per line, which
+the assembler can read back in (see assemble.parse_lines).
+
+Each kind of item corresponds to one kind of assembly line:
+
+    ClassDecl    .class Name:Super
+    FieldDecl    .field name
+    MethodDecl   .method name forward
+    MethodDef    .method name
+    LocalsDecl   .local a,b,c
+    ArgsDecl     .args a,b
+    Label        name:
+    Instr        opname operand
+
+Labels are symbolic; the assembler resolves them to relative jumps.
+Operands are kept in their assembly text form (e.g., a string constant
+includes its quotes), except that integer operands may be ints.
+"""
+
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+
+class ClassDecl(NamedTuple):
+    name: str
+    super_name: str
+
+    def __str__(self):
+        return f".class {self.name}:{self.super_name}"
+
+
+class FieldDecl(NamedTuple):
+    name: str
+
+    def __str__(self):
+        return f".field {self.name}"
+
+
+class MethodDecl(NamedTuple):
+    name: str
+
+    def __str__(self):
+        return f".method {self.name} forward"
+
+
+class MethodDef(NamedTuple):
+    name: str
+
+    def __str__(self):
+        return f".method {self.name}"
+
+
+class LocalsDecl(NamedTuple):
+    names: Tuple[str, ...]
+
+    def __str__(self):
+        return f".local {','.join(self.names)}"
+
+
+class ArgsDecl(NamedTuple):
+    names: Tuple[str, ...]
+
+    def __str__(self):
+        return f".args {','.join(self.names)}"
+
+
+class Label(NamedTuple):
+    name: str
+
+    def __str__(self):
+        return f"{self.name}:"
+
+
+class Instr(NamedTuple):
+    opname: str
+    operand: Optional[Union[str, int]] = None
+
+    def __str__(self):
+        if self.operand is None:
+            return f"\t{self.opname}"
+        return f"\t{self.opname} {self.operand}"
+
+
+Item = Union[ClassDecl, FieldDecl, MethodDecl, MethodDef,
+             LocalsDecl, ArgsDecl, Label, Instr]
+
+
+def dump_lines(code: Iterable[Item]) -> Iterator[str]:
+    """Assembly text for each item"""
+    for item in code:
+        if type(item) is MethodDef:
+            yield ""  # Blank line between methods, for the human reader
+        yield str(item)
+
+
+def dump(code: Iterable[Item]) -> str:
+    """Text assembly for a whole module"""
+    return "\n".join(dump_lines(code)) + "\n"
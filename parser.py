@@ -1,55 +1,114 @@
 import sys
+import hashlib
+import contextlib
+from pathlib import Path
+import lark
 from lark import Lark, Transformer, v_args, Tree, Token
 from quackGrammar import quack_grammar
 from Type import *
+import ir
+from ir import ClassDecl, FieldDecl, MethodDef, LocalsDecl, ArgsDecl, Label, Instr
 
 # Provide unique names to all labels
 if_count = 0
-elif_count = 0
-elif_inner_count = 0
-else_count = 0
 while_count = 0
 and_count = 0
 or_count = 0
 not_count = 0
+hoist_count = 0  # And to the temporaries of hoisted expressions
 
 # Namespace trackers
 current_class = "Global"
 current_function = "Constr"
 
 # Global information
-node_list = []
+node_count = 0  # AST nodes created; the nodes themselves are not kept
 var_list = {"Global": {"Constr": {}}}
 file_list = []
+class_asm = {}  # Class name -> assembly code (a list of ir items), filled in by get_assembly
+
+class CompileError(Exception):
+    """Raised for errors in the Quack program being compiled"""
+    pass
 
 # Abstract Base Class
 class ASTNode:
+    __slots__ = ()
+
     def __init__(self):
-        node_list.append(self)
+        global node_count; node_count += 1
 
     def get_assembly(self):
         NotImplementedError(f"{self.__name} should have a get_assembly method")
 
+    def branch(self, label, when):
+        """Code of a condition that jumps to label if the condition
+        is when (True or False), and otherwise falls through
+        """
+        return self.get_assembly() + [Instr("jump_if" if when else "jump_ifnot", label)]
+
     def update_info(self):
         NotImplementedError(f"{self.__name} should have an update_info method")
 
+    def fold(self):
+        """Constant folding: returns the node to use in place of this one"""
+        return self
+
+    def diverges(self):
+        """Does control never get past this statement?"""
+        return False
+
+def statements_assembly(statements):
+    """Assembly code of a sequence of statements, leaving out those
+    after a statement that never completes (like while true).
+    Their code is still generated, for stable label numbers.
+    """
+    code = []
+    reachable = True
+    for statement in statements:
+        statement_code = statement.get_assembly()
+        if reachable:
+            code.extend(statement_code)
+            reachable = not statement.diverges()
+    return code
+
 class Program(ASTNode):
-    def __init__(self, left, right):
+    """A sequence of statements, kept flat (not nested one per
+    statement) so that long programs do not exhaust the Python stack
+    """
+    __slots__ = ("statements",)
+
+    def __init__(self, statements):
         super().__init__()
-        self.left = left
-        self.right = right
+        self.statements = statements
 
     def get_assembly(self):
-        left = self.left.get_assembly()
-        right = self.right.get_assembly()
-        return f"{left}{right}"
+        return statements_assembly(self.statements)
+
+    def diverges(self):
+        return any(statement.diverges() for statement in self.statements)
 
     def update_info(self):
-        self.left.update_info()
-        self.right.update_info()
+        for statement in self.statements:
+            statement.update_info()
+
+    def fold(self):
+        self.statements = [statement.fold() for statement in self.statements]
+        return self
 
 # Control Flow
+# Branches whose condition is the constant true or false (after
+# constant folding) are pruned: an arm that can never be taken is left
+# out, an arm that is always taken ends the chain, and while false
+# loops vanish.  The code of pruned parts is still generated and
+# thrown away, so that label numbers (and so object files) are the
+# same whatever is pruned.
+def is_constant(node, value):
+    return isinstance(node, Bool) and node.val == value
+
 class If(ASTNode):
+    __slots__ = ("condition", "block", "elif_node", "else_node")
+
     def __init__(self, condition, block, elif_node, else_node):
         super().__init__()
         self.condition = condition
@@ -57,30 +116,78 @@ class If(ASTNode):
         self.elif_node = elif_node
         self.else_node = else_node
 
-    def get_assembly(self):
-        global if_count, elif_count, elif_inner_count, else_count
-        condition = self.condition.get_assembly()
-        block = self.block.get_assembly()
-        next_label = f"if_end{if_count}"
-
-        elif_asm = ""
-        else_asm = ""
+    def arms(self):
+        """(condition, block) of the if and of each elif"""
+        arms = [(self.condition, self.block)]
+        node = self.elif_node
+        while node is not None:
+            arms.append((node.condition, node.block))
+            node = node.elif_node
+        return arms
+
+    def live_arms(self):
+        """Indices of the arms whose conditions must be tested, and
+        the index of the block run when none is taken: an arm whose
+        condition is true, len(arms) for the else, or None
+        """
+        arms = self.arms()
+        live = []
+        for i, (condition, block) in enumerate(arms):
+            if is_constant(condition, "true"):
+                return live, i
+            if not is_constant(condition, "false"):
+                live.append(i)
+        if self.else_node is None:
+            return live, None
+        return live, len(arms)
 
+    def get_assembly(self):
+        global if_count
+        arms = self.arms()
+        block_code = [block.get_assembly() for condition, block in arms]
+        else_code = None
         if self.else_node is not None:
-            else_asm = self.else_node.get_assembly()
-            next_label = f"else{else_count}"
-
-        if self.elif_node is not None:
-            elif_asm = self.elif_node.get_assembly(next_label, next_label)
-            next_label = f"elif{elif_count}v{elif_inner_count - 1}"
-
-        msg = f"{condition}\tjump_ifnot {next_label}\n{block}\tjump if_end{if_count}\n{elif_asm}{else_asm}if_end{if_count}:\n"
+            else_code = self.else_node.block.get_assembly()
+        end_label = f"if_end{if_count}"
+        labels = [f"elif{if_count}v{i}" for i in range(len(arms))] + [f"else{if_count}"]
         if_count += 1
-        elif_count += 1
-        else_count += 1
-        elif_inner_count = 0
-        
-        return msg
+
+        live, default = self.live_arms()
+        if default is None:
+            default_label, default_code = end_label, []
+        elif default == len(arms):
+            default_label, default_code = labels[default], else_code
+        else:
+            default_label, default_code = labels[default], block_code[default]
+
+        # Each condition jumps to the next arm when it is false, so
+        # its code is generated once the labels are known
+        next_labels = {i: labels[live[k + 1]] if k + 1 < len(live) else default_label
+                       for k, i in enumerate(live)}
+        condition_code = [condition.branch(next_labels.get(i, end_label), False)
+                          for i, (condition, block) in enumerate(arms)]
+
+        code = []
+        for k, i in enumerate(live):
+            if k > 0:
+                code.append(Label(labels[i]))
+            code.extend(condition_code[i])
+            code.extend(block_code[i])
+            code.append(Instr("jump", end_label))
+        if live and default is not None:
+            code.append(Label(default_label))
+        code.extend(default_code)
+        if live:
+            code.append(Label(end_label))
+        return code
+
+    def diverges(self):
+        live, default = self.live_arms()
+        if default is None:
+            return False
+        arms = self.arms()
+        block = self.else_node.block if default == len(arms) else arms[default][1]
+        return block.diverges() and all(arms[i][1].diverges() for i in live)
 
     def update_info(self):
         self.condition.update_info()
@@ -90,122 +197,337 @@ class If(ASTNode):
         if self.else_node is not None:
             self.else_node.update_info()
 
+    def fold(self):
+        self.condition = self.condition.fold()
+        self.block = self.block.fold()
+        if self.elif_node is not None:
+            self.elif_node = self.elif_node.fold()
+        if self.else_node is not None:
+            self.else_node = self.else_node.fold()
+        return self
+
+# Elif and Else are parts of an If, which generates their code
 class Elif(ASTNode):
+    __slots__ = ("condition", "block", "elif_node")
+
     def __init__(self, condition, block, elif_node):
         super().__init__()
         self.condition = condition
         self.block = block
         self.elif_node = elif_node
 
-    def get_assembly(self, next_label, final_label):
-        global elif_count, elif_inner_count
-
-        condition = self.condition.get_assembly()
-        block = self.block.get_assembly()
-        
-        elif_asm = ""
- 
-        if self.elif_node is None:
-            next_label = final_label
-        else:
-            next_label = f"elif{elif_count}v{elif_inner_count}"
-            elif_asm = self.elif_node.get_assembly(next_label, final_label)
-
-        msg = f"elif{elif_count}v{elif_inner_count}:\n{condition}\tjump_ifnot {next_label}\n{block}\tjump if_end{if_count}\n{elif_asm}"
-        elif_inner_count += 1
-        return msg
-
     def update_info(self):
         self.condition.update_info()
         self.block.update_info()
         if self.elif_node is not None:
             self.elif_node.update_info()
 
+    def fold(self):
+        self.condition = self.condition.fold()
+        self.block = self.block.fold()
+        if self.elif_node is not None:
+            self.elif_node = self.elif_node.fold()
+        return self
+
 class Else(ASTNode):
+    __slots__ = ("block",)
+
     def __init__(self, block):
         super().__init__()
         self.block = block
 
-    def get_assembly(self):
-        global else_count
-        block = self.block.get_assembly()
-        
-        return f"else{else_count}:\n{block}"
-
     def update_info(self):
         self.block.update_info()
 
+    def fold(self):
+        self.block = self.block.fold()
+        return self
+
+# Loop-invariant code motion
+# Before the code of a while loop, the expressions in it whose value
+# is the same on every iteration are computed into temporaries (new
+# locals of the method), which the loop loads instead.  An expression
+# is invariant if it reads no variable the loop assigns, no field the
+# loop stores or that a method or constructor it calls might store,
+# and calls only pure methods (see Methodcall.pure).  Only method calls
+# and field loads are worth hoisting, and only those that run on every
+# iteration: in the condition (but not the right side of an and or
+# an or) and in the statements of the loop's own block.  Those of the
+# block are computed once the condition has been found true the first
+# time, so nothing is computed that the loop would not have computed.
+slot_names = {}   # AST class -> names of the slots of its instances
+
+def children(node):
+    """The nodes directly under node"""
+    cls = type(node)
+    names = slot_names.get(cls)
+    if names is None:
+        names = slot_names[cls] = [name for base in cls.__mro__
+                                   for name in getattr(base, "__slots__", ())]
+    nodes = []
+    for name in names:
+        value = getattr(node, name, None)
+        if isinstance(value, ASTNode):
+            nodes.append(value)
+        elif type(value) is list:
+            nodes.extend(item for item in value if isinstance(item, ASTNode))
+    return nodes
+
+class LoopEffects:
+    """What a loop may change: the variables it assigns, the fields
+    it stores, and whether it calls methods that might store fields.
+    Those of the loops in it are computed once, and merged.
+    """
+    __slots__ = ("assigned", "stored", "calls")
+
+    def __init__(self, loop):
+        self.assigned = set()
+        self.stored = set()
+        self.calls = False
+        stack = [loop.condition, loop.block]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Loop):
+                inner = node.loop_effects()
+                self.assigned |= inner.assigned
+                self.stored |= inner.stored
+                self.calls |= inner.calls
+                continue
+            if isinstance(node, VarCreate):
+                self.assigned.add(node.name)
+            elif isinstance(node, FieldCreate):
+                self.stored.add(node.name)
+            elif isinstance(node, Instance) or (isinstance(node, Methodcall) and
+                                                node.val.get_typ().name not in FINAL_TYPES):
+                self.calls = True
+            stack.extend(children(node))
+
+    def invariant(self, node):
+        if isinstance(node, Const):
+            return True
+        if isinstance(node, VarCall):
+            return node.name not in self.assigned
+        if isinstance(node, FieldCall):
+            return (not self.calls and node.name not in self.stored
+                    and (node.val == "$" or node.val not in self.assigned))
+        if isinstance(node, Methodcall):
+            return (node.pure() and self.invariant(node.val)
+                    and all(self.invariant(arg) for arg in node.args))
+        return False
+
+def hoist(node, effects, hoisted):
+    """node, or a load of a new temporary if node is an invariant
+    expression worth hoisting, whose code is then appended to hoisted.
+    Parts of node that are always evaluated with it are hoisted likewise.
+    """
+    global hoist_count
+    if isinstance(node, (Methodcall, FieldCall)) and effects.invariant(node):
+        variables = var_list[current_class][current_function]
+        while f"hoisted{hoist_count}" in variables:
+            hoist_count += 1
+        name = f"hoisted{hoist_count}"
+        hoist_count += 1
+        v = VarType()
+        v.add_typ(node.get_typ())
+        v.valid = True
+        variables[name] = v
+        hoisted.extend(node.get_assembly())
+        hoisted.append(Instr("store", name))
+        temp = VarCall(name)
+        temp.typ = v
+        return temp
+    if isinstance(node, Methodcall):
+        node.val = hoist(node.val, effects, hoisted)
+        node.args = [hoist(arg, effects, hoisted) for arg in node.args]
+    elif isinstance(node, Instance):
+        node.args = [hoist(arg, effects, hoisted) for arg in node.args]
+    elif isinstance(node, (And, Or)):
+        node.left = hoist(node.left, effects, hoisted)
+    elif isinstance(node, Not):
+        node.cond = hoist(node.cond, effects, hoisted)
+    return node
+
 class Loop(ASTNode):
+    __slots__ = ("condition", "block", "effects")
+
     def __init__(self, condition, block):
         super().__init__()
         self.condition = condition
         self.block = block
+        self.effects = None
+
+    def loop_effects(self):
+        if self.effects is None:
+            self.effects = LoopEffects(self)
+        return self.effects
 
     def get_assembly(self):
         global while_count
 
-        condition = self.condition.get_assembly()
+        before, first = [], []  # Hoisted from the condition, from the block
+        if not is_constant(self.condition, "false"):
+            effects = self.loop_effects()
+            self.condition = hoist(self.condition, effects, before)
+            self.hoist_block(effects, first)
         block = self.block.get_assembly()
-
-        msg = f"\tjump while_end{while_count}\nwhile_start{while_count}:\n{block}while_end{while_count}:\n{condition}\tjump_if while_start{while_count}\n"
+        start_label = f"while_start{while_count}"
+        end_label = f"while_end{while_count}"
+        exit_label = f"while_exit{while_count}"
         while_count += 1
-
-        return msg
+        condition = self.condition.branch(start_label, True)
+
+        if is_constant(self.condition, "false"):
+            return []
+        if is_constant(self.condition, "true"):
+            return first + [Label(start_label)] + block + [Instr("jump", start_label)]
+
+        code = before
+        if first:
+            # Test the condition before computing what the block needs
+            code.extend(self.condition.branch(exit_label, False))
+            code.extend(first)
+        else:
+            code.append(Instr("jump", end_label))
+        code.append(Label(start_label))
+        code.extend(block)
+        code.append(Label(end_label))
+        code.extend(condition)
+        if first:
+            code.append(Label(exit_label))
+
+        return code
+
+    def hoist_block(self, effects, hoisted):
+        """Hoist the invariant expressions of the statements of the
+        block, which run on every iteration (up to one that diverges)
+        """
+        for statement in self.block.statements:
+            if isinstance(statement, Assignment):
+                statement.val = hoist(statement.val, effects, hoisted)
+            elif isinstance(statement, Methodcall):
+                statement.val = hoist(statement.val, effects, hoisted)
+                statement.args = [hoist(arg, effects, hoisted) for arg in statement.args]
+            elif isinstance(statement, (If, Loop)):
+                statement.condition = hoist(statement.condition, effects, hoisted)
+            if statement.diverges():
+                break
+
+    def diverges(self):
+        return is_constant(self.condition, "true")
 
     def update_info(self):
         self.condition.update_info()
         self.block.update_info()
 
+    def fold(self):
+        self.condition = self.condition.fold()
+        self.block = self.block.fold()
+        return self
+
 class And(ASTNode):
+    __slots__ = ("left", "right")
+
     def __init__(self, left, right):
         self.left = left
         self.right = right
 
     def get_assembly(self):
         global and_count
-        left = self.left.get_assembly()
-        right = self.right.get_assembly()
-        msg = f"{left}\tjump_ifnot and_mid{and_count}\n{right}\tjump and_end{and_count}\nand_mid{and_count}:\n\tconst false\nand_end{and_count}:\n"
+        mid, end = f"and_mid{and_count}", f"and_end{and_count}"
+        and_count += 1
+        code = self.left.branch(mid, False)
+        code.extend(self.right.get_assembly())
+        code += [Instr("jump", end), Label(mid), Instr("const", "false"), Label(end)]
+        return code
+
+    def branch(self, label, when):
+        # Short circuit: no Boolean is pushed for either side
+        global and_count
+        if not when:
+            return self.left.branch(label, False) + self.right.branch(label, False)
+        skip = f"and_skip{and_count}"
         and_count += 1
-        return msg
+        return self.left.branch(skip, False) + self.right.branch(label, True) + [Label(skip)]
 
     def update_info(self):
         self.left.update_info()
         self.right.update_info()
 
+    def fold(self):
+        # true and x == x;  false and x == false
+        self.left = self.left.fold()
+        self.right = self.right.fold()
+        if isinstance(self.left, Bool):
+            return self.right if self.left.val == "true" else Bool("false")
+        return self
+
 class Or(ASTNode):
+    __slots__ = ("left", "right")
+
     def __init__(self, left, right):
         self.left = left
         self.right = right
 
     def get_assembly(self):
         global or_count
-        left = self.left.get_assembly()
-        right = self.right.get_assembly()
-        msg = f"{left}\tjump_if or_mid{or_count}\n{right}\tjump or_end{or_count}\nor_mid{or_count}:\n\tconst true\nor_end{or_count}:\n"
+        mid, end = f"or_mid{or_count}", f"or_end{or_count}"
+        or_count += 1
+        code = self.left.branch(mid, True)
+        code.extend(self.right.get_assembly())
+        code += [Instr("jump", end), Label(mid), Instr("const", "true"), Label(end)]
+        return code
+
+    def branch(self, label, when):
+        global or_count
+        if when:
+            return self.left.branch(label, True) + self.right.branch(label, True)
+        skip = f"or_skip{or_count}"
         or_count += 1
-        return msg
+        return self.left.branch(skip, True) + self.right.branch(label, False) + [Label(skip)]
 
     def update_info(self):
         self.left.update_info()
         self.right.update_info()
 
+    def fold(self):
+        # true or x == true;  false or x == x
+        self.left = self.left.fold()
+        self.right = self.right.fold()
+        if isinstance(self.left, Bool):
+            return Bool("true") if self.left.val == "true" else self.right
+        return self
+
 class Not(ASTNode):
+    __slots__ = ("cond",)
+
     def __init__(self, cond):
         self.cond = cond
 
     def get_assembly(self):
         global not_count
-        cond = self.cond.get_assembly()
-        msg = f"{cond}\tjump_if not_mid{not_count}\n\tconst true\n\tjump not_end{not_count}\n\tnot_mid{not_count}:\t\nconst false\n\tnot_end{not_count}:\n"
+        mid, end = f"not_mid{not_count}", f"not_end{not_count}"
         not_count += 1
-        return msg
+        code = self.cond.branch(mid, True)
+        code += [Instr("const", "true"), Instr("jump", end), Label(mid),
+                 Instr("const", "false"), Label(end)]
+        return code
+
+    def branch(self, label, when):
+        return self.cond.branch(label, not when)
 
     def update_info(self):
         self.cond.update_info()
 
+    def fold(self):
+        self.cond = self.cond.fold()
+        if isinstance(self.cond, Bool):
+            return Bool("false") if self.cond.val == "true" else Bool("true")
+        return self
+
 # Arithmetic Operations
 class BinOp(ASTNode):
+    __slots__ = ("op", "left", "right", "typ")
+
     def __init__(self, op, left, right):
         super().__init__()
         self.op = op
@@ -216,7 +538,7 @@ class BinOp(ASTNode):
     def get_assembly(self):
         left = self.left.get_assembly()
         right = self.right.get_assembly()
-        return f"{left}{right}\tcall {self.typ}:{self.op}\n"
+        return left + right + [Instr("call", f"{self.typ.name}:{self.op}")]
 
     def update_info(self):
         self.op.update_info()
@@ -224,6 +546,8 @@ class BinOp(ASTNode):
         self.right.update_info()
 
 class Negate(ASTNode):
+    __slots__ = ("val", "typ")
+
     def __init__(self, val):
         super().__init__()
         self.val = val
@@ -231,12 +555,34 @@ class Negate(ASTNode):
 
     def get_assembly(self):
         val = self.val.get_assembly()
-        return f"\tconst 0\n{val}\tcall {self.typ}:sub\n"
+        return [Instr("const", "0")] + val + [Instr("call", f"{self.typ.name}:sub")]
 
     def update_info(self):
         self.val.update_info()
 
+# Int methods with instructions of their own, used when both operands
+# are known to be Int (int_opcodes False turns them off, for benchmarks)
+INT_OPCODES = {"plus": "int_plus", "sub": "int_sub", "mult": "int_mult",
+               "div": "int_div", "less": "int_less", "greater": "int_greater",
+               "LE": "int_le", "GE": "int_ge", "equals": "int_equals"}
+int_opcodes = True
+
+# Int comparisons in conditions jump on the comparison, with no Boolean
+# in between:  instruction -> (jump if false, jump if true)
+INT_JUMPS = {"int_less": ("jump_int_ge", "jump_int_less"),
+             "int_greater": ("jump_int_le", "jump_int_greater"),
+             "int_le": ("jump_int_greater", "jump_int_le"),
+             "int_ge": ("jump_int_less", "jump_int_ge"),
+             "int_equals": ("jump_int_ne", "jump_int_equals")}
+
+# Methods of builtin classes that have no effects (see Methodcall.pure)
+PURE_METHODS = {"Int": {"plus", "sub", "mult", "div", "less", "greater",
+                        "LE", "GE", "equals", "string"},
+                "String": {"plus", "less", "greater", "LE", "GE", "equals", "string"}}
+
 class Methodcall(ASTNode):
+    __slots__ = ("method", "val", "args", "owner", "typ")
+
     def __init__(self, val, method, args):
         super().__init__()
         self.method = method
@@ -246,52 +592,113 @@ class Methodcall(ASTNode):
     def get_assembly(self):
         val = self.val.get_assembly()
 
-        arg = ""
+        arg = []
         for argu in self.args:
-            arg += argu.get_assembly()
-
-        roll = ""
-
-        if self.method == "sub" or self.method == "div" or self.method == "less" or self.method == "plus":
-            roll = "\troll 1\n"
+            arg.extend(argu.get_assembly())
 
+        if self.int_opcode() is not None:
+            return val + arg + [Instr(self.int_opcode())]
         if self.val.get_typ().name in var_list:
-            text = f"{arg}{val}{roll}\tcall {self.typ.name}:{self.method}\n"
+            code = arg + val
         else:
-            text = f"{val}{arg}{roll}\tcall {self.typ.name}:{self.method}\n"
+            # Builtin receivers are evaluated first, then rolled
+            # above their arguments, so that 3 - 2 is 3.sub(2)
+            code = val + arg
+            if self.args:
+                code.append(Instr("roll", len(self.args)))
+        op = "call_direct" if self.monomorphic() else "call"
+        code.append(Instr(op, f"{self.owner.name}:{self.method}"))
 
         if self.method == "print":
-            text += "\tpop\n"
+            code.append(Instr("pop"))
+
+        return code
 
-        return text
+    def branch(self, label, when):
+        opcode = self.int_opcode()
+        if opcode not in INT_JUMPS:
+            return super().branch(label, when)
+        code = self.val.get_assembly() + self.args[0].get_assembly()
+        return code + [Instr(INT_JUMPS[opcode][when], label)]
 
     def update_info(self):
         self.val.update_info()
-        self.typ = self.val.get_typ()
         for arg in self.args:
             arg.update_info()
 
         self.check_method()
 
+    def fold(self):
+        self.val = self.val.fold()
+        self.args = [arg.fold() for arg in self.args]
+        folded = fold_call(self.val, self.method, self.args)
+        if folded is None:
+            return self
+        return folded
+
+    def int_opcode(self):
+        """The instruction for this call if it is an Int operation
+        on two Ints, or None
+        """
+        if not (int_opcodes and self.method in INT_OPCODES and len(self.args) == 1):
+            return None
+        # (and, or, and not have no type of their own, but are Booleans)
+        if any(isinstance(node, (And, Or, Not)) for node in (self.val, self.args[0])):
+            return None
+        if self.val.get_typ() is types["Int"] and self.args[0].get_typ() is types["Int"]:
+            return INT_OPCODES[self.method]
+        return None
+
+    def pure(self):
+        """Does this call only compute a value from its receiver and
+        arguments, and never fail?  Int and String methods other than
+        print do, given arguments of the receiver's type, except that
+        Int division must be by a literal other than 0 and -1.
+        """
+        typ = self.val.get_typ().name
+        if self.method not in PURE_METHODS.get(typ, ()):
+            return False
+        # (and, or, and not have no type of their own, but are Booleans)
+        if any(isinstance(arg, (And, Or, Not)) or arg.get_typ().name != typ
+               for arg in self.args):
+            return False
+        return self.method != "div" or literal_value(self.args[0]) not in (None, 0, -1)
+
+    def monomorphic(self):
+        """Can this call reach only one method, so that it need not
+        look the method up in the receiver's vtable?  It can when the
+        receiver is a new object, whose class is exact; when the receiver's
+        type is a builtin class that cannot be extended; and, in the main
+        program, when the receiver's type is a class of this program that no
+        class of this program extends with its own version of the method.
+        Classes are compiled before the classes (and programs) that may
+        extend them, so calls in their methods get only the first two.
+        """
+        if isinstance(self.val, Instance):
+            return True
+        typ = types[self.val.get_typ().name]
+        if typ.name in FINAL_TYPES:
+            return True
+        return (current_class == "Global" and typ.name not in BUILTIN_TYPES
+                and not typ.imported and not typ.overridden(self.method))
+
     def check_method(self):
-        typ = self.val.get_typ()
-        while typ != None:
-            if self.method in types[typ.name].methods:
-                self.typ = types[typ.name]
-                return
-            else:
-                typ = types[typ.name].parent
-                if typ != None:
-                    typ = types[typ.name]
-    
-        sys.stderr.write(f"ERROR: {self.typ} does not have a {self.method} method\n")
-        sys.exit(1)
+        typ = types[self.val.get_typ().name]
+        # The class that defines the method is the one we call, and
+        # the method's return type is the type of the call
+        self.owner = typ.find_method(self.method)
+        if self.owner is None:
+            raise CompileError(f"{typ} does not have a {self.method} method")
+        ret = self.owner.methods[self.method].ret
+        self.typ = types.get(ret, types["Obj"])
 
     def get_typ(self):
         return self.typ
 
 # Containers
 class Function(ASTNode):
+    __slots__ = ("name", "params", "typ", "program", "ret")
+
     def __init__(self, name, params, typ, program, ret):
         super().__init__()
         self.name = str(name)
@@ -303,14 +710,21 @@ class Function(ASTNode):
     def get_assembly(self):
         global current_function; current_function = self.name
 
+        code = [MethodDef(self.name)]
+
         params = []
         for param in self.params:
-            params.append(param) 
+            params.append(param)
 
         if len(params) > 0:
-            params = ".args " + ",".join(params) + "\n"
+            code.append(ArgsDecl(tuple(params)))
+
+        # The code comes first, since loops add temporaries to the locals
+        body = statements_assembly(self.program)
+        if self.ret is None:
+            body.append(Instr("const", "nothing"))
         else:
-            params = ""
+            body.extend(self.ret.get_assembly())
 
         local = []
         for var in var_list[current_class][current_function]:
@@ -318,23 +732,15 @@ class Function(ASTNode):
                 local.append(var)
 
         if len(local) > 0:
-            local = ".local " + ",".join(local) + "\n"
-        else:
-            local = ""
+            code.append(LocalsDecl(tuple(local)))
 
-        program = ""
-        for line in self.program:
-            program += line.get_assembly()
-
-        if self.ret is None:
-            ret = "\tconst nothing\n"
-        else:
-            ret = self.ret.get_assembly()
+        code.append(Instr("enter"))
+        code.extend(body)
 
         current_function = "Constr"
 
-        text = f".method {self.name}\n{params}{local}\tenter\n{program}{ret}\treturn {len(self.params)}\n"
-        return text
+        code.append(Instr("return", len(self.params)))
+        return code
 
     def update_info(self):
         global current_function; current_function = self.name
@@ -356,11 +762,19 @@ class Function(ASTNode):
         if self.ret is not None:
             self.ret.update_info()
 
-        types[current_class].methods[self.name] = Method(self.name, self.typ, params)
+        types[current_class].add_method(Method(self.name, self.typ, params))
 
         current_function = "Constr"
 
+    def fold(self):
+        self.program = [line.fold() for line in self.program]
+        if self.ret is not None:
+            self.ret = self.ret.fold()
+        return self
+
 class Class(ASTNode):
+    __slots__ = ("name", "params", "parent", "code", "funcs")
+
     def __init__(self, name, params, parent, code, funcs):
         super().__init__()
         self.name = name
@@ -375,49 +789,49 @@ class Class(ASTNode):
     def get_assembly(self):
         global current_class; current_class = self.name
 
-        code = ".method $constructor\n"
+        code = [ClassDecl(self.name, self.parent)]
 
-        local = ""
-        local_li = []
-        for var in var_list[current_class][current_function]:
-            if not var_list[current_class][current_function][var].param:
-                local.append(var_list[current_class][current_function][var])
+        for key in var_list[current_class]:
+            if key != "Constr" and key not in types[current_class].methods:
+                code.append(FieldDecl(key))
 
-        if len(local_li) > 0:
-            local = ".local " + ",".join(local) + "\n"
+        code.append(MethodDef("$constructor"))
 
         if len(self.params) > 0:
-            code += ".args "
             li = []
             for param in self.params:
                 li.append(param)
-            code += ",".join(li) + "\n"
+            code.append(ArgsDecl(tuple(li)))
+
+        body = statements_assembly(self.code)
+
+        local_li = []
+        for var in var_list[current_class][current_function]:
+            if not var_list[current_class][current_function][var].param:
+                local_li.append(var)
 
-        code += f"{local}\tenter\n"
+        if len(local_li) > 0:
+            code.append(LocalsDecl(tuple(local_li)))
 
-        for line in self.code:
-            code += line.get_assembly()
+        code.append(Instr("enter"))
 
-        funcs = []
-        for func in self.funcs:
-            funcs.append(self.funcs[func].get_assembly())
+        code.extend(body)
 
-        funcs = "\n".join(funcs)
+        code += [Instr("load", "$"), Instr("return", len(self.params))]
 
-        fields = ""
-        for key in var_list[current_class]:
-            if key != "Constr" and key not in types[current_class].methods:
-                fields += f".field {key}\n"
+        for func in self.funcs:
+            code.extend(self.funcs[func].get_assembly())
 
         current_class = "Global"
 
-        with open(f"{self.name}.asm", "w") as fil:
-            fil.write(f".class {self.name}:{self.parent}\n{fields}{code}\tload $\n\treturn {len(self.params)}\n\n{funcs}")
-        return ""
+        class_asm[self.name] = code
+        return []
 
     def update_info(self):
         global current_class; current_class = self.name
 
+        if self.parent in FINAL_TYPES:
+            raise CompileError(f"Class {self.name} cannot extend builtin class {self.parent}")
         var_list[current_class] = {"Constr": {}}
         types[self.name] = Type(self.name, types[self.parent], {}, {})
         file_list.append(self.name)
@@ -437,39 +851,56 @@ class Class(ASTNode):
 
         current_class = "Global"
 
+    def fold(self):
+        self.code = [item.fold() for item in self.code]
+        for func in self.funcs:
+            self.funcs[func] = self.funcs[func].fold()
+        return self
+
 class Instance(ASTNode):
+    __slots__ = ("name", "args")
+
     def __init__(self, name, args):
         super().__init__()
         self.name = name
         self.args = args
 
     def get_assembly(self):
-        ret = ""
+        code = []
         for arg in self.args:
-            ret += arg.get_assembly()
+            code.extend(arg.get_assembly())
 
-        return f"{ret}\tnew {self.name}\n\tcall {self.name}:$constructor\n"
+        code += [Instr("new", self.name), Instr("call_direct", f"{self.name}:$constructor")]
+        return code
 
     def update_info(self):
         for arg in self.args:
             arg.update_info()
 
+    def fold(self):
+        self.args = [arg.fold() for arg in self.args]
+        return self
+
     def get_typ(self):
         return types[self.name]
 
 # Constants
 class Const(ASTNode):
+    __slots__ = ("val", "typ")
+
     def __init__(self, val):
         super().__init__()
         self.val = val
 
     def get_assembly(self):
-        return f"\tconst {self.val}\n"
+        return [Instr("const", str(self.val))]
 
     def get_typ(self):
         return self.typ
 
 class Number(Const):
+    __slots__ = ()
+
     def __init__(self, val):
         super().__init__(val)
 
@@ -477,6 +908,8 @@ class Number(Const):
         self.typ = types["Int"]
 
 class String(Const):
+    __slots__ = ()
+
     def __init__(self, val):
         super().__init__(val)
 
@@ -484,38 +917,142 @@ class String(Const):
         self.typ = types["String"]
 
 class Bool(Const):
+    __slots__ = ()
+
     def __init__(self, val):
         super().__init__(val)
 
     def update_info(self):
         self.typ = types["Boolean"]
 
+    def branch(self, label, when):
+        return [Instr("jump", label)] if (self.val == "true") == when else []
+
+# Constant folding
+# Method calls on literals (3 + 4, "a" + "b", 6 < 7, ...) are evaluated
+# at compile time, as the vm would evaluate them: Int arithmetic wraps
+# around at 32 bits, and division truncates toward zero.  A call is left
+# for run time if it would fail there (division by zero, an argument of
+# the wrong type, ...), so that the program still fails the same way,
+# and so are strings with escapes or non-ascii text.
+INT_MIN = -2 ** 31
+INT_MAX = 2 ** 31 - 1
+
+def wrap_int(n):
+    return (n - INT_MIN) % 2 ** 32 + INT_MIN
+
+def int_div(a, b):
+    if b == 0 or (a == INT_MIN and b == -1):
+        return None
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+INT_OPS = {
+        "plus": lambda a, b: wrap_int(a + b),
+        "sub": lambda a, b: wrap_int(a - b),
+        "mult": lambda a, b: wrap_int(a * b),
+        "div": int_div,
+        "less": lambda a, b: a < b,
+        "greater": lambda a, b: a > b,
+        "LE": lambda a, b: a <= b,
+        "GE": lambda a, b: a >= b,
+        "equals": lambda a, b: a == b,
+        }
+
+STRING_OPS = {
+        "plus": lambda a, b: a + b,
+        "less": lambda a, b: a < b,
+        "greater": lambda a, b: a > b,
+        "LE": lambda a, b: a <= b,
+        "GE": lambda a, b: a >= b,
+        "equals": lambda a, b: a == b,
+        }
+
+def literal_value(node):
+    """The value of a literal node, or None if it is not one we fold"""
+    if isinstance(node, Number):
+        n = int(node.val)
+        if INT_MIN <= n <= INT_MAX:
+            return n
+    elif isinstance(node, String):
+        text = str(node.val)[1:-1]
+        if text.isascii() and "\\" not in text:
+            return text
+    elif isinstance(node, Bool):
+        return node.val == "true"
+    return None
+
+def make_literal(value):
+    if isinstance(value, bool):
+        return Bool("true" if value else "false")
+    if isinstance(value, int):
+        return Number(str(value))
+    return String(f'"{value}"')
+
+def fold_call(val, method, args):
+    """Literal node for the result of val.method(args), or None"""
+    receiver = literal_value(val)
+    if receiver is None:
+        return None
+    if not args:
+        if method != "string":
+            return None
+        if isinstance(val, Bool):
+            return make_literal("true" if receiver else "false")
+        return make_literal(str(receiver))
+    if len(args) != 1 or type(args[0]) is not type(val):
+        return None
+    other = literal_value(args[0])
+    if other is None:
+        return None
+    if isinstance(val, Number):
+        op = INT_OPS.get(method)
+    elif isinstance(val, String):
+        op = STRING_OPS.get(method)
+    else:
+        op = INT_OPS["equals"] if method == "equals" else None
+    if op is None:
+        return None
+    result = op(receiver, other)
+    if result is None:
+        return None
+    return make_literal(result)
+
 # Variables
 class VarType():
+    __slots__ = ("typs", "valid", "param", "typ")
+
     def __init__(self):
         self.typs = set()
         self.valid = False
         self.param = False
+        self.typ = None # Common ancestor of typs, once computed
 
     def add_typ(self, typ):
-        self.typs.add(typ)
+        if typ not in self.typs:
+            self.typs.add(typ)
+            self.typ = None
 
     def get_typ(self):
-        typs = list(self.typs)
-        while len(typs) > 1:
-            typ0 = typs.pop()
-            typ1 = typs.pop()
-            typs.append(typ0.get_common_ancestor(typ1))
-        return typs[0]
+        if self.typ is None:
+            typs = list(self.typs)
+            while len(typs) > 1:
+                typ0 = typs.pop()
+                typ1 = typs.pop()
+                typs.append(typ0.get_common_ancestor(typ1))
+            self.typ = typs[0]
+        return self.typ
 
 class VarCreate(ASTNode):
+    __slots__ = ("name", "typ")
+
     def __init__(self, name):
         super().__init__()
         self.name = name
 
     def get_assembly(self):
         self.typ.valid = True
-        return f"\tstore {self.name}\n"
+        return [Instr("store", self.name)]
 
     def update_info(self, typ):
         if self.name not in var_list[current_class][current_function]:
@@ -531,13 +1068,15 @@ class VarCreate(ASTNode):
         return self.typ.get_typ()
 
 class VarCall(ASTNode):
+    __slots__ = ("name", "typ")
+
     def __init__(self, name):
         super().__init__()
         self.name = name
 
     def get_assembly(self):
         assert self.typ.valid, f"Variable {self.name} has not been initialized before use"
-        return f"\tload {self.name}\n"
+        return [Instr("load", self.name)]
 
     def update_info(self):
         assert self.name in var_list[current_class][current_function], f"Variable {self.name} has not been initialized before use"
@@ -547,6 +1086,8 @@ class VarCall(ASTNode):
         return self.typ.get_typ()
 
 class FieldCreate(ASTNode):
+    __slots__ = ("name", "val", "typ")
+
     def __init__(self, val, name):
         super().__init__()
         self.name = name
@@ -556,7 +1097,7 @@ class FieldCreate(ASTNode):
 
     def get_assembly(self):
         self.typ.valid = True
-        return f"\tload {self.val}\n\tstore_field {self.val}:{self.name}\n"
+        return [Instr("load", self.val), Instr("store_field", f"{self.val}:{self.name}")]
 
     def update_info(self, typ):
         if self.name not in var_list[current_class]:
@@ -573,6 +1114,8 @@ class FieldCreate(ASTNode):
 
 
 class FieldCall(ASTNode):
+    __slots__ = ("name", "val", "typ")
+
     def __init__(self, val, name):
         super().__init__()
         self.name = name
@@ -582,7 +1125,7 @@ class FieldCall(ASTNode):
 
     def get_assembly(self):
         assert self.typ.valid, f"Field {self.name} has not been initialized before use"
-        return f"\tload {self.val}\n\tload_field {self.val}:{self.name}\n"
+        return [Instr("load", self.val), Instr("load_field", f"{self.val}:{self.name}")]
 
     def update_info(self):
         assert self.name in var_list[current_class], f"Field {self.val}.{self.name} has not been initialized before use"
@@ -592,26 +1135,32 @@ class FieldCall(ASTNode):
         return self.typ.get_typ()
 
 class Assignment(ASTNode):
+    __slots__ = ("name", "val", "typ")
+
     def __init__(self, name, val):
         super().__init__()
         self.name = name
         self.val = val
 
     def get_assembly(self):
-        val = self.val.get_assembly();
-        name = self.name.get_assembly();
-        return f"{val}{name}"
+        code = self.val.get_assembly()
+        code.extend(self.name.get_assembly())
+        return code
 
     def update_info(self):
         self.val.update_info()
         self.name.update_info(self.val.get_typ())
         self.typ = self.val.get_typ()
+
+    def fold(self):
+        self.val = self.val.fold()
+        return self
         
 
 @v_args(inline=True)    # Affects the signatures of the methods
 class BuildTree(Transformer):
-    def program(self, left, right):
-        return Program(left, right)
+    def program(self, *statements):
+        return Program(list(statements))
     
     def statement(self, node):
         return node
@@ -794,6 +1343,150 @@ class BuildTree(Transformer):
     def log_not(self, cond):
         return Not(cond)
 
+# Grammar analysis and LALR table construction are cached on disk,
+# keyed by a hash of the grammar and the Lark version, and the parser
+# is built at most once per process.
+PARSER_CACHE_DIR = Path(__file__).parent.joinpath(".quack_cache")
+quack_parser = None
+tree_parser = None  # Without the BuildTree transformer, for timing the phases
+
+def parser_cache_path():
+    key = hashlib.sha256(f"{lark.__version__}\n{quack_grammar}".encode("utf-8"))
+    return PARSER_CACHE_DIR.joinpath(f"grammar-{key.hexdigest()[:16]}.lark")
+
+def build_parser(cache=True, transformer=True):
+    """A new LALR parser for Quack, loaded from the table cache if possible.
+    With transformer False, the parser returns the Lark parse tree.
+    """
+    cache_file = False
+    if cache:
+        try:
+            PARSER_CACHE_DIR.mkdir(exist_ok=True)
+            cache_file = str(parser_cache_path())
+        except OSError:
+            pass  # Read-only installation; build the tables every time
+    return Lark(quack_grammar, parser="lalr", cache=cache_file,
+                transformer=BuildTree() if transformer else None)
+
+def get_parser():
+    """The parser for this process"""
+    global quack_parser
+    if quack_parser is None:
+        quack_parser = build_parser()
+    return quack_parser
+
+def parse(source, timed=None):
+    """Syntax tree of Quack source, with constant expressions folded.
+    timed(phase), if given, is a context manager timing each phase
+    (parse, build_tree, fold); Lark then builds its parse tree before
+    BuildTree transforms it, instead of BuildTree running as it parses.
+    """
+    global tree_parser
+    if timed is None:
+        return get_parser().parse(source).fold()
+    if tree_parser is None:
+        tree_parser = build_parser(transformer=False)
+    with timed("parse"):
+        tree = tree_parser.parse(source)
+    with timed("build_tree"):
+        tree = BuildTree().transform(tree)
+    with timed("fold"):
+        return tree.fold()
+
+def reset():
+    """Forget everything learned from a previous compilation,
+    so that one process can compile more than one program.
+    """
+    global if_count, while_count, and_count, or_count, not_count
+    global current_class, current_function, node_count, hoist_count
+    if_count = 0
+    while_count = and_count = or_count = not_count = hoist_count = 0
+    current_class = "Global"
+    current_function = "Constr"
+    node_count = 0
+    var_list.clear()
+    var_list["Global"] = {"Constr": {}}
+    file_list.clear()
+    class_asm.clear()
+    for name in list(types):
+        if name not in BUILTIN_TYPES:
+            del types[name]
+        else:
+            types[name].common_ancestors.clear()
+            types[name].subclasses = [sub for sub in types[name].subclasses
+                                      if sub.name in BUILTIN_TYPES]
+
+def compile_program(source, filename, timed=None):
+    """Compile Quack source text for the main class 'filename'.
+    Returns a dict from class name to assembly text, with
+    classes in the order they were defined and the main class last.
+    timed(phase), if given, times each phase (see parse).
+    """
+    file_list.append(filename)
+
+    tree = parse(source, timed) # Build tree
+    if timed is None:
+        timed = lambda phase: contextlib.nullcontext()
+    with timed("type_check"):
+        tree.update_info() # Fills in missing type information
+
+    with timed("codegen"):
+        class_asm[filename] = main_assembly(tree, filename)
+    return dict(class_asm)
+
+def main_assembly(tree, filename):
+    """Assembly code for the main class, whose constructor runs the
+    top-level statements of the program (tree may be None if there are none).
+    Call after update_info, since it needs the main program's variables.
+    """
+    code = [ClassDecl(filename, "Obj"), MethodDef("$constructor")]
+    body = tree.get_assembly() if tree is not None else []
+    if len(var_list["Global"]["Constr"]) > 0:
+        li = []
+        for var in var_list["Global"]["Constr"]:
+            li.append(var)
+        code.append(LocalsDecl(tuple(li)))
+    code.append(Instr("enter"))
+
+    # Closing assembly for main file
+    code.extend(body)
+    code += [Instr("const", "nothing"), Instr("return", 0)]
+    return code
+
+def class_interface(name):
+    """What other classes need to know about class 'name' to be
+    type-checked and compiled against it: its parent, its methods
+    with their signatures (in vtable order), and its fields.
+    """
+    typ = types[name]
+    methods = {}
+    for method in typ.methods.values():
+        methods[method.name] = {"ret": method.ret, "params": dict(method.params)}
+    fields = {}
+    for key, var in var_list[name].items():
+        if key != "Constr" and key not in typ.methods:
+            fields[key] = sorted(t.name for t in var.typs)
+    return {"name": name, "parent": typ.parent.name, "methods": methods, "fields": fields}
+
+def declare_class(interface, imported=False):
+    """Make a class known to the type checker from its interface,
+    without compiling its source.  An imported class was built by
+    another program, which may also have extended it.
+    """
+    name = interface["name"]
+    methods = {}
+    for method_name, sig in interface["methods"].items():
+        methods[method_name] = Method(method_name, sig["ret"], dict(sig["params"]))
+    types[name] = Type(name, types[interface["parent"]], methods, {})
+    types[name].imported = imported
+    var_list[name] = {"Constr": {}}
+    for field, typ_names in interface["fields"].items():
+        v = VarType()
+        for typ_name in typ_names:
+            v.add_typ(types[typ_name])
+        v.valid = True
+        var_list[name][field] = v
+
 def main():
     if len(sys.argv) != 2:
         print("Usage: python3 parser.py [name]")
@@ -803,27 +1496,15 @@ def main():
         s = f.read()
 
     filename = sys.argv[1].split("/")[-1].split(".")[-2]
-    file_list.append(filename)
-
-    tree = Lark(quack_grammar, parser="lalr", transformer=BuildTree()).parse(s) # Build tree
-    tree.update_info() # Fills in missing type information
-
-    # Main file assembly
-    output = f".class {filename}:Obj\n.method $constructor\n"
-    if len(var_list["Global"]["Constr"]) > 0:
-        output += ".local "
-        li = []
-        for var in var_list["Global"]["Constr"]:
-            li.append(var)
-        output += ",".join(li)
-    output += "\tenter\n"
-
-    # Closing assembly for main file
-    output += tree.get_assembly()
-    output += "\tconst nothing\n\treturn 0"
+    try:
+        asm = compile_program(s, filename)
+    except CompileError as e:
+        sys.stderr.write(f"ERROR: {e}\n")
+        sys.exit(1)
 
-    with open(filename + ".asm", "w") as f:
-        f.write(output)
+    for name, code in asm.items():
+        with open(name + ".asm", "w") as f:
+            f.write(ir.dump(code))
 
     # List of built .asm files for the quack script
     print("\n".join(reversed(file_list)))
@@ -0,0 +1,278 @@
+"""Peephole optimization of tiny vm assembly code.
+
+The code generator in parser.py emits each construct on its own, which
+leaves redundant code where constructs meet: a variable stored and then
+loaded right back, jumps to jumps and to the very next instruction, and
+the jump/const ladders of 'not', 'and', and 'or' feeding the conditional
+jump of an 'if' or 'while'.  This pass cleans up the code of each method
+(a list of ir items) before it is assembled, by applying these rewrites
+until none applies:
+
+    Jump threading     jump/jump_if/jump_int_less/... L, where L: jump M
+                       ==> jump/jump_if/jump_int_less/... M
+    Constant branches  const true; [jump L,] L: jump_if M
+                       ==> jump M  (and likewise for false and jump_ifnot,
+                       jumping past the conditional jump when not taken)
+    Jumps to next      jump L; L:  ==> (nothing)
+                       jump_if L; L:  ==> pop
+                       jump_int_less L; L:  ==> pop; pop
+    Unreachable code   anything after jump or return, up to the next
+                       label that is jumped to; labels never jumped to
+    Dead stores        store x, where x is never loaded  ==> pop
+                       store x; load x, where that is the only load of x
+                       ==> (nothing)
+                       load x; store x  ==> (nothing)
+    Unused values      const k; pop  ==> (nothing)
+                       load x; pop  ==> (nothing)
+
+Labels are unique within a class (the assembler resolves them per
+class), so labels this pass adds are numbered to avoid those already used.
+"""
+
+import collections
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import ir
+from ir import ClassDecl, MethodDef, Label, Instr
+
+BRANCHES = ("jump_if", "jump_ifnot")
+INT_BRANCHES = ("jump_int_less", "jump_int_greater", "jump_int_le",   # Compare two Ints
+                "jump_int_ge", "jump_int_equals", "jump_int_ne")
+JUMPS = ("jump",) + BRANCHES + INT_BRANCHES
+PUSHES = ("const", "load")    # Push a value without side effects
+ENDS = ("jump", "return", "halt")   # Control never falls through
+
+
+class MethodStats(NamedTuple):
+    """Instructions in one method before and after optimization"""
+    class_name: str
+    method: str
+    before: int
+    after: int
+
+    @property
+    def removed(self) -> int:
+        return self.before - self.after
+
+    def __str__(self):
+        return (f"{self.class_name}:{self.method} {self.before} -> {self.after} "
+                f"instructions ({self.removed} removed)")
+
+
+class LabelMaker:
+    """Labels not already used in a class"""
+    def __init__(self, code: Iterable[ir.Item]):
+        self.taken = {item.name for item in code if type(item) is Label}
+        self.count = 0
+
+    def __call__(self) -> str:
+        while True:
+            name = f"peep{self.count}"
+            self.count += 1
+            if name not in self.taken:
+                self.taken.add(name)
+                return name
+
+
+def is_instr(item: Optional[ir.Item], *opnames: str) -> bool:
+    return type(item) is Instr and item.opname in opnames
+
+
+def label_index(body: List[ir.Item]) -> Dict[str, int]:
+    """Index of the first instruction at each label"""
+    index = {}
+    pending = []
+    for i, item in enumerate(body):
+        if type(item) is Label:
+            pending.append(item.name)
+        elif pending:
+            for name in pending:
+                index[name] = i
+            pending = []
+    for name in pending:
+        index[name] = len(body)
+    return index
+
+
+def thread_jumps(body: List[ir.Item], new_label: LabelMaker) -> List[ir.Item]:
+    index = label_index(body)
+
+    def final(label: str) -> str:
+        seen = set()
+        while label not in seen:  # A jump to itself is left alone
+            seen.add(label)
+            i = index.get(label, len(body))
+            if i == len(body) or not is_instr(body[i], "jump"):
+                break
+            label = body[i].operand
+        return label
+
+    out = []
+    for item in body:
+        if is_instr(item, *JUMPS):
+            item = Instr(item.opname, final(item.operand))
+        out.append(item)
+    return out
+
+
+def fold_branches(body: List[ir.Item], new_label: LabelMaker) -> List[ir.Item]:
+    index = label_index(body)
+    replace: Dict[int, Tuple[int, Instr]] = {}  # First index -> (end index, jump)
+    after: Dict[int, str] = {}   # Index of a branch -> label to add after it
+    for i, item in enumerate(body):
+        if not (is_instr(item, "const") and item.operand in ("true", "false")):
+            continue
+        j = i + 1
+        while j < len(body) and type(body[j]) is Label:
+            j += 1
+        if j == i + 1 and is_instr(body[j] if j < len(body) else None, "jump"):
+            k = index.get(body[j].operand, len(body))
+            end = j + 1
+        else:
+            k = j
+            end = i + 1
+        if k == len(body) or not is_instr(body[k], *BRANCHES):
+            continue
+        if (item.operand == "true") == (body[k].opname == "jump_if"):
+            target = body[k].operand
+        elif k + 1 < len(body) and type(body[k + 1]) is Label:
+            target = body[k + 1].name
+        else:
+            if k not in after:
+                after[k] = new_label()
+            target = after[k]
+        replace[i] = (end, Instr("jump", target))
+    if not replace:
+        return body
+    out = []
+    i = 0
+    while i < len(body):
+        if i in replace:
+            end, jump = replace[i]
+            out.append(jump)
+            i = end
+            continue
+        out.append(body[i])
+        if i in after:
+            out.append(Label(after[i]))
+        i += 1
+    return out
+
+
+def operands(jump: Instr) -> int:
+    """Values a jump pops from the stack"""
+    if jump.opname in INT_BRANCHES:
+        return 2
+    return 1 if jump.opname in BRANCHES else 0
+
+
+def drop_jumps_to_next(body: List[ir.Item], new_label: LabelMaker) -> List[ir.Item]:
+    out = []
+    for i, item in enumerate(body):
+        if is_instr(item, *JUMPS):
+            j = i + 1
+            while j < len(body) and type(body[j]) is Label:
+                if body[j].name == item.operand:
+                    # Still pop the operands of a conditional jump
+                    out.extend([Instr("pop")] * operands(item))
+                    item = None
+                    break
+                j += 1
+        if item is not None:
+            out.append(item)
+    return out
+
+
+def drop_unreachable(body: List[ir.Item], new_label: LabelMaker) -> List[ir.Item]:
+    referenced = {item.operand for item in body if is_instr(item, *JUMPS)}
+    out = []
+    reachable = True
+    for item in body:
+        if type(item) is Label:
+            if item.name in referenced:
+                out.append(item)
+                reachable = True
+        elif reachable:
+            out.append(item)
+            if item.opname in ENDS:
+                reachable = False
+    return out
+
+
+def drop_dead_values(body: List[ir.Item], new_label: LabelMaker) -> List[ir.Item]:
+    loads = collections.Counter(item.operand for item in body if is_instr(item, "load"))
+    out = []
+    i = 0
+    while i < len(body):
+        item = body[i]
+        following = body[i + 1] if i + 1 < len(body) else None
+        if is_instr(item, "store") and loads[item.operand] == 0:
+            out.append(Instr("pop"))
+        elif (is_instr(item, "store") and loads[item.operand] == 1
+              and is_instr(following, "load") and following.operand == item.operand):
+            i += 2
+            continue
+        elif (is_instr(item, "load") and is_instr(following, "store")
+              and following.operand == item.operand):
+            i += 2
+            continue
+        elif is_instr(item, *PUSHES) and is_instr(following, "pop"):
+            i += 2
+            continue
+        else:
+            out.append(item)
+        i += 1
+    return out
+
+
+PASSES = [thread_jumps, fold_branches, drop_jumps_to_next,
+          drop_unreachable, drop_dead_values]
+
+
+def optimize_method(body: List[ir.Item], new_label: LabelMaker) -> List[ir.Item]:
+    """Optimized labels and instructions of one method"""
+    changed = True
+    while changed:
+        changed = False
+        for rewrite in PASSES:
+            rewritten = rewrite(body, new_label)
+            if rewritten != body:
+                body = rewritten
+                changed = True
+    return body
+
+
+def optimize(code: List[ir.Item], stats: Optional[List[MethodStats]] = None
+             ) -> List[ir.Item]:
+    """Optimized assembly code of a class.  If stats is
+    given, the statistics of each method are appended to it.
+    """
+    new_label = LabelMaker(code)
+    out: List[ir.Item] = []
+    class_name = None
+    method = None
+    body: List[ir.Item] = []
+
+    def flush():
+        if not body:
+            return
+        optimized = optimize_method(body, new_label)
+        if stats is not None:
+            before = sum(1 for item in body if type(item) is Instr)
+            after = sum(1 for item in optimized if type(item) is Instr)
+            stats.append(MethodStats(class_name, method, before, after))
+        out.extend(optimized)
+        body.clear()
+
+    for item in code:
+        if type(item) in (Label, Instr):
+            body.append(item)
+            continue
+        flush()
+        if type(item) is ClassDecl:
+            class_name = item.name
+        elif type(item) is MethodDef:
+            method = item.name
+        out.append(item)
+    flush()
+    return out
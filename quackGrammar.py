@@ -1,8 +1,7 @@
 quack_grammar = r"""
     ?start: program
 
-    ?program: statement
-        | program statement
+    program: statement+
 
     statement: rexp ";"
         | assignment ";"
@@ -93,7 +92,7 @@ quack_grammar = r"""
     ?bool: "true"                -> true
         | "false"               -> false
 
-    COMMENT: "/*" /(.|\n)*/ "*/"
+    COMMENT: "/*" /(.|\n)*?/ "*/"
 
     %import common.CNAME        -> NAME
     %import common.INT
@@ -0,0 +1,166 @@
+"""A compile server that keeps the compiler warm.
+
+Each run of driver.py pays for starting Python, importing Lark and
+the compiler, loading the parser tables, and reading opdefs.txt
+before it compiles anything.  This server does all of that once, then
+listens on a Unix socket (see quackd_client.socket_path) for compile
+requests from quackd_client.py.
+
+Each request is served by a process forked from the warm server, which
+runs the driver with the request's arguments, in the client's working
+directory, with the client's standard input, output, and error (passed
+over the socket).  The compiler's global state lives and dies in that
+process, so requests are isolated from each other and from the server,
+and several can run at once.
+
+The server exits when any source file of the compiler changes, rather
+than compile with stale code; clients then compile on their own.
+
+    python3 quackd.py &             # start the server
+    python3 quackd_client.py hello.qk
+"""
+
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import traceback
+from pathlib import Path
+from typing import Dict, Tuple
+
+import quackd_client
+import parser as quack
+import buildcache
+import driver
+
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+MAX_REQUEST = 1 << 16
+SERVER_FILES = buildcache.TOOLCHAIN_FILES + ["quackd.py"]
+
+
+def cli() -> object:
+    parser = argparse.ArgumentParser(
+        description="Serve compile requests from quackd_client.py")
+    parser.add_argument("--socket", type=Path, default=quackd_client.socket_path(),
+                        help="Unix socket to listen on")
+    return parser.parse_args()
+
+
+def source_stamp() -> Dict[str, Tuple[int, int]]:
+    """Enough to tell whether the compiler's source has changed"""
+    stamp = {}
+    for name in SERVER_FILES:
+        try:
+            stat = buildcache.ROOT.joinpath(name).stat()
+            stamp[name] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            stamp[name] = None
+    return stamp
+
+
+def warm_up():
+    """Everything a compile needs that does not depend on the program"""
+    quack.get_parser()
+    quack.tree_parser = quack.build_parser(transformer=False)
+    buildcache.toolchain_version()
+
+
+def listen(path: Path) -> socket.socket:
+    """A socket listening at path, replacing the
+    socket of a server that is no longer running
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        try:
+            quackd_client.connect(path).close()
+        except OSError:
+            path.unlink()
+        else:
+            raise OSError(f"A server is already listening on {path}")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(path))
+    server.listen()
+    return server
+
+
+def receive_request(conn: socket.socket) -> dict:
+    message, fds, _, _ = socket.recv_fds(conn, MAX_REQUEST, 3)
+    while not message.endswith(b"\n"):
+        more = conn.recv(MAX_REQUEST)
+        if not more:
+            break
+        message += more
+    # The client's stdin, stdout, and stderr become ours
+    for fd, target in zip(fds, range(3)):
+        os.dup2(fd, target)
+        os.close(fd)
+    return json.loads(message)
+
+
+def serve_request(conn: socket.socket) -> int:
+    """Runs in the forked process; returns the driver's exit status"""
+    request = receive_request(conn)
+    os.chdir(request["cwd"])
+    sys.argv = [str(quackd_client.DRIVER)] + request["argv"]
+    try:
+        status = driver.main()
+    except SystemExit as e:  # From argparse
+        status = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception:
+        traceback.print_exc()
+        status = driver.EXIT_COMPILE_ERROR
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return status
+
+
+def serve(server: socket.socket):
+    stamp = source_stamp()
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)  # Children reap themselves
+    while True:
+        conn, _ = server.accept()
+        if source_stamp() != stamp:
+            log.info("Compiler source changed; exiting")
+            conn.close()
+            return
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if os.fork() == 0:
+            server.close()
+            try:
+                status = serve_request(conn)
+                conn.sendall((json.dumps({"status": status}) + "\n").encode("utf-8"))
+            finally:
+                os._exit(0)
+        conn.close()
+
+
+def main() -> int:
+    args = cli()
+    warm_up()
+    try:
+        server = listen(args.socket)
+    except OSError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    # Let SIGTERM clean up like ^C does
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    log.info(f"Listening on {args.socket}")
+    try:
+        serve(server)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        args.socket.unlink(missing_ok=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
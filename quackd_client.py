@@ -0,0 +1,81 @@
+"""Thin client for the compile server (quackd.py).
+
+Takes the same arguments as driver.py, and has the server compile the
+program in a process forked from its warm state.  The client passes
+its standard input, output, and error to the server along with the
+request, so the compile writes straight to them, and exits with the
+driver's exit status.
+
+If no server is running (or the server is out of date, see quackd.py),
+the client runs driver.py itself, so it can always stand in for
+"python3 driver.py".
+
+This module is kept small and imports nothing from the compiler, so
+that starting it costs little more than starting Python.
+"""
+
+import json
+import os
+import socket
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+DRIVER = ROOT.joinpath("driver.py")
+
+
+def socket_path() -> Path:
+    """Where the server listens: $QUACKD_SOCKET, or in the
+    cache directory of this copy of the compiler
+    """
+    path = os.environ.get("QUACKD_SOCKET")
+    if path:
+        return Path(path)
+    return ROOT.joinpath(".quack_cache", "quackd.sock")
+
+
+def connect(path: Path = None) -> socket.socket:
+    """Raises OSError if no server is listening"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(path or socket_path()))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def request(sock: socket.socket, argv) -> int:
+    """Exit status of compiling with driver.py arguments argv,
+    or None if the server closed the connection without compiling
+    """
+    message = json.dumps({"argv": list(argv), "cwd": os.getcwd()}) + "\n"
+    socket.send_fds(sock, [message.encode("utf-8")], [0, 1, 2])
+    reply = sock.makefile("r").readline()
+    if not reply:
+        return None
+    return json.loads(reply)["status"]
+
+
+def run_locally(argv):
+    os.execv(sys.executable, [sys.executable, str(DRIVER)] + list(argv))
+
+
+def main():
+    argv = sys.argv[1:]
+    try:
+        sock = connect()
+    except OSError:
+        run_locally(argv)
+    with sock:
+        try:
+            status = request(sock, argv)
+        except OSError:
+            status = None
+    if status is None:
+        run_locally(argv)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,12 @@
+# The assembler fails on this class (there is no such
+# instruction as shout), and so must not leave an object file
+.class BadBase:Obj
+.method $constructor
+    enter
+    load $
+    return 0
+.method greet
+    enter
+    const "Hello\n"
+    shout
+    return 0
@@ -0,0 +1,11 @@
+# Refers to BadBase, which fails to assemble, and so
+# must not be assembled against an old object file of BadBase
+.class UsesBadBase:Obj
+.method $constructor
+    enter
+    new BadBase
+    call BadBase:$constructor
+    call BadBase:greet
+    pop
+    const nothing
+    return 0
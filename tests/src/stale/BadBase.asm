@@ -0,0 +1,12 @@
+# An earlier version of BadBase, which assembled;
+# its object file is left in OBJ when the tests start
+.class BadBase:Obj
+.method $constructor
+    enter
+    load $
+    return 0
+.method greet
+    enter
+    const "Hello from an old BadBase\n"
+    call String:print
+    return 0
@@ -1,5 +1,5 @@
-"""Simple test script for Ori (tiny vm) asm files.
-(Extend later to work with Quack compilation)
+"""Simple test script for Ori (tiny vm) asm files,
+and for Quack programs compiled with the driver.
 
 FIXME: There must be better ways to handle file dependencies
 """
@@ -21,8 +21,9 @@ log.setLevel(logging.INFO)
 PY = "python3"
 ROOT = ".."
 ASM = f"{ROOT}/assemble.py"
+DRIVER = f"{ROOT}/driver.py"
 VM = f"{ROOT}/bin/tiny_vm"
-BUILTINS = ["Bool.json", "Int.json", "Nothing.json", "Obj.json", "String.json"]
+BUILTINS = ["Boolean.json", "Int.json", "Nothing.json", "Obj.json", "String.json"]
 ASMREQS = ["asm.conf", "opdefs.txt"]
 
 def install_prereqs():
@@ -40,25 +41,67 @@ def install_prereqs():
         log.debug(f"Copying {origin} to {copied}")
         shutil.copyfile(origin, copied)
 
-def assemble(class_name: str) -> bool:
-    """Translate src/Class.asm to OBJ/Class.json.
+def clean_objects():
+    """Remove the object and interface files left by earlier runs
+    (all but the json of the builtin classes), so that no test
+    passes on an old one
+    """
+    for pattern in ("*.tvm", "*.qki"):
+        for obj in pathlib.Path("./OBJ").glob(pattern):
+            obj.unlink()
+
+
+def install_stale(class_names: list):
+    """Assemble src/stale/Class.asm, an earlier version of a class,
+    to OBJ/Class.tvm, as if left there by an earlier build, for each
+    class that has one.  Cases checking that the assembler does not
+    use old object files have them.
+    """
+    for name in class_names:
+        stale = pathlib.Path("./src/stale/" + name + ".asm")
+        if stale.exists():
+            subprocess.run([PY, ASM, stale, "./OBJ/" + name + ".tvm"],
+                           stderr=subprocess.DEVNULL, check=True)
+
+
+def assemble(class_names: list) -> set:
+    """Translate src/Class.asm to OBJ/Class.tvm for each class,
+    in one run of the assembler, which assembles each class after
+    the classes it depends on.  Returns the classes translated.
     Separated because some classes (e.g., Counter) cannot
     be run as main programs.  (Main program class constructors
     cannot have arguments.)
     """
-    src = pathlib.Path("./src/" + class_name + ".asm")
-    obj = pathlib.Path("./OBJ/" + class_name + ".json")
-    try:
-        proc = subprocess.run([PY, ASM, src, obj], text=True)
-        proc.check_returncode() # May throw CalledProcessError
-    except subprocess.CalledProcessError:
-        log.warning(f"Assembler crashed on {src}")
+    srcs = [pathlib.Path("./src/" + name + ".asm") for name in class_names]
+    objs = {name: pathlib.Path("./OBJ/" + name + ".tvm") for name in class_names}
+    for obj in objs.values():
+        obj.unlink(missing_ok=True)
+    install_stale(class_names)
+    proc = subprocess.run([PY, ASM, "--obj", "OBJ"] + srcs, text=True)
+    if proc.returncode:
+        log.warning(f"Assembler reported errors")
+    assembled = {name for name, obj in objs.items() if obj.exists()}
+    for name in class_names:
+        if name not in assembled:
+            log.warning(f"Assembler crashed on src/{name}.asm")
+    return assembled
+
+
+def compile_quack(program: str) -> bool:
+    """Compile src/program.qk to object code in OBJ, with its
+    main class named program.  Returns True iff it compiled.
+    """
+    src = pathlib.Path("./src/" + program + ".qk")
+    proc = subprocess.run([PY, DRIVER, src, "--obj", "OBJ", "--no-cache"],
+                          text=True, stdout=subprocess.DEVNULL)
+    if proc.returncode:
+        log.warning(f"Could not compile {src}")
         return False
     return True
 
 
-def test_class(class_name: str) -> bool:
-    """Assemble, run, and check a single test case
+def test_class(class_name: str, assembled: set) -> bool:
+    """Run and check a single test case
     for a class C, in src/C.asm, with expected output
     in expect/C_stdout.txt.  Returns True iff test case
     has expected outcome.
@@ -67,7 +110,7 @@ def test_class(class_name: str) -> bool:
     observed_stdout = pathlib.Path("out/" + class_name + "_stdout.txt")
     observed_stderr = pathlib.Path("out/" + class_name + "_stderr.txt")
     expect_stdout = pathlib.Path("expect/" + class_name + "_stdout.txt")
-    if not assemble(class_name):
+    if class_name not in assembled:
         return False
     try:
         std_out = open(observed_stdout, "w")
@@ -75,7 +118,10 @@ def test_class(class_name: str) -> bool:
         proc = subprocess.run([VM, class_name], text=True,
                               stdout=std_out, stderr=std_err)
         proc.check_returncode() # May throw CalledProcessError
-        if filecmp.cmp(observed_stdout, expect_stdout):
+        if not expect_stdout.exists():
+            log.warning(f"No expected output {expect_stdout}")
+            ok = False
+        elif filecmp.cmp(observed_stdout, expect_stdout):
             log.info(f"OK: {class_name} produced expected output")
         else:
             log.info(f"{class_name} output did not match expectation")
@@ -89,22 +135,33 @@ def test_class(class_name: str) -> bool:
 def main():
     """Stub"""
     install_prereqs()
+    clean_objects()
     with open("src/TESTS.csv") as cases:
-        case_reader = csv.DictReader(cases)
-        for case in case_reader:
-            class_name = case["Class"]
-            action = case["Action"]
-            if action == "assemble":
-                # Assemble but do not execute
-                log.info(f"Class '{class_name} -- assemble only")
-                ok = assemble(class_name)
-            elif action == "run":
-                log.info(f"Class '{class_name} -- assemble and run")
-                ok = test_class(class_name)
-            else:
-                log.error(f"Unrecognized action '{action}' for class {class_name}")
-            if not ok:
-                print(f"*** Failed test case: {action} {class_name}", file=sys.stderr)
+        case_list = list(csv.DictReader(cases))
+    # The assembler orders the classes itself
+    assembled = assemble([case["Class"] for case in case_list
+                          if case["Action"] != "quack"])
+    for case in case_list:
+        class_name = case["Class"]
+        action = case["Action"]
+        if action == "assemble":
+            # Assemble but do not execute
+            log.info(f"Class '{class_name} -- assemble only")
+            ok = class_name in assembled
+        elif action == "run":
+            log.info(f"Class '{class_name} -- assemble and run")
+            ok = test_class(class_name, assembled)
+        elif action == "fail":
+            # The assembler must fail, leaving no object file
+            log.info(f"Class '{class_name} -- fail to assemble")
+            ok = class_name not in assembled
+        elif action == "quack":
+            log.info(f"Program '{class_name} -- compile and run")
+            ok = compile_quack(class_name) and test_class(class_name, {class_name})
+        else:
+            log.error(f"Unrecognized action '{action}' for class {class_name}")
+        if not ok:
+            print(f"*** Failed test case: {action} {class_name}", file=sys.stderr)
     # FIXME: Add a check for omitted source files
     print("Testing complete")
 
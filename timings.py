@@ -0,0 +1,106 @@
+"""Wall time and counts for the phases of a compile.
+
+The driver records, for the program and for each class it compiles:
+
+Phases (seconds)
+    parse        Lark lexing and LALR parsing
+    build_tree   BuildTree, turning the parse tree into AST nodes
+    fold         constant folding
+    type_check   update_info type inference
+    codegen      get_assembly
+    peephole     peephole optimization
+    frames       sharing of local variable slots
+    assemble     assembly of ir items into object code
+    write        encoding and writing the object file
+
+Counts
+    ast_nodes     AST nodes created (parser.node_count)
+    instructions  instructions assembled (after peephole optimization)
+    constants     constants in the object code
+    labels        labels in the object code
+    words         words of object code
+
+The totals for the program include classes reused from the build
+cache, which have no phases of their own (they are counted as
+"reused").  A program that could not be split into classes is parsed
+and type-checked as a whole, and those phases appear only in the totals.
+"""
+
+import json
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+PHASES = ["parse", "build_tree", "fold", "type_check", "codegen",
+          "peephole", "frames", "assemble", "write"]
+
+
+class Timings:
+    """Phase times and counts for a program and for each of its classes"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.phases: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.classes: Dict[str, "Timings"] = {}
+
+    def of_class(self, name: str) -> "Timings":
+        if name not in self.classes:
+            self.classes[name] = Timings(name)
+        return self.classes[name]
+
+    @contextmanager
+    def phase(self, phase: str, class_name: Optional[str] = None):
+        """Time the body of the with statement as (part of) a phase
+        of the program, and of class_name if given.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[phase] = self.phases.get(phase, 0.0) + elapsed
+            if class_name is not None:
+                self.of_class(class_name).phases[phase] = \
+                    self.of_class(class_name).phases.get(phase, 0.0) + elapsed
+
+    def timer(self, class_name: Optional[str] = None):
+        """phase(...) as a function of the phase alone"""
+        return lambda phase: self.phase(phase, class_name)
+
+    def count(self, counter: str, n: int = 1, class_name: Optional[str] = None):
+        self.counts[counter] = self.counts.get(counter, 0) + n
+        if class_name is not None:
+            counts = self.of_class(class_name).counts
+            counts[counter] = counts.get(counter, 0) + n
+
+    def total(self) -> float:
+        return sum(self.phases.values())
+
+    def as_dict(self) -> dict:
+        d = {"name": self.name,
+             "seconds": self.total(),
+             "phases": self.phases,
+             "counts": self.counts}
+        if self.classes:
+            d["classes"] = {name: c.as_dict() for name, c in self.classes.items()}
+        return d
+
+    def json(self) -> str:
+        return json.dumps(self.as_dict(), indent=2)
+
+    def text(self) -> str:
+        """A table with a row for each class and the program"""
+        columns = [p for p in PHASES if p in self.phases]
+        counters = sorted(self.counts)
+        rows = list(self.classes.values()) + [self]
+        width = max(len(row.name) for row in rows) + 2
+        lines = ["".join([f"{'':<{width}}"] + [f"{p:>11}" for p in columns + ["total"]]
+                         + [f"{c:>13}" for c in counters])]
+        for row in rows:
+            name = "= " + row.name if row is self else row.name
+            times = [row.phases.get(p) for p in columns] + [row.total()]
+            cells = [f"{'':>11}" if t is None else f"{t * 1000:9.2f}ms" for t in times]
+            cells += [f"{row.counts.get(c, ''):>13}" for c in counters]
+            lines.append("".join([f"{name:<{width}}"] + cells))
+        return "\n".join(lines)
@@ -0,0 +1,122 @@
+"""
+Benchmark the throughput of the assembler, in lines per second, on
+generated assembly code like the compiler's:  reading the lines
+with the regular expression for each kind of line in turn
+(assemble.match_line) and with the lexer (assemble.parse_lines), and
+assembling them into object code (assemble.translate) with each.
+
+Run from the repository root:  python3 tools/bench_assemble.py [-n 200000]
+"""
+
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import assemble
+
+
+def cli() -> object:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser("Lines per second read and assembled")
+    parser.add_argument("-n", "--lines", type=int, default=200000,
+                        help="Lines of assembly code, about (default 200000)")
+    parser.add_argument("-m", "--methods", type=int, default=20,
+                        help="Methods of each generated class (default 20)")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Runs of each measurement; the fastest is reported (default 3)")
+    return parser.parse_args()
+
+
+def method_lines(m: int) -> List[str]:
+    """A method with a loop, as the compiler would generate it"""
+    return [f".method m{m}",
+            ".args a,b",
+            ".local i,s",
+            "    enter",
+            "    const 0",
+            "    store i",
+            '    const "item"   # a string constant',
+            "    store s",
+            f"loop{m}:",
+            "    load i",
+            "    load a",
+            f"    jump_int_ge done{m}",
+            "    load s",
+            "    call String:print",
+            "    pop",
+            "    load i",
+            "    const 1",
+            "    int_plus",
+            "    store i",
+            f"    jump loop{m}",
+            f"done{m}:  load b",
+            "    load i",
+            "    call Int:plus",
+            "    return 2",
+            ""]
+
+
+def classes(n: int, methods: int) -> List[List[str]]:
+    """About n lines of classes of generated methods"""
+    sources = []
+    total = 0
+    while total < n:
+        lines = [f".class Generated{len(sources)}:Obj", ".field count"]
+        for m in range(methods):
+            lines += method_lines(m)
+        sources.append(lines)
+        total += len(lines)
+    return sources
+
+
+def read_with_patterns(lines: List[str]) -> List:
+    items = []
+    for line in lines:
+        line = assemble.strip_comments(line)
+        if line:
+            items.extend(assemble.match_line(line))
+    return items
+
+
+def each(function, sources: List[List[str]]):
+    """Apply function to each class, keeping none of the results"""
+    for lines in sources:
+        function(lines)
+
+
+def fastest(repeat: int, action) -> float:
+    """Shortest wall time of repeat runs of action()"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        action()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    args = cli()
+    assemble.log.setLevel(logging.WARNING)
+    sources = classes(args.lines, args.methods)
+    n = sum(len(lines) for lines in sources)
+    for lines in sources:
+        assert read_with_patterns(lines) == list(assemble.parse_lines(lines))
+    cases = [
+        ("read, patterns", read_with_patterns),
+        ("read, lexer", lambda lines: list(assemble.parse_lines(lines))),
+        ("assemble, patterns", lambda lines: assemble.translate_ir(read_with_patterns(lines))),
+        ("assemble, lexer", assemble.translate),
+    ]
+    print(f"{n} lines in {len(sources)} classes")
+    print(f"{'':<20}{'seconds':>10}{'lines/s':>14}")
+    for name, function in cases:
+        seconds = fastest(args.repeat, lambda: each(function, sources))
+        print(f"{name:<20}{seconds:10.3f}{n / seconds:14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark the cost of each Int operation on the vm, compiled as a
+call of the Int method (roll, call, and the native method's frame)
+and as the inline Int instruction (int_plus, ...).
+
+For each operation, a loop of n iterations runs it once per iteration;
+the time of the same loop without it is subtracted, and the rest is
+divided by n.  Needs a built vm (see README.md).
+
+Run from the repository root:  python3 tools/bench_int_ops.py [-n 10000]
+"""
+
+import argparse
+import logging
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import parser as quack
+import assemble
+import batch
+import driver
+
+ROOT = Path(__file__).resolve().parent.parent
+
+OPERATORS = {"plus": "+", "sub": "-", "mult": "*", "div": "/",
+             "less": "<", "greater": ">", "LE": "<=", "GE": ">=",
+             "equals": "=="}
+
+
+def cli() -> object:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser("Time Int operations on the vm")
+    parser.add_argument("-n", "--iterations", type=int, default=10000,
+                        help="Iterations of each loop (default 10000)")
+    parser.add_argument("--vm", type=Path, default=ROOT.joinpath("tiny_vm"),
+                        help="The vm executable (default ./tiny_vm)")
+    return parser.parse_args()
+
+
+def loop(n: int, operator: str = None) -> str:
+    """A loop of n iterations, each computing x operator 3 if given"""
+    body = f"r = x {operator} 3;" if operator else "r = x;"
+    return (f"i = 0;\n"
+            f"x = 7;\n"
+            f"while i < {n} {{\n"
+            f"    {body}\n"
+            f"    i = i + 1;\n"
+            f"}}\n")
+
+
+def run_seconds(vm: Path, source: str, specialized: bool) -> float:
+    """Compile source, then the wall time of running it"""
+    quack.int_opcodes = specialized
+    with tempfile.TemporaryDirectory() as obj_dir:
+        obj_dir = Path(obj_dir)
+        batch.install_builtins(obj_dir)
+        driver.compile_file(source, "Loop", obj_dir, use_cache=False)
+        start = time.perf_counter()
+        subprocess.run([str(vm), "-L", str(obj_dir), "Loop"], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return time.perf_counter() - start
+
+
+def main():
+    args = cli()
+    assemble.log.setLevel(logging.WARNING)
+    n = args.iterations
+    baseline = {mode: run_seconds(args.vm, loop(n), mode) for mode in (False, True)}
+    print(f"{'':<10}{'call':>12}{'inline':>12}{'speedup':>10}   (microseconds per operation)")
+    for method, operator in OPERATORS.items():
+        costs = []
+        for mode in (False, True):
+            seconds = run_seconds(args.vm, loop(n, operator), mode)
+            costs.append(max(seconds - baseline[mode], 0.0) / n * 1e6)
+        call, inline = costs
+        speedup = f"{call / inline:9.1f}x" if inline > 0 else f"{'-':>10}"
+        print(f"{method:<10}{call:12.2f}{inline:12.2f}{speedup}")
+    quack.int_opcodes = True
+
+
+if __name__ == "__main__":
+    main()
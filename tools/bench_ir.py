@@ -0,0 +1,67 @@
+"""
+Benchmark code generation and assembly of one very long method,
+comparing the in-memory ir handoff with a round trip through
+assembly text (dump, then parse with the assembler's regexes).
+
+Run from the repository root:  python3 tools/bench_ir.py [-n 10000]
+"""
+
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import parser as quack
+import assemble
+import ir
+
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+
+def cli() -> object:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser("Time codegen and assembly of a long method")
+    parser.add_argument("-n", "--statements", type=int, default=10000,
+                        help="Statements in the method (default 10000)")
+    return parser.parse_args()
+
+
+def long_method(n: int) -> str:
+    """A class whose one method has n statements"""
+    body = "\n".join(f"        x = x + {i};" for i in range(n))
+    return ("class Big() {\n"
+            "    def run(): Int {\n"
+            "        x = 0;\n"
+            f"{body}\n"
+            "        return x;\n"
+            "    }\n"
+            "}\n")
+
+
+def timed(label: str, f):
+    start = time.perf_counter()
+    result = f()
+    print(f"{label:<28} {(time.perf_counter() - start) * 1000:9.1f} ms")
+    return result
+
+
+def main():
+    args = cli()
+    assemble.log.setLevel(logging.INFO)
+    quack.reset()
+    tree = timed("parse", lambda: quack.get_parser().parse(long_method(args.statements)))
+    timed("type check", tree.update_info)
+    timed("codegen to ir", tree.get_assembly)
+    code = quack.class_asm["Big"]
+    print(f"{len(code)} ir items")
+    text = timed("dump to text", lambda: ir.dump(code))
+    timed("assemble from text", lambda: assemble.translate(text.splitlines()))
+    timed("assemble from ir", lambda: assemble.translate_ir(code))
+
+
+if __name__ == "__main__":
+    main()
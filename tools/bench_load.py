@@ -0,0 +1,139 @@
+"""
+Benchmark reading object files in the binary format (.tvm) and in
+json: their size, the time the assembler takes to read one back (as
+it does for each class it imports), and the wall time of the vm
+loading a program from each.
+
+The classes are generated:  each has the given number of methods,
+each method using one constant and pushing and popping "this" the
+given number of times.  The vm's code space (CODE_CAPACITY words)
+limits the classes it can load, so the vm runs load fewer and smaller
+ones (--vm-classes, --vm-methods).  Needs a built vm (see README.md).
+
+Run from the repository root:  python3 tools/bench_load.py [--methods 40]
+"""
+
+import argparse
+import logging
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import assemble
+import batch
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def cli() -> object:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser("Time loading binary and json object files")
+    parser.add_argument("--classes", type=int, default=8,
+                        help="Classes generated (default 8)")
+    parser.add_argument("--methods", type=int, default=40,
+                        help="Methods of each class (default 40)")
+    parser.add_argument("--ops", type=int, default=10,
+                        help="Pairs of load and pop in each method (default 10)")
+    parser.add_argument("--vm-classes", type=int, default=4,
+                        help="Classes loaded by the vm (default 4)")
+    parser.add_argument("--vm-methods", type=int, default=8,
+                        help="Methods of each class loaded by the vm (default 8)")
+    parser.add_argument("-r", "--repeat", type=int, default=20,
+                        help="Runs of each measurement; the fastest is reported (default 20)")
+    parser.add_argument("--vm", type=Path, default=ROOT.joinpath("tiny_vm"),
+                        help="The vm executable (default ./tiny_vm)")
+    return parser.parse_args()
+
+
+def class_source(name: str, methods: int, ops: int) -> str:
+    """Assembly code of a generated class"""
+    lines = [f".class {name}:Obj"]
+    for m in range(methods):
+        lines += [f".method m{m}", "    enter", f'    const "m{m}"', "    pop"]
+        lines += ["    load $", "    pop"] * ops
+        lines += ["    const nothing", "    return 0"]
+    return "\n".join(lines) + "\n"
+
+
+MAIN_SOURCE = """.class LoadMain:Obj
+.method $constructor
+    enter
+    load $
+    return 0
+"""
+
+
+def fastest(repeat: int, action) -> float:
+    """Shortest wall time of repeat runs of action()"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        action()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def write_objects(obj_dir: Path, sources: dict, suffixes: list):
+    """Assemble each source into obj_dir, in each format of suffixes"""
+    for name, source in sources.items():
+        objcode = assemble.translate(source.splitlines())
+        for suffix in suffixes:
+            path = obj_dir.joinpath(name).with_suffix(suffix)
+            if suffix == assemble.OBJ_SUFFIX:
+                path.write_bytes(objcode.binary())
+            else:
+                path.write_text(objcode.json() + "\n")
+
+
+def run_vm(vm: Path, obj_dir: Path, classes: list):
+    subprocess.run([str(vm), "-L", str(obj_dir)] + classes, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main():
+    args = cli()
+    assemble.log.setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as obj_dir:
+        obj_dir = Path(obj_dir)
+        batch.install_builtins(obj_dir)
+        assemble.CONFIG.tvmlib = obj_dir
+
+        # Reading object files back, as the assembler does for imports
+        sources = {f"Big{c}": class_source(f"Big{c}", args.methods, args.ops)
+                   for c in range(args.classes)}
+        write_objects(obj_dir, sources, [assemble.OBJ_SUFFIX, ".json"])
+        print(f"{args.classes} classes of {args.methods} methods")
+        print(f"{'':<8}{'bytes':>12}{'read (ms)':>12}")
+        for suffix in (assemble.OBJ_SUFFIX, ".json"):
+            paths = [obj_dir.joinpath(name).with_suffix(suffix) for name in sources]
+            size = sum(path.stat().st_size for path in paths)
+            seconds = fastest(args.repeat,
+                              lambda: [assemble.ImportedModule.load(path) for path in paths])
+            print(f"{suffix:<8}{size:12d}{seconds * 1e3:12.2f}")
+
+        # Loading into the vm
+        sources = {f"Run{c}": class_source(f"Run{c}", args.vm_methods, args.ops)
+                   for c in range(args.vm_classes)}
+        sources["LoadMain"] = MAIN_SOURCE
+        classes = list(sources)
+        write_objects(obj_dir, sources, [assemble.OBJ_SUFFIX, ".json"])
+        print(f"\nvm loading {args.vm_classes} classes of {args.vm_methods} methods")
+        print(f"{'':<8}{'bytes':>12}{'wall (ms)':>12}")
+        binary_seconds = fastest(args.repeat, lambda: run_vm(args.vm, obj_dir, classes))
+        size = sum(obj_dir.joinpath(name).with_suffix(assemble.OBJ_SUFFIX).stat().st_size
+                   for name in classes)
+        print(f"{assemble.OBJ_SUFFIX:<8}{size:12d}{binary_seconds * 1e3:12.2f}")
+        # The vm falls back to the json when there is no .tvm
+        for name in classes:
+            obj_dir.joinpath(name).with_suffix(assemble.OBJ_SUFFIX).unlink()
+        json_seconds = fastest(args.repeat, lambda: run_vm(args.vm, obj_dir, classes))
+        size = sum(obj_dir.joinpath(name).with_suffix(".json").stat().st_size
+                   for name in classes)
+        print(f"{'.json':<8}{size:12d}{json_seconds * 1e3:12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Regression benchmark: compile a program of 100,000 statements.
+
+Half the statements are at the top level and half in the block of an
+if statement, so that both kinds of statement sequence are long.  The
+compile runs with Python's default recursion limit, and fails (exit
+status 1) if the compiler recurses once per statement.
+
+Run from the repository root:  python3 tools/bench_long_program.py [-n 100000]
+"""
+
+import argparse
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import assemble
+import batch
+import driver
+from timings import Timings
+
+
+def cli() -> object:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser("Time compiling a very long program")
+    parser.add_argument("-n", "--statements", type=int, default=100000,
+                        help="Statements in the program (default 100000)")
+    return parser.parse_args()
+
+
+def long_program(n: int) -> str:
+    """A program of n statements, about half of them in an if block"""
+    top = n // 2
+    inner = n - top - 2
+    lines = ["x = 0;"]
+    lines += [f"x = x + {i};" for i in range(top - 1)]
+    lines.append("if x > 0 {")
+    lines += [f"    x = x - {i};" for i in range(inner)]
+    lines += ["}", "x.print();"]
+    return "\n".join(lines) + "\n"
+
+
+def main() -> int:
+    args = cli()
+    assemble.log.setLevel(logging.WARNING)
+    source = long_program(args.statements)
+    timings = Timings("Long")
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as obj_dir:
+        obj_dir = Path(obj_dir)
+        batch.install_builtins(obj_dir)
+        try:
+            driver.compile_file(source, "Long", obj_dir, use_cache=False, timings=timings)
+        except RecursionError as e:
+            print(f"FAILED: {args.statements} statements: RecursionError: {e}")
+            return 1
+    print(timings.text())
+    print(f"{args.statements} statements compiled in {time.perf_counter() - start:.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""
+Benchmark how the compiler scales with the size of a program.
+
+Grows one dimension of a synthetic program at a time (see
+gen_program.py), holding the others at their defaults, and measures
+the time of each compiler phase (see timings.py) and the peak memory
+of a full compile, from parsing to object files.  Each measurement runs
+in a fresh process, so that memory and the compiler's global state
+do not carry over from one to the next.
+
+The cost of a phase per AST node should not grow with the program.
+Where it does, as a power of the dimension more than THRESHOLD, the
+phase is flagged as super-linear in that dimension (for instance,
+string concatenation, symbol lookup by list.index, or common ancestor
+searches that redo work for every use).  With --profile, the functions
+taking the most time in the largest program of a flagged dimension are
+listed.
+
+Run from the repository root:
+    python3 tools/bench_scaling.py [--dimension classes] [--sizes 8,16,32]
+"""
+
+import argparse
+import cProfile
+import json
+import logging
+import math
+import pstats
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import gen_program
+from gen_program import Config
+
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+SIZES = {
+    "classes": [4, 8, 16, 32, 64],
+    "methods": [2, 4, 8, 16, 32],
+    "depth": [1, 2, 4, 8],
+    "statements": [8, 16, 32, 64, 128],
+    "nesting": [1, 2, 4, 8, 16],
+    "expr_depth": [2, 4, 8, 16, 32],
+}
+THRESHOLD = 0.25    # Growth exponent of the cost per AST node
+MIN_SECONDS = 0.002  # Phases faster than this are noise
+
+
+def cli() -> object:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser("Measure how compile time and memory scale")
+    parser.add_argument("--dimension", choices=list(SIZES), action="append",
+                        help="Dimension to grow (default all; may be repeated)")
+    parser.add_argument("--sizes", type=lambda s: [int(n) for n in s.split(",")],
+                        help="Comma-separated sizes (default depends on the dimension)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Compiles of each program; the fastest is kept (default 3)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile the largest program of each flagged dimension")
+    parser.add_argument("--json", type=Path,
+                        help="Also write the measurements to this file")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def compile_once(source: str, obj_dir: Path, timings=None):
+    """Compile source from scratch into obj_dir"""
+    import driver
+    driver.compile_file(source, "Main", obj_dir, use_cache=False, timings=timings)
+
+
+def measure(config: Config, repeat: int) -> dict:
+    """Runs in the child process: phase times of the fastest of
+    repeat compiles, and the growth of the peak resident set
+    over the first compile
+    """
+    import assemble
+    import batch
+    from timings import Timings
+    assemble.log.setLevel(logging.WARNING)
+    source = gen_program.generate(config)
+    result = {"source_bytes": len(source)}
+    with tempfile.TemporaryDirectory() as obj_dir:
+        obj_dir = Path(obj_dir)
+        batch.install_builtins(obj_dir)
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        best = None
+        for _ in range(repeat):
+            timings = Timings("Main")
+            try:
+                compile_once(source, obj_dir, timings)
+            except RecursionError as e:
+                return dict(result, error=f"RecursionError: {e}")
+            if best is None or timings.total() < best.total():
+                best = timings
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result.update(phases=best.phases, counts=best.counts,
+                  seconds=best.total(), peak_kb=peak - baseline)
+    return result
+
+
+def run_child(config: Config, repeat: int) -> dict:
+    argv = [sys.executable, __file__, "--measure", json.dumps(config._asdict()),
+            "--repeat", str(repeat)]
+    done = subprocess.run(argv, capture_output=True, text=True)
+    if done.returncode != 0:
+        return {"error": done.stderr.strip().splitlines()[-1] if done.stderr else
+                f"exit status {done.returncode}"}
+    return json.loads(done.stdout)
+
+
+def growth(sizes: List[int], costs: List[float]) -> float:
+    """Least-squares slope of log(cost) against log(size)"""
+    xs = [math.log(s) for s in sizes]
+    ys = [math.log(c) for c in costs]
+    mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+    sxx = sum((x - mx) ** 2 for x in xs)
+    if sxx == 0:
+        return 0.0
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx
+
+
+def super_linear(dimension: str, sizes: List[int], points: List[dict]) -> Dict[str, float]:
+    """Phases (and "memory") whose cost per AST node grows with
+    the dimension, with their growth exponents
+    """
+    ok = [(size, point) for size, point in zip(sizes, points) if "error" not in point]
+    if len(ok) < 2:
+        return {}
+    flagged = {}
+    costs = {phase: [] for phase in ok[-1][1]["phases"]}
+    costs["memory"] = []
+    for size, point in ok:
+        nodes = point["counts"]["ast_nodes"]
+        for phase in costs:
+            if phase == "memory":
+                cost = max(point["peak_kb"], 1)
+            else:
+                cost = max(point["phases"].get(phase, 0.0), 1e-6)
+            costs[phase].append(cost / nodes)
+    for phase, per_node in costs.items():
+        if phase != "memory" and ok[-1][1]["phases"].get(phase, 0.0) < MIN_SECONDS:
+            continue
+        exponent = growth([size for size, _ in ok], per_node)
+        if exponent > THRESHOLD:
+            flagged[phase] = exponent
+    return flagged
+
+
+def print_table(dimension: str, sizes: List[int], points: List[dict]):
+    phases = []
+    for point in points:
+        for phase in point.get("phases", {}):
+            if phase not in phases:
+                phases.append(phase)
+    print(f"\n{dimension}")
+    print("".join([f"{'size':>8}{'nodes':>9}"] + [f"{p:>12}" for p in phases]
+                  + [f"{'total':>12}{'peak MB':>10}"]))
+    for size, point in zip(sizes, points):
+        if "error" in point:
+            print(f"{size:>8}  FAILED  {point['error']}")
+            continue
+        cells = [f"{point['phases'].get(p, 0.0) * 1000:10.1f}ms" for p in phases]
+        print("".join([f"{size:>8}{point['counts']['ast_nodes']:>9}"] + cells
+                      + [f"{point['seconds'] * 1000:10.1f}ms",
+                         f"{point['peak_kb'] / 1024:10.1f}"]))
+
+
+def profile(config: Config, top: int = 12):
+    """The functions taking the most time compiling the program of config"""
+    import assemble
+    import batch
+    assemble.log.setLevel(logging.WARNING)
+    source = gen_program.generate(config)
+    with tempfile.TemporaryDirectory() as obj_dir:
+        obj_dir = Path(obj_dir)
+        batch.install_builtins(obj_dir)
+        profiler = cProfile.Profile()
+        profiler.runcall(compile_once, source, obj_dir)
+    pstats.Stats(profiler).sort_stats("tottime").print_stats(top)
+
+
+def main():
+    args = cli()
+    if args.measure:
+        print(json.dumps(measure(Config(**json.loads(args.measure)), args.repeat)))
+        return
+    report = {}
+    for dimension in args.dimension or list(SIZES):
+        sizes = args.sizes or SIZES[dimension]
+        start = time.perf_counter()
+        points = [run_child(Config()._replace(**{dimension: size}), args.repeat)
+                  for size in sizes]
+        print_table(dimension, sizes, points)
+        flagged = super_linear(dimension, sizes, points)
+        for phase, exponent in sorted(flagged.items(), key=lambda item: -item[1]):
+            print(f"  SUPER-LINEAR: {phase} per AST node grows as {dimension}^{exponent:.2f}")
+        log.debug(f"{dimension} took {time.perf_counter() - start:.1f} s")
+        report[dimension] = {"sizes": sizes, "points": points, "super_linear": flagged}
+        if flagged and args.profile:
+            largest = [size for size, point in zip(sizes, points) if "error" not in point][-1]
+            print(f"\nProfile of {dimension} = {largest}")
+            profile(Config()._replace(**{dimension: largest}))
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
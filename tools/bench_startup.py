@@ -0,0 +1,97 @@
+"""
+Startup-time benchmark for the Quack front end.
+
+Runs each scenario in a fresh Python process, several times, and
+reports the best and median wall time:
+
+- build:   construct the LALR parser, no table cache
+- cached:  construct the LALR parser from the table cache
+- compile: compile a small program with driver.py, cold vs. cached tables
+- daemon:  compile the same program with quackd_client.py and a warm quackd.py
+
+Run from the repository root:  python3 tools/bench_startup.py
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+ROOT = Path(__file__).resolve().parent.parent
+PY = sys.executable
+
+BUILD = "import parser; parser.build_parser(cache=False)"
+CACHED = "import parser; parser.build_parser(cache=True)"
+
+
+def cli() -> object:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser("Measure compiler startup time")
+    parser.add_argument("-n", "--repeat", type=int, default=10,
+                        help="Runs per scenario (default 10)")
+    parser.add_argument("program", nargs="?",
+                        default=str(ROOT.joinpath("my_tests", "functionality.qk")),
+                        help="Quack program to compile")
+    return parser.parse_args()
+
+
+def clear_cache():
+    shutil.rmtree(ROOT.joinpath(".quack_cache"), ignore_errors=True)
+
+
+def timed(cmd, repeat: int, before=None, env=None) -> list:
+    """Wall time of each of 'repeat' runs of cmd"""
+    times = []
+    for _ in range(repeat):
+        if before:
+            before()
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=ROOT, check=True, env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(name: str, times: list):
+    print(f"{name:<24} best {min(times) * 1000:8.1f} ms"
+          f"   median {statistics.median(times) * 1000:8.1f} ms")
+
+
+def main():
+    args = cli()
+    with tempfile.TemporaryDirectory() as obj:
+        compile_cmd = [PY, "driver.py", "--obj", obj, args.program]
+        shutil.copytree(ROOT.joinpath("OBJ"), obj, dirs_exist_ok=True)
+        report("python startup", timed([PY, "-c", "pass"], args.repeat))
+        report("import lark", timed([PY, "-c", "import lark"], args.repeat))
+        report("parser, no cache", timed([PY, "-c", BUILD], args.repeat))
+        timed([PY, "-c", CACHED], 1, clear_cache)  # Warm the cache
+        report("parser, cached", timed([PY, "-c", CACHED], args.repeat))
+        report("compile, cold", timed(compile_cmd, args.repeat, clear_cache))
+        report("compile, cached", timed(compile_cmd, args.repeat))
+        sock = Path(obj, "quackd.sock")
+        env = dict(os.environ, QUACKD_SOCKET=str(sock))
+        server = subprocess.Popen([PY, "quackd.py", "--socket", str(sock)], cwd=ROOT,
+                                  stderr=subprocess.DEVNULL)
+        try:
+            while not sock.exists():
+                time.sleep(0.05)
+            client_cmd = [PY, "quackd_client.py", "--obj", obj, args.program]
+            report("compile, daemon", timed(client_cmd, args.repeat, env=env))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark the memory and time of assembling one large class in memory
+(assemble.translate, then ObjectCode.binary) and streaming it
+(assemble.assemble_streaming, which keeps one method's code at a
+time).  The class is generated like the compiler's code, with the
+methods of tools/bench_assemble.py; peak memory is measured with
+tracemalloc, which also slows both down.
+
+Run from the repository root:  python3 tools/bench_stream.py [--methods 4000]
+"""
+
+import argparse
+import logging
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import assemble
+from bench_assemble import method_lines
+
+
+def cli() -> object:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser("Memory of assembling a large class, in memory and streaming")
+    parser.add_argument("-m", "--methods", type=int, default=4000,
+                        help="Methods of the generated class (default 4000)")
+    return parser.parse_args()
+
+
+def in_memory(source: Path, target: Path):
+    with open(source, "r") as lines:
+        objcode = assemble.translate(lines)
+    target.write_bytes(objcode.binary())
+
+
+def measure(action) -> tuple:
+    """Wall time and peak memory (bytes) of action()"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    action()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main():
+    args = cli()
+    assemble.log.setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        source = tmp.joinpath("Big.asm")
+        with open(source, "w") as f:
+            print(".class Big:Obj", file=f)
+            for m in range(args.methods):
+                print("\n".join(method_lines(m)), file=f)
+        cases = [("in memory", in_memory, tmp.joinpath("memory.tvm")),
+                 ("streaming", assemble.assemble_streaming, tmp.joinpath("stream.tvm"))]
+        print(f"{source.stat().st_size:,} bytes of assembly code, {args.methods} methods")
+        print(f"{'':<12}{'seconds':>10}{'peak (KiB)':>14}")
+        for name, function, target in cases:
+            seconds, peak = measure(lambda: function(source, target))
+            print(f"{name:<12}{seconds:10.3f}{peak / 1024:14,.0f}")
+        assert cases[0][2].read_bytes() == cases[1][2].read_bytes()
+
+
+if __name__ == "__main__":
+    main()
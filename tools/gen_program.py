@@ -0,0 +1,184 @@
+"""
+Generate synthetic Quack programs of tunable size, for benchmarks.
+
+The programs are valid for this compiler.  Small ones also run on the
+vm, but the vm's fixed tables (code, constants per class) are too small
+for most.  The size of a program grows about linearly in each parameter:
+
+- classes:    number of classes
+- methods:    methods per class (the same names in every class, so
+              subclasses override them)
+- depth:      inheritance depth; classes form chains this long
+- statements: statements in the body of each method
+- nesting:    nesting depth of if/elif/else and while statements
+- expr_depth: depth of arithmetic expressions
+
+Each method also calls a method of the class before it, and the main
+program joins the types of classes in the same chain, so that the type
+checker's method lookups and common ancestors are exercised.
+
+Run from the repository root:
+    python3 tools/gen_program.py --classes 20 --methods 5 > big.qk
+"""
+
+import argparse
+import random
+import sys
+from typing import List, NamedTuple
+
+
+class Config(NamedTuple):
+    classes: int = 8
+    methods: int = 4
+    depth: int = 2
+    statements: int = 8
+    nesting: int = 1
+    expr_depth: int = 2
+    seed: int = 0
+
+
+LOCALS = ["x", "v0", "v1", "v2", "v3"]
+INNER_STATEMENTS = 3   # In each block of an if or while
+
+
+class Generator:
+    def __init__(self, config: Config):
+        self.config = config
+        self.rng = random.Random(config.seed)
+
+    def parent(self, i: int) -> str:
+        """Classes form chains of 'depth' classes under Obj"""
+        if self.config.depth <= 1 or i % self.config.depth == 0:
+            return "Obj"
+        return f"C{i - 1}"
+
+    def leaf(self) -> str:
+        if self.rng.random() < 0.3:
+            return str(self.rng.randint(1, 9))
+        return self.rng.choice(LOCALS)
+
+    def expr(self, depth: int) -> str:
+        """Int expression, nested depth deep (to the right, so its
+        size is linear in depth)
+        """
+        if depth == 0:
+            return self.leaf()
+        op = self.rng.choice(["+", "-", "*"])
+        return f"{self.leaf()} {op} ({self.expr(depth - 1)})"
+
+    def condition(self) -> str:
+        op = self.rng.choice(["<", ">", "==", "<=", ">="])
+        cond = f"{self.rng.choice(LOCALS)} {op} {self.leaf()}"
+        if self.rng.random() < 0.3:
+            joiner = self.rng.choice(["and", "or"])
+            cond += f" {joiner} {self.rng.choice(LOCALS)} < {self.leaf()}"
+        return cond
+
+    def assignment(self) -> str:
+        target = self.rng.choice(LOCALS[1:])
+        return f"{target} = {self.expr(self.config.expr_depth)};"
+
+    def block(self, n: int, nesting: int, indent: str) -> List[str]:
+        """n statements, the first of them compound if nesting > 0"""
+        lines = []
+        for i in range(n):
+            if i == 0 and nesting > 0:
+                if self.rng.random() < 0.5:
+                    lines += self.if_statement(nesting, indent)
+                else:
+                    lines += self.while_statement(nesting, indent)
+            else:
+                lines.append(indent + self.assignment())
+        return lines
+
+    def if_statement(self, nesting: int, indent: str) -> List[str]:
+        inner = indent + "    "
+        # Only the first arm nests deeper, so the size stays linear
+        lines = [f"{indent}if {self.condition()} {{"]
+        lines += self.block(INNER_STATEMENTS, nesting - 1, inner)
+        lines.append(f"{indent}}} elif {self.condition()} {{")
+        lines += self.block(INNER_STATEMENTS, 0, inner)
+        lines.append(f"{indent}}} else {{")
+        lines += self.block(INNER_STATEMENTS, 0, inner)
+        lines.append(f"{indent}}}")
+        return lines
+
+    def while_statement(self, nesting: int, indent: str) -> List[str]:
+        # A counter for each nesting level, so that loops terminate
+        counter = f"w{nesting}"
+        inner = indent + "    "
+        lines = [f"{indent}{counter} = 0;",
+                 f"{indent}while {counter} < 3 {{"]
+        lines += self.block(INNER_STATEMENTS, nesting - 1, inner)
+        lines.append(f"{inner}{counter} = {counter} + 1;")
+        lines.append(f"{indent}}}")
+        return lines
+
+    def method(self, i: int, j: int) -> List[str]:
+        indent = " " * 8
+        lines = [f"    def m{j}(x: Int): Int {{",
+                 f"{indent}v0 = x;",
+                 f"{indent}v1 = this.f{i};",
+                 f"{indent}v2 = {j};"]
+        if i > 0:
+            lines.append(f"{indent}v3 = C{i - 1}(x).m{self.rng.randrange(self.config.methods)}(v1);")
+        else:
+            lines.append(f"{indent}v3 = x + 1;")
+        lines += self.block(self.config.statements, self.config.nesting, indent)
+        lines += [f"{indent}return v0 + v1 + v2 + v3;", "    }"]
+        return lines
+
+    def clazz(self, i: int) -> List[str]:
+        lines = [f"class C{i}(a: Int) extends {self.parent(i)} {{",
+                 f"    this.f{i} = a;"]
+        for j in range(self.config.methods):
+            lines += self.method(i, j)
+        lines.append("}")
+        return lines
+
+    def main(self) -> List[str]:
+        n = self.config.classes
+        lines = ["t = 0;"]
+        for i in range(n):
+            lines.append(f"t = t + C{i}(t).m{i % self.config.methods}({i});")
+        # Join the types of two classes in the same chain
+        for i in range(1, n):
+            if self.parent(i) != "Obj":
+                lines += [f"p{i} = C{i - 1}(1);",
+                          f"if t > {i} {{ p{i} = C{i}(2); }}",
+                          f"t = t + p{i}.m0(1);"]
+        lines.append("t.print();")
+        return lines
+
+    def program(self) -> str:
+        lines = [f"/* Generated by tools/gen_program.py: {self.config} */"]
+        for i in range(self.config.classes):
+            lines += self.clazz(i)
+        lines += self.main()
+        return "\n".join(lines) + "\n"
+
+
+def generate(config: Config) -> str:
+    """Source of a Quack program"""
+    return Generator(config).program()
+
+
+def cli() -> object:
+    """Command line arguments"""
+    parser = argparse.ArgumentParser("Generate a synthetic Quack program")
+    for field, default in Config._field_defaults.items():
+        parser.add_argument(f"--{field.replace('_', '-')}", type=int, default=default,
+                            help=f"(default {default})")
+    parser.add_argument("-o", "--output", type=argparse.FileType("w"), default=sys.stdout,
+                        help="Where to write the program (default stdout)")
+    return parser.parse_args()
+
+
+def main():
+    args = cli()
+    config = Config(**{field: getattr(args, field) for field in Config._fields})
+    args.output.write(generate(config))
+
+
+if __name__ == "__main__":
+    main()
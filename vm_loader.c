@@ -10,6 +10,11 @@
 #include <stdlib.h>
 #include <string.h>
 #include <assert.h>
+#include <stdint.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 
 
 // Set load library path before loading each class by name.
@@ -45,12 +50,15 @@ static void set_loaded(class_ref c) {
     return;
 }
 
+/* Indexes of the named constant literals in the constant pool */
+static int const_nothing, const_true, const_false;
+
 /* Initialize loader
  * (loads built-in classes, dummy main program,
  * special named constants)
  */
 void vm_loader_init(char *load_path_prefix) {
-    // Where we will look for object modules in .json format
+    // Where we will look for object modules (.tvm or .json)
     PATH_PREFIX = load_path_prefix;
     // The built-in classes are available from the start,
     // and don't go through the usual class-loading translation process.
@@ -71,9 +79,34 @@ void vm_loader_init(char *load_path_prefix) {
     vm_code_block[4] = (vm_Word) {.instr = vm_op_halt};
     //
     // The named constant literals
-    create_const_value("$nothing", nothing);
-    create_const_value("$true", lit_true);
-    create_const_value("$false", lit_false);
+    const_nothing = create_const_value(CONST_NAMED, "nothing", nothing);
+    const_true = create_const_value(CONST_NAMED, "true", lit_true);
+    const_false = create_const_value(CONST_NAMED, "false", lit_false);
+}
+
+/* Direct calls (call_direct) name a method by class and vtable
+ * slot, but the vtable entry may not be filled in yet when the call
+ * is loaded (a class calling its own methods, or classes loading
+ * each other), so we record where each call's code address goes
+ * and patch them all in when everything is loaded.
+ */
+#define MAX_DIRECT_CALLS (CODE_CAPACITY / 2)
+static struct direct_call_patch {
+    vm_addr patch_loc;  // Operand word of the call_direct instruction
+    class_ref clazz;
+    int slot;
+} direct_calls[MAX_DIRECT_CALLS];
+static int n_direct_calls;
+
+static void resolve_direct_calls(void) {
+    for (int i = 0; i < n_direct_calls; ++i) {
+        struct direct_call_patch patch = direct_calls[i];
+        check_health_class(patch.clazz);
+        vm_addr method_addr = patch.clazz->vtable[patch.slot];
+        assert(method_addr);
+        *patch.patch_loc = (vm_Word) {.code_addr = method_addr};
+    }
+    n_direct_calls = 0;
 }
 
 /* When everything is loaded, we can patch in a call to the
@@ -83,6 +116,7 @@ void vm_loader_init(char *load_path_prefix) {
 void vm_loader_set_main(char *main_class_name) {
     class_ref main_class = find_loaded(main_class_name);
     assert(main_class);
+    resolve_direct_calls();
     vm_code_block[0] = (vm_Word) {.instr = vm_op_new};
     vm_code_block[1] = (vm_Word) {.clazz = main_class};
     vm_code_block[2] = (vm_Word) {.instr = vm_op_methodcall};
@@ -118,53 +152,84 @@ class_ref ensure_loaded(char *class_name) {
 
 
 
-// Capacity limit:  For simplicity we read into a
-// buffer of 20k bytes.
-//
-#define FILE_BUFFER_CAPACITY (1024 * 100 * sizeof(char))
-
+/* Constants in an object file are referenced as small
+ * (non-negative) integer indexes
+ * in a per-class "constant pool", or a fixed set of
+ * negative integers (-1 .. -3 currently) for named literals.
+ * Adding them to the constant pool for the
+ * whole program requires remapping them to different indexes.
+ * (Java, in contrast, maintains a separate constant pool for each
+ * class at run-time.)  remap_constant gives the index in the
+ * program's pool of one constant of the class.
+ */
+static int remap_constant(char kind, char *literal) {
+    int internal = 0;
+    if (kind == CONST_INT) {
+        internal = int_literal_const(literal);
+    } else if (kind == CONST_STR) {
+        internal = str_literal_const(literal);
+    } else {
+        log_error("Constant %s of unknown type", literal);
+    }
+    return internal;
+}
 
-/* read_file_fd
- * returns 0 (failure) or 1 (success)
+/* Create the class object, with the methods it inherits in its
+ * vtable, and add it to the loaded classes (before its methods are
+ * loaded, since they may refer to the class itself).
  */
-int read_file_fd(FILE *fd, char *file_buffer) {
-    int pos = 0;
-    char ch;
-    /* Simple, not efficient. */
-    while (1) {
-        ch = fgetc(fd);
-        if (feof(fd)) {
-            break;
-        } else if (ferror(fd)) {
-            perror("Error reading file");
-            break;
-        }
-        file_buffer[pos++] = ch;
+static class_ref create_class(char *class_name, char *super_name,
+                              int n_methods, int n_fields, int n_inherited) {
+    log_info("Class %s extends %s", class_name, super_name);
+    log_info("Class %s has %d methods and %d fields",
+             class_name, n_methods, n_fields);
+    size_t class_obj_size =
+            sizeof(struct class_header_struct)
+            + n_methods * sizeof(vm_Word);
+    size_t obj_size = sizeof(struct obj_header_struct) + n_fields * sizeof(vm_Word);
+    class_ref the_super = ensure_loaded(super_name);
+    assert(the_super); // Error if we can't find the superclass
+    class_ref the_class = (class_ref) malloc(class_obj_size);
+    the_class->header = (struct class_header_struct) {
+            .class_name = strdup(class_name),
+            .healthy_class_tag = HEALTHY,
+            .n_fields = n_fields,
+            .object_size = obj_size,
+            .super = the_super
+    };
+    log_debug("Class %s class object size %d with %d methods",
+             class_name, class_obj_size, n_methods);
+    log_debug("Objects of %s size %d with %d fields",
+            class_name,  obj_size, n_fields);
+    log_debug("Size of object header alone is %d bytes\n",
+             sizeof(struct obj_header_struct));
+    // Copy inherited method pointers into vtable
+    for (int i = 0; i < n_inherited; ++i) {
+        the_class->vtable[i] = the_super->vtable[i];
     }
-    // Do we need to add the null byte?  Maybe.
-    file_buffer[pos] = 0;
-    return 1;
+    set_loaded(the_class);
+    return the_class;
 }
 
-vm_Word *translate_method_code(cJSON *ops, int const_map[], class_ref class_map[]);
+vm_Word *translate_method_code(int32_t ops[], int n_ops,
+                               int const_map[], class_ref class_map[]);
 
 /*
- * Constants in a class file (.json) are referenced as small
- * (non-negative) integer indexes
- * in a per-class "constant pool", or a fixed set of
- * negative integers (-1 .. -3 currently) for named literals.
- * Adding them to the constant pool for the
- * whole program requires remapping them to different indexes.
- * (Java, in contrast, maintains a separate constant pool for each
- * class at run-time.)
+ * JSON object files (.json), as written for debugging and for
+ * the built-in classes.
+ */
+
+/* The map from the class's constants to the constant pool,
+ * allocated for as many constants as the class has (free it).
  */
-static int remap_constants(int map[], cJSON *tree, int capacity) {
+static int *remap_constants(cJSON *tree) {
     cJSON *constants = cJSON_GetObjectItemCaseSensitive(tree,
                                            "constants");
     if (constants == NULL) {
         perror("Missing 'constants' element in json");
         return 0;
     }
+    int *map = malloc((cJSON_GetArraySize(constants) + 1) * sizeof(int));
     int literal_count = 0;
     cJSON *el;
     cJSON_ArrayForEach(el, constants) {
@@ -172,29 +237,22 @@ static int remap_constants(int map[], cJSON *tree, int capacity) {
         cJSON *value_el = cJSON_GetObjectItemCaseSensitive(el, "value");
         char *kind = kind_el->valuestring;
         char *literal = value_el->valuestring;
-        int internal;
-        if (kind[0] == 'i') {
-            internal = int_literal_const(literal);
-        } else if (kind[0] == 's') {
-            internal = str_literal_const(strdup(literal));
-        } else {
-            perror("Constant of unknown type");
-        }
+        int internal = remap_constant(kind[0], literal);
         map[literal_count] = internal;
         log_debug("Literal %s internal %d remapped to %d",
                   literal, literal_count, internal);
         ++literal_count;
-        assert(literal_count < capacity);
     }
-    return literal_count; // Actually it's the count - 1
+    return map;
 }
 
-/*  Object code in .json file refers to classes by index of its
+/*  Object code refers to classes by index of its
  * "imports" list.  We
  *  need to make sure each referenced class is loaded, and to
- *  map those indexes to actual references to loaded classes.
+ *  map those indexes to actual references to loaded classes
+ *  (in a map allocated for the imports; free it).
  */
-static int map_classes(class_ref class_map[], cJSON *tree, int capacity) {
+static class_ref *map_classes(cJSON *tree) {
     int class_count = 0;
     cJSON *imports = cJSON_GetObjectItemCaseSensitive(tree,
                                                         "imports");
@@ -203,22 +261,21 @@ static int map_classes(class_ref class_map[], cJSON *tree, int capacity) {
         return 0;
     }
     assert(cJSON_IsArray(imports));
+    class_ref *class_map = malloc((cJSON_GetArraySize(imports) + 1) * sizeof(class_ref));
     cJSON *el = imports->child;
     while (el) {
-        assert(class_count < capacity);
         char *class_name = el->valuestring;
         class_ref clazz = ensure_loaded(class_name);
         class_map[class_count] = clazz;
         ++class_count;
         el = el->next;
     }
-    return class_count; // Actually it's the count - 1
+    return class_map;
 }
 
 
 static int load_json(char buf[]) {
     cJSON *tree = NULL; // Tree as a whole
-    cJSON *val = NULL;  // Named value in tree
     cJSON *el = NULL;   // Element of value
     tree = cJSON_Parse(buf);  // Must free at end
     if (tree == NULL) {
@@ -227,91 +284,167 @@ static int load_json(char buf[]) {
     }
 
     /* module constant index -> global constant index */
-    int constant_renumber_map[30];
-    int n_consts = remap_constants(constant_renumber_map, tree, 30);
+    int *constant_renumber_map = remap_constants(tree);
 
     // Mapping imported classes was here; moving AFTER we
     // create and index this class so that it can reference itself
 
     // Create and initialize a class object
-    // push_log_level(DEBUG);
     char *class_name = cJSON_GetStringValue(
             cJSON_GetObjectItemCaseSensitive(tree, "class_name"));
     char *super_name = cJSON_GetStringValue(
             cJSON_GetObjectItemCaseSensitive(tree, "super"));
-    log_info("Class %s extends %s", class_name, super_name);
     // Counts of methods and fields; I'm letting the assembler do the work here.
     int n_fields = (int) cJSON_GetNumberValue(
             cJSON_GetObjectItemCaseSensitive(tree, "n_fields"));
     int n_methods = (int) cJSON_GetNumberValue(
             cJSON_GetObjectItemCaseSensitive(tree, "n_methods"));
-    log_info("Class %s has %d methods and %d fields",
-             class_name, n_methods, n_fields);
-    size_t class_obj_size =
-            sizeof(struct class_header_struct)
-            + n_methods * sizeof(vm_Word);
-    size_t obj_size = sizeof(struct obj_header_struct) + n_fields * sizeof(vm_Word);
-    class_ref the_super = ensure_loaded(super_name);
-    assert(the_super); // Error if we can't find the superclass
-    class_ref the_class = (class_ref) malloc(class_obj_size);
-    the_class->header = (struct class_header_struct) {
-            .class_name = strdup(class_name),
-            .healthy_class_tag = HEALTHY,
-            .n_fields = n_fields,
-            .object_size = obj_size,
-            .super = the_super
-    };
-    log_debug("Class %s class object size %d with %d methods",
-             class_name, class_obj_size, n_methods);
-    log_debug("Objects of %s size %d with %d fields",
-            class_name,  obj_size, n_fields);
-    log_debug("Size of object header alone is %d bytes\n",
-             sizeof(struct obj_header_struct));
-    // Copy inherited method pointers into vtable
     int n_inherited = (int) cJSON_GetNumberValue(
             cJSON_GetObjectItemCaseSensitive(tree, "n_inherited"));
-    for (int i = 0; i < n_inherited; ++i) {
-        the_class->vtable[i] = the_super->vtable[i];
-    }
-    //pop_log_level();
-
-    set_loaded(the_class);
-    // We want the class in the "loaded classes" table before loading
-    // methods, because the methods might have references to the current class.
+    class_ref the_class = create_class(class_name, super_name,
+                                       n_methods, n_fields, n_inherited);
 
     /* module class index -> class reference,
     * with potential side effect of loading more class files.
     */
-    class_ref class_map[30];
-    int n_classes = map_classes(class_map, tree, 30);
+    class_ref *class_map = map_classes(tree);
 
 
     cJSON *code_table = cJSON_GetObjectItemCaseSensitive(tree, "code");
     assert(code_table);  // Abort if it wasn't present
     assert(cJSON_IsArray(code_table));  // Should be an array of methods
     cJSON_ArrayForEach(el, code_table) {
-        char *method_name = cJSON_GetStringValue(
-                cJSON_GetObjectItemCaseSensitive(el, "name"));
         int method_slot = (int) cJSON_GetNumberValue(
                 cJSON_GetObjectItemCaseSensitive(el, "slot"));
         cJSON *ops = cJSON_GetObjectItemCaseSensitive(el, "code");
+        assert (cJSON_IsArray(ops));
+        int n_ops = cJSON_GetArraySize(ops);
+        int32_t *words = malloc(n_ops * sizeof(int32_t) + 1);
+        int n = 0;
+        cJSON *op;
+        cJSON_ArrayForEach(op, ops) {
+            assert(cJSON_IsNumber(op));
+            words[n++] = op->valueint;
+        }
         vm_Word *method_start_addr =
-                translate_method_code(ops, constant_renumber_map, class_map);
+                translate_method_code(words, n_ops, constant_renumber_map, class_map);
+        free(words);
         the_class->vtable[method_slot] = method_start_addr;
     }
+    free(constant_renumber_map);
+    free(class_map);
     cJSON_Delete(tree);
     return 1;
 }
 
-vm_Word *translate_method_code(cJSON *ops, int const_map[], class_ref class_map[]) {
+/*
+ * Binary object files (.tvm), as written by the assembler
+ * (see the layout in assemble.py).  The file is mapped into memory
+ * and read where it lies; the code of each method is translated
+ * straight from its array of words.  Strings are NUL-terminated in
+ * the file, and whatever the loaded program keeps of them is copied,
+ * so the file can be unmapped once loaded.
+ */
+struct obj_reader {
+    char *pos;
+    char *end;
+};
+
+static int32_t read_int(struct obj_reader *r) {
+    int32_t value;
+    assert(r->pos + sizeof(int32_t) <= r->end);
+    memcpy(&value, r->pos, sizeof(int32_t));  // Little-endian, like the vm
+    r->pos += sizeof(int32_t);
+    return value;
+}
+
+static char *read_str(struct obj_reader *r) {
+    int32_t length = read_int(r);
+    char *s = r->pos;
+    assert(length >= 0 && s + length < r->end && s[length] == 0);
+    r->pos += (length + 4) & ~3;   // NUL and padding
+    return s;
+}
+
+static int load_binary(char buf[], size_t size) {
+    struct obj_reader r = {.pos = buf + OBJ_MAGIC_LENGTH, .end = buf + size};
+    int version = read_int(&r);
+    if (version != OBJ_VERSION) {
+        log_error("Object file version %d, expected %d (reassemble it)",
+                  version, OBJ_VERSION);
+        return 0;
+    }
+    int n_imports = read_int(&r);
+    int n_methods = read_int(&r);
+    int n_fields = read_int(&r);
+    int n_inherited = read_int(&r);
+    int n_constants = read_int(&r);
+    int n_code = read_int(&r);
+    int n_words = read_int(&r);
+    char *class_name = read_str(&r);
+    char *super_name = read_str(&r);
+    char **imports = malloc((n_imports + 1) * sizeof(char *));
+    for (int i = 0; i < n_imports; ++i) {
+        imports[i] = read_str(&r);
+    }
+    // Method and field names are not needed to run the code
+    for (int i = 0; i < n_methods + n_fields; ++i) {
+        read_str(&r);
+    }
+
+    /* module constant index -> global constant index */
+    int *constant_renumber_map = malloc((n_constants + 1) * sizeof(int));
+    for (int i = 0; i < n_constants; ++i) {
+        char *literal = read_str(&r);
+        char kind = (char) read_int(&r);
+        constant_renumber_map[i] = remap_constant(kind, literal);
+        log_debug("Literal %s internal %d remapped to %d",
+                  literal, i, constant_renumber_map[i]);
+    }
+
+    class_ref the_class = create_class(class_name, super_name,
+                                       n_methods, n_fields, n_inherited);
+
+    /* module class index -> class reference,
+    * with potential side effect of loading more class files.
+    */
+    class_ref *class_map = malloc((n_imports + 1) * sizeof(class_ref));
+    for (int i = 0; i < n_imports; ++i) {
+        class_map[i] = ensure_loaded(imports[i]);
+    }
+    free(imports);
+
+    // The method table precedes the code array it indexes
+    struct obj_reader table = r;
+    for (int i = 0; i < n_code; ++i) {
+        read_str(&r);
+        r.pos += 3 * sizeof(int32_t);
+    }
+    assert(r.pos + n_words * sizeof(int32_t) <= r.end);
+    int32_t *words = (int32_t *) r.pos;   // Aligned: everything before is whole words
+    for (int i = 0; i < n_code; ++i) {
+        read_str(&table);
+        int method_slot = read_int(&table);
+        int start = read_int(&table);
+        int length = read_int(&table);
+        assert(start >= 0 && length >= 0 && start + length <= n_words);
+        the_class->vtable[method_slot] =
+                translate_method_code(words + start, length,
+                                      constant_renumber_map, class_map);
+    }
+    free(constant_renumber_map);
+    free(class_map);
+    return 1;
+}
+
+vm_Word *translate_method_code(int32_t ops[], int n_ops,
+                               int const_map[], class_ref class_map[]) {
     // Translating code.  Constants must be renumbered since local
     // constant number is not global constant number.
-    assert (cJSON_IsArray(ops));
-    cJSON *el = ops->child;
     vm_Word *method_start_address = vm_current_address();
-    while (el) {
-        assert(cJSON_IsNumber(el));
-        int opcode = el->valueint;
+    int i = 0;
+    while (i < n_ops) {
+        int opcode = ops[i++];
         log_debug("[%d] Op: %d (%s)",
                vm_current_address() - vm_code_block,
                opcode, vm_op_bytecodes[opcode].name);
@@ -320,19 +453,19 @@ vm_Word *translate_method_code(cJSON *ops, int const_map[], class_ref class_map[
 
         if (vm_op_bytecodes[opcode].n_operands) {
             // Max is 1 operand!
-            el = el->next;
-            int operand = el->valueint;
+            assert(i < n_ops);
+            int operand = ops[i++];
             log_debug("[%d] Operand: %d",
                       vm_current_address() - vm_code_block,
                       operand);
             if (vm_op_bytecodes[opcode].instr == vm_op_const) {
                 int const_index;
                 if (operand == CODE_FALSE) {
-                    const_index = lookup_const_index("$false");
+                    const_index = const_false;
                 } else if (operand == CODE_TRUE) {
-                    const_index = lookup_const_index("$true");
+                    const_index = const_true;
                 } else if (operand == CODE_NOTHING) {
-                    const_index = lookup_const_index("$nothing");
+                    const_index = const_nothing;
                 } else {
                     assert(operand >= 0);
                     const_index = const_map[operand];
@@ -348,46 +481,73 @@ vm_Word *translate_method_code(cJSON *ops, int const_map[], class_ref class_map[
                           clazz->header.class_name);
                 vm_code_block[vm_code_index++] = (vm_Word)
                         {.clazz = clazz};
+            } else if (vm_op_bytecodes[opcode].instr == vm_op_call_direct) {
+                // Operand packs class (index in imports) and vtable slot
+                assert(n_direct_calls < MAX_DIRECT_CALLS);
+                direct_calls[n_direct_calls++] = (struct direct_call_patch) {
+                        .patch_loc = vm_current_address(),
+                        .clazz = class_map[operand >> DIRECT_CALL_SHIFT],
+                        .slot = operand & ((1 << DIRECT_CALL_SHIFT) - 1)
+                };
+                vm_code_block[vm_code_index++] = (vm_Word)
+                        {.code_addr = 0};  // Until resolve_direct_calls
             } else {
                 vm_code_block[vm_code_index++] = (vm_Word)
                         {.intval = operand};
             }
         }
-        el = el->next;
     }
     return method_start_address;
 }
 
 
 
-/* Load an "object" file (json format) from
- * a class name.
+/* Load an object file from a class name:  the binary
+ * object file if there is one, else the json.
  */
 #define PATHBUFSIZE 4096
 extern int vm_load_class(char *classname) {
     char load_path[PATHBUFSIZE];
     // Use printf for multi-concat
-    snprintf(load_path, PATHBUFSIZE, "%s/%s.json", PATH_PREFIX, classname);
+    snprintf(load_path, PATHBUFSIZE, "%s/%s.tvm", PATH_PREFIX, classname);
+    if (access(load_path, R_OK) != 0) {
+        snprintf(load_path, PATHBUFSIZE, "%s/%s.json", PATH_PREFIX, classname);
+    }
     log_info("Loading %s", load_path);
     return vm_load_from_path(load_path);
 }
 
 
 int vm_load_from_path(char *path) {
-    char file_buffer[FILE_BUFFER_CAPACITY];
-    FILE *fd = fopen(path, "r");
-    if (! fd) {
+    int fd = open(path, O_RDONLY);
+    if (fd < 0) {
         perror("Failed to open file");
         return 0;
     }
+    struct stat info;
+    if (fstat(fd, &info) != 0 || info.st_size == 0) {
+        perror("Failed to read file");
+        close(fd);
+        return 0;
+    }
+    size_t size = info.st_size;
+    char *buf = mmap(NULL, size, PROT_READ, MAP_PRIVATE, fd, 0);
+    close(fd);
+    if (buf == MAP_FAILED) {
+        perror("Failed to map file");
+        return 0;
+    }
     int ok;
-    ok = read_file_fd(fd, file_buffer);
-    if (ok) {
-        cJSON *jobj = cJSON_Parse(file_buffer);
-        ok = (jobj != NULL);
+    if (size >= OBJ_MAGIC_LENGTH && memcmp(buf, OBJ_MAGIC, OBJ_MAGIC_LENGTH) == 0) {
+        ok = load_binary(buf, size);
+    } else {
+        // cJSON wants a NUL-terminated string
+        char *text = malloc(size + 1);
+        memcpy(text, buf, size);
+        text[size] = 0;
+        ok = load_json(text);
+        free(text);
     }
-    assert(ok);
-    ok = load_json(file_buffer);
-    fclose(fd);
+    munmap(buf, size);
     return ok;
 }
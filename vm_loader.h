@@ -24,16 +24,26 @@ void vm_loader_set_main(char *main_class_name);
  */
 extern class_ref find_loaded(char *name);
 
-/* Load an "object" file (json format) from
- * a class name.
+/* Load an "object" file from a class name:
+ * Name.tvm (binary) if it exists, else Name.json.
  */
 extern int vm_load_class(char *classname);
 
-/* Load an "object" file, which should be in JSON format.
+/* Load an "object" file, in the binary format (recognized
+ * by its magic number) or JSON.
  * Return 1 = success, 0 = failure.
  */
 extern int vm_load_from_path(char *path);
 
+/* Binary object files start with these 4 bytes and a format version.
+ *
+ * NOTE:  These MUST be consistent with OBJ_MAGIC and OBJ_VERSION
+ * in the assembler (assemble.py), which describes the layout.
+ */
+#define OBJ_MAGIC "TVMO"
+#define OBJ_MAGIC_LENGTH 4
+#define OBJ_VERSION 1
+
 /* Constants in method bytecode will be small non-negative
  * integers corresponding to the "constants" list in the
  * object code json, or chosen from this fixed set of
@@ -46,4 +56,11 @@ extern int vm_load_from_path(char *path);
 #define CODE_FALSE (-2)
 #define CODE_TRUE (-3)
 
+/* The operand of call_direct in method bytecode is the index of
+ * the method's class in the "imports" list, shifted left by
+ * DIRECT_CALL_SHIFT bits, plus the method's vtable slot.
+ * It MUST be consistent with DIRECT_CALL_SHIFT in assemble.py.
+ */
+#define DIRECT_CALL_SHIFT 16
+
 #endif //TINY_VM_VM_LOADER_H
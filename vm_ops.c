@@ -88,6 +88,24 @@ extern void vm_op_methodcall(void) {
     return;
 }
 
+/* Call a method without looking it up in the vtable of
+ * the receiver's class: the next word in the instruction
+ * stream is the address of its code, resolved by the loader.
+ * The frame is the same as for vm_op_methodcall.
+ */
+extern void vm_op_call_direct(void) {
+    vm_addr method_addr = vm_fetch_next().code_addr;
+    // New "this" will be receiver object
+    vm_addr new_fp = vm_sp;
+    // Save program counter for return
+    vm_frame_push_word((vm_Word) {.code_addr = vm_pc});
+    // Save caller's frame pointer
+    vm_frame_push_word((vm_Word) {.frame_addr = vm_fp});
+    vm_fp = new_fp;
+    vm_pc = method_addr;
+    return;
+}
+
 /* Trampoline to a native method.
  * Wrap this inside an interpreted method
  * to handle the frame layout properly.
@@ -307,3 +325,134 @@ extern void vm_op_store_field() {
     target_obj->fields[field_slot] = value;
     // pop_log_level();
 }
+
+/* ========  Int operations =========== */
+
+/* Pop the operands of an Int operation:  [a b] -> [],
+ * with the values of a and b.  Arithmetic is done on unsigned
+ * values so that it wraps around, as the compiler's constant
+ * folding assumes.
+ */
+static void pop_int_operands(int *a, int *b) {
+    obj_ref right = vm_frame_pop_word().obj;
+    obj_ref left = vm_frame_pop_word().obj;
+    assert_is_type(left, the_class_Int);
+    assert_is_type(right, the_class_Int);
+    *a = ((obj_Int) left)->value;
+    *b = ((obj_Int) right)->value;
+}
+
+static void push_bool(int cond) {
+    vm_eval_push(cond ? lit_true : lit_false);
+}
+
+extern void vm_op_int_plus() {
+    int a, b;
+    pop_int_operands(&a, &b);
+    vm_eval_push(new_int((int) ((unsigned) a + (unsigned) b)));
+}
+
+extern void vm_op_int_sub() {
+    int a, b;
+    pop_int_operands(&a, &b);
+    vm_eval_push(new_int((int) ((unsigned) a - (unsigned) b)));
+}
+
+extern void vm_op_int_mult() {
+    int a, b;
+    pop_int_operands(&a, &b);
+    vm_eval_push(new_int((int) ((unsigned) a * (unsigned) b)));
+}
+
+extern void vm_op_int_div() {
+    int a, b;
+    pop_int_operands(&a, &b);
+    vm_eval_push(new_int(a / b));
+}
+
+extern void vm_op_int_less() {
+    int a, b;
+    pop_int_operands(&a, &b);
+    push_bool(a < b);
+}
+
+extern void vm_op_int_greater() {
+    int a, b;
+    pop_int_operands(&a, &b);
+    push_bool(a > b);
+}
+
+extern void vm_op_int_le() {
+    int a, b;
+    pop_int_operands(&a, &b);
+    push_bool(a <= b);
+}
+
+extern void vm_op_int_ge() {
+    int a, b;
+    pop_int_operands(&a, &b);
+    push_bool(a >= b);
+}
+
+extern void vm_op_int_equals() {
+    int a, b;
+    pop_int_operands(&a, &b);
+    push_bool(a == b);
+}
+
+/* Compare two Ints and jump:  [a b] -> [], with no Boolean
+ * in between.  The jump span follows, as for jump_if.
+ */
+extern void vm_op_jump_int_less() {
+    int span = vm_fetch_next().intval;
+    int a, b;
+    pop_int_operands(&a, &b);
+    if (a < b) {
+        vm_relative_jump(span);
+    }
+}
+
+extern void vm_op_jump_int_greater() {
+    int span = vm_fetch_next().intval;
+    int a, b;
+    pop_int_operands(&a, &b);
+    if (a > b) {
+        vm_relative_jump(span);
+    }
+}
+
+extern void vm_op_jump_int_le() {
+    int span = vm_fetch_next().intval;
+    int a, b;
+    pop_int_operands(&a, &b);
+    if (a <= b) {
+        vm_relative_jump(span);
+    }
+}
+
+extern void vm_op_jump_int_ge() {
+    int span = vm_fetch_next().intval;
+    int a, b;
+    pop_int_operands(&a, &b);
+    if (a >= b) {
+        vm_relative_jump(span);
+    }
+}
+
+extern void vm_op_jump_int_equals() {
+    int span = vm_fetch_next().intval;
+    int a, b;
+    pop_int_operands(&a, &b);
+    if (a == b) {
+        vm_relative_jump(span);
+    }
+}
+
+extern void vm_op_jump_int_ne() {
+    int span = vm_fetch_next().intval;
+    int a, b;
+    pop_int_operands(&a, &b);
+    if (a != b) {
+        vm_relative_jump(span);
+    }
+}
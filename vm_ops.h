@@ -25,6 +25,15 @@ extern void vm_op_halt(void);
  */
 extern void vm_op_methodcall(void);
 
+/* Call a method whose code is known when the program is
+ * loaded, because the compiler has proved that the call can
+ * reach only one method.  Next word is the code address of
+ * the method (the loader resolves it from class and method index).
+ *
+ * vm_op_call_direct(addr): [arg, arg, ...,  receiver] -> [result]
+ */
+extern void vm_op_call_direct(void);
+
 /* Trampoline to a native method.
  * Wrap this inside an interpreted method
  * to handle the frame layout properly.
@@ -107,5 +116,28 @@ extern void vm_op_load_field();  // Load from field of object
 // store_field n: [value target] -> [], target.fields[n] = value
 extern void vm_op_store_field(); // Store into field of object
 
+/* Int arithmetic and comparison, for operands the compiler has
+ * proved are Int:  [a b] -> [a op b].  Unlike a call of the Int
+ * method, these build no frame and call no native method.
+ */
+extern void vm_op_int_plus();
+extern void vm_op_int_sub();
+extern void vm_op_int_mult();
+extern void vm_op_int_div();
+extern void vm_op_int_less();
+extern void vm_op_int_greater();
+extern void vm_op_int_le();
+extern void vm_op_int_ge();
+extern void vm_op_int_equals();
+
+/* Compare two Ints and jump on the result:  [a b] -> [],
+ * for conditions, which then need no Boolean object.
+ */
+extern void vm_op_jump_int_less();
+extern void vm_op_jump_int_greater();
+extern void vm_op_jump_int_le();
+extern void vm_op_jump_int_ge();
+extern void vm_op_jump_int_equals();
+extern void vm_op_jump_int_ne();
 
 #endif //TINY_VM_VM_OPS_H
@@ -9,6 +9,7 @@
 #include "builtins.h"  // For debugging only
 #include <assert.h>
 #include <stdio.h>
+#include <stdlib.h>
 #include <string.h>
 
 /* The concrete data structures live here */
@@ -116,6 +117,7 @@ void vm_roll(int n) {
 /* --------------------- Constant pool --------------- */
 
 struct constant_pool_entry {
+    char kind;   // CONST_INT, CONST_STR, or CONST_NAMED
     char* name;
     obj_ref const_object;
 };
@@ -126,34 +128,90 @@ struct constant_pool_entry {
  * Local constants are consolidated into the global pool
  * when a module is loaded into the VM, and constant
  * indexes are remapped while the module is loaded.
+ *
+ * A constant is identified by its kind and its literal, so
+ * that the Int 1 and the String "1" are different constants.
+ * The pool grows as needed (code refers to constants by index,
+ * so the entries may move), and a hash table from kind and
+ * literal to index makes each lookup take constant time.
  */
 
 /* The global pool */
-static struct constant_pool_entry vm_constant_pool[CONST_POOL_CAPACITY];
+static struct constant_pool_entry *vm_constant_pool;
+static int vm_const_capacity;
 static int vm_next_const = 1; // Skip index 0 so that it can be failure signal
 
-/* lookup_const_index("literal string") returns index
- * OR zero to indicate not present
+/* Open addressing hash table of pool indexes (0 for an empty slot),
+ * with at least twice as many slots as the pool has entries.
  */
-extern int lookup_const_index(char *literal) {
-    // We start with index 1, not 0, so that we can use 0 as failure
-    for (int i=1; i < vm_next_const; ++i) {
-        if (strcmp(literal, vm_constant_pool[i].name) == 0) {
-            return i;
+static int *const_hash_table;
+static unsigned const_hash_size;  // A power of 2
+
+static unsigned const_hash(char kind, char *literal) {
+    // FNV-1a
+    unsigned h = 2166136261u;
+    h = (h ^ (unsigned char) kind) * 16777619u;
+    for (char *c = literal; *c; ++c) {
+        h = (h ^ (unsigned char) *c) * 16777619u;
+    }
+    return h;
+}
+
+/* The slot of the constant in the hash table, or of the empty slot
+ * where it belongs
+ */
+static unsigned const_hash_slot(char kind, char *literal) {
+    unsigned mask = const_hash_size - 1;
+    unsigned slot = const_hash(kind, literal) & mask;
+    while (const_hash_table[slot]) {
+        struct constant_pool_entry *entry = &vm_constant_pool[const_hash_table[slot]];
+        if (entry->kind == kind && strcmp(entry->name, literal) == 0) {
+            break;
         }
+        slot = (slot + 1) & mask;
+    }
+    return slot;
+}
+
+static void grow_constant_pool(void) {
+    vm_const_capacity = vm_const_capacity ? 2 * vm_const_capacity : CONST_POOL_CAPACITY;
+    vm_constant_pool = realloc(vm_constant_pool,
+                               vm_const_capacity * sizeof(struct constant_pool_entry));
+    assert(vm_constant_pool);
+    free(const_hash_table);
+    const_hash_size = 2 * vm_const_capacity;
+    const_hash_table = calloc(const_hash_size, sizeof(int));
+    assert(const_hash_table);
+    for (int i = 1; i < vm_next_const; ++i) {
+        struct constant_pool_entry *entry = &vm_constant_pool[i];
+        const_hash_table[const_hash_slot(entry->kind, entry->name)] = i;
     }
-    // Not present in constant table
-    return 0;
+}
+
+/* lookup_const_index(CONST_STR, "literal string") returns index
+ * OR zero to indicate not present
+ */
+extern int lookup_const_index(char kind, char *literal) {
+    if (! const_hash_table) {
+        return 0;
+    }
+    // We start with index 1, not 0, so that we can use 0 as failure
+    return const_hash_table[const_hash_slot(kind, literal)];
 }
 
 /* create_const_value returns a positive index of the
  * entry the new constant object will have in the constant pool.
  */
-extern int create_const_value(char *literal, obj_ref value) {
+extern int create_const_value(char kind, char *literal, obj_ref value) {
+    if (vm_next_const >= vm_const_capacity) {
+        grow_constant_pool();
+    }
     int const_index = vm_next_const;
     vm_next_const += 1;
+    vm_constant_pool[const_index].kind = kind;
     vm_constant_pool[const_index].name = strdup(literal);
     vm_constant_pool[const_index].const_object = value;
+    const_hash_table[const_hash_slot(kind, literal)] = const_index;
     return const_index;
 }
 
@@ -15,7 +15,7 @@
 
 #define CODE_CAPACITY    1024  // Max # instruction words
 #define FRAME_CAPACITY   1024    // Procedure call stack words
-#define CONST_POOL_CAPACITY 128  // Constant objects, created during loading
+#define CONST_POOL_CAPACITY 128  // Initial constant objects; the pool grows
 
 /* Core definitions shared with
  * builtins.h
@@ -99,15 +99,23 @@ extern char *guess_description(vm_Word w);
  * Constant values are object references.
  */
 
-/* lookup_const_index("literal string") returns index
+/* Kinds of constant, as in the "constants" of object files,
+ * plus the named literals (nothing, true, false).
+ * A constant is identified by kind and literal.
+ */
+#define CONST_INT 'i'
+#define CONST_STR 's'
+#define CONST_NAMED '$'
+
+/* lookup_const_index(CONST_STR, "literal string") returns index
  * OR zero to indicate not present
  */
-extern int lookup_const_index(char *literal);
+extern int lookup_const_index(char kind, char *literal);
 
 /* create_const_value returns a positive index of the
  * entry the new constant object will have in the constant pool.
  */
-extern int create_const_value(char *literal, obj_ref value);
+extern int create_const_value(char kind, char *literal, obj_ref value);
 
 /* get_const_value returns an object reference corresponding
  * to the provided index.